@@ -1,28 +1,28 @@
 # app/auth.py
 
-from passlib.context import CryptContext
+import time
+from dataclasses import dataclass
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from app import models, database
+from app import models, database, passwords, cache, revocation, refresh_tokens
 from app.models import UserRole
 
 SECRET_KEY = "your_super_secret_key_change_in_production"  
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-# Hash a password
+# Hash a password (in the password pool; async routes await passwords.hash_password instead)
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return passwords.hash_password_blocking(password)
 
-# Verify a password
+# Verify a password (in the password pool; async routes await passwords.verify_and_update instead)
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.verify_blocking(plain_password, hashed_password)
 
 # Create JWT token
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -31,55 +31,142 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-# Decode JWT token
-def decode_access_token(token: str):
+# Create the access token for a user: "uid", "role" and "ver" let read-only routes skip the user lookup;
+# "fam" is the refresh token family it was issued from, so revoking the family revokes it too
+def create_user_token(user: models.User, family_id: str = None):
+    claims = {
+        "sub": user.username,
+        "uid": user.id,
+        "role": user.role.value if user.role else UserRole.USER.value,
+        "ver": user.token_version or 0,
+    }
+    if family_id is not None:
+        claims["fam"] = family_id
+    return create_access_token(data=claims)
+
+# Decode JWT token: the verified claims, or None
+def decode_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
 
-# Get current user from token
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+def decode_access_token(token: str):
+    payload = decode_token(token)
+    return None if payload is None else payload["sub"]
+
+@dataclass(frozen=True)
+class Principal:
+    """Immutable snapshot of the authenticated user, shared across requests via cache.principal_cache"""
+    id: int
+    username: str
+    role: UserRole
+    is_active: bool
+    token_version: int = 0
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    username = decode_access_token(token)
-    if username is None:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
-        raise credentials_exception
-    
-    if not user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="User account is deactivated"
+
+def _cache_principal(user: models.User, generation: int) -> Principal:
+    principal = Principal(
+        id=user.id, username=user.username, role=user.role,
+        is_active=user.is_active, token_version=user.token_version or 0
+    )
+    cache.principal_cache.set(user.id, principal, generation=generation)
+    return principal
+
+def _deactivated_exception():
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="User account is deactivated"
+    )
+
+# Get the authenticated principal: a dictionary lookup while token and user are cached
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> Principal:
+    entry = cache.token_cache.get(token)
+    if entry is None:
+        payload = decode_token(token)
+        if payload is None:
+            raise _credentials_exception()
+        generation = cache.principal_cache.generation()
+        user = db.query(models.User).filter(models.User.username == payload["sub"]).first()
+        if user is None:
+            raise _credentials_exception()
+        principal = _cache_principal(user, generation)
+        entry = (user.id, user.username, payload.get("exp"), payload.get("ver"), payload.get("fam"))
+        cache.token_cache.set(token, entry)
+    else:
+        user_id, username, expires_at, _, _ = entry
+        if expires_at is not None and expires_at <= time.time():
+            raise _credentials_exception()
+        principal = cache.principal_cache.get(user_id)
+        if principal is None:
+            # Evicted, expired or invalidated by an admin change: re-read by primary key
+            generation = cache.principal_cache.generation()
+            user = db.get(models.User, user_id)
+            if user is None or user.username != username:
+                raise _credentials_exception()
+            principal = _cache_principal(user, generation)
+
+    if not principal.is_active:
+        raise _deactivated_exception()
+    token_version, family_id = entry[3], entry[4]
+    if token_version is not None and token_version != principal.token_version:
+        # Issued before the user's tokens were revoked
+        raise _credentials_exception()
+    if family_id is not None and refresh_tokens.is_family_revoked(db, family_id):
+        raise _credentials_exception()
+    return principal
+
+# Get the principal from the token's claims alone, for read-only routes.
+# Revocation is checked against the in-memory table in app/revocation.py,
+# so a current token costs no query. Tokens issued before they carried
+# claims fall back to get_current_principal.
+def get_token_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> Principal:
+    payload = decode_token(token)
+    if payload is None:
+        raise _credentials_exception()
+    if not all(claim in payload for claim in ("uid", "role", "ver")):
+        return get_current_principal(token, db)
+    try:
+        principal = Principal(
+            id=int(payload["uid"]), username=payload["sub"], role=UserRole(payload["role"]),
+            is_active=True, token_version=int(payload["ver"])
         )
-    
+    except (TypeError, ValueError):
+        raise _credentials_exception()
+    if revocation.is_inactive(principal.id):
+        raise _deactivated_exception()
+    if revocation.is_revoked(principal.id, principal.token_version):
+        raise _credentials_exception()
+    if "fam" in payload and refresh_tokens.is_family_revoked(db, payload["fam"]):
+        raise _credentials_exception()
+    return principal
+
+# Get current user from token (the full row, for routes that need profile fields)
+def get_current_user(principal: Principal = Depends(get_current_principal), db: Session = Depends(database.get_db)):
+    user = db.get(models.User, principal.id)
+    if user is None:
+        raise _credentials_exception()
     return user
 
 # Get current user (returns username only - for backward compatibility)
 def get_current_username(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
     username = decode_access_token(token)
     if username is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return username
 
-# Role-based access control decorators
+# Role-based access control decorators (authorize from the cached principal)
 def require_role(required_role: UserRole):
-    def role_checker(current_user: models.User = Depends(get_current_user)):
+    def role_checker(current_user: Principal = Depends(get_current_principal)):
         if current_user.role.value != required_role.value:
             # Allow super admin to access everything
             if current_user.role != UserRole.SUPER_ADMIN:
@@ -90,7 +177,7 @@ def require_role(required_role: UserRole):
         return current_user
     return role_checker
 
-def require_admin(current_user: models.User = Depends(get_current_user)):
+def require_admin(current_user: Principal = Depends(get_current_principal)):
     if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -98,7 +185,7 @@ def require_admin(current_user: models.User = Depends(get_current_user)):
         )
     return current_user
 
-def require_super_admin(current_user: models.User = Depends(get_current_user)):
+def require_super_admin(current_user: Principal = Depends(get_current_principal)):
     if current_user.role != UserRole.SUPER_ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,155 @@
+# app/cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import models, schemas
+
+# In-process caches.
+# Entries are immutable snapshots (pydantic models / tuples), never ORM
+# instances, so they can be shared safely across sessions and threads.
+# Each uvicorn worker has its own cache: invalidation is precise within a
+# process and the TTL bounds staleness across processes.
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        """Token to pass to set() so a read that raced an invalidation is not stored"""
+        return self._generation
+
+    def set(self, key, value, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Product catalog cache
+
+PRODUCT_CACHE_SIZE = 4096
+PRODUCT_CACHE_TTL_SECONDS = 300
+
+product_cache = TTLCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL_SECONDS)
+
+def get_product(db: Session, product_id: int) -> Optional[schemas.ProductOut]:
+    """Cached product snapshot, or None if the product does not exist"""
+    return get_many(db, [product_id]).get(product_id)
+
+def get_many(db: Session, product_ids: Iterable[int]) -> Dict[int, schemas.ProductOut]:
+    """Cached product snapshots by id; all misses are loaded in a single query"""
+    found = {}
+    misses = []
+    for product_id in dict.fromkeys(product_ids):
+        snapshot = product_cache.get(product_id)
+        if snapshot is None:
+            misses.append(product_id)
+        else:
+            found[product_id] = snapshot
+
+    if misses:
+        generation = product_cache.generation()
+        rows = db.query(models.Product).filter(models.Product.id.in_(misses)).all()
+        for row in rows:
+            snapshot = schemas.ProductOut.model_validate(row)
+            product_cache.set(row.id, snapshot, generation=generation)
+            found[row.id] = snapshot
+    return found
+
+def invalidate_product(product_id: int):
+    product_cache.invalidate(product_id)
+
+def invalidate_on_commit(db: Session, product_id: int):
+    """Invalidate a product once the session's current transaction commits"""
+    db.info.setdefault("invalidate_products", set()).add(product_id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for product_id in session.info.pop("invalidate_products", ()):
+        product_cache.invalidate(product_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("invalidate_products", None)
+
+
+# Authenticated principal cache (see auth.get_current_principal)
+
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL_SECONDS = 30
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL_SECONDS = 300
+
+# user id -> auth.Principal (id, username, role, is_active)
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+# verified token -> (user id, username, exp): skips decoding and the username lookup
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id: int):
+    """Drop a user's principal so the next request re-reads role and active flag"""
+    principal_cache.invalidate(user_id)
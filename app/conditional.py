@@ -0,0 +1,119 @@
+# app/conditional.py
+
+import hashlib
+import random
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+from app import models
+from app.database import dialect_insert
+
+# Conditional GET support.
+# Writers bump one or more change scopes inside their transaction; readers
+# build a strong ETag and Last-Modified from those counters with a single
+# primary-key lookup and answer 304 before running the real query.
+#
+# Scopes in use:
+#   "products"           any product insert/update/delete
+#   "product:<id>"       a single product row
+#   "stock:<n>"          stock changes of any product, one of STOCK_SHARDS
+#   "product:<id>:stock" stock changes of one product
+#   "reviews"            any review change (affects rating sort)
+#   "reviews:<id>"       reviews of one product
+#
+# Stock moves on every checkout, so a single catalog-wide counter for it
+# would put one hot row back on every order (the contention flash-sale mode
+# and stock sharding remove). A stock change bumps one randomly chosen
+# counter of STOCK_SHARDS instead, and listings include all of them in the
+# ETag: any bump still changes it, and concurrent checkouts mostly write
+# different rows. A single product's page reads just its own stock counter,
+# which only that product's orders write.
+
+STOCK_SHARDS = 16
+
+def product_scopes(product_id: int):
+    return ["products", f"product:{product_id}"]
+
+def stock_scopes(product_id: int):
+    """Scopes to bump for a stock-only change (orders, holds), not product edits"""
+    return [
+        f"stock:{random.randrange(STOCK_SHARDS)}",
+        f"product:{product_id}:stock",
+    ]
+
+def catalog_read_scopes():
+    """Scopes a product listing depends on: catalog edits and everyone's stock"""
+    return ["products"] + [f"stock:{shard}" for shard in range(STOCK_SHARDS)]
+
+def product_read_scopes(product_id: int):
+    """Scopes a single product's representation depends on: its edits and its stock"""
+    return [f"product:{product_id}", f"product:{product_id}:stock"]
+
+def review_scopes(product_id: int):
+    return ["reviews", f"reviews:{product_id}"]
+
+def review_read_scopes(product_id: int):
+    """Scopes one product's reviews depend on: that product and its reviews, not the whole catalog"""
+    return [f"product:{product_id}", f"reviews:{product_id}"]
+
+def bump(db: Session, *scopes: str):
+    """Increment the version of each scope; caller commits"""
+    if not scopes:
+        return
+    now = datetime.utcnow()
+    insert = dialect_insert(db.get_bind())
+    stmt = insert(models.ChangeCounter).values(
+        # Sorted, so concurrent bumps lock their rows in the same order
+        [{"scope": scope, "version": 1, "updated_at": now} for scope in sorted(set(scopes))]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["scope"],
+        set_={"version": models.ChangeCounter.version + 1, "updated_at": stmt.excluded.updated_at}
+    )
+    db.execute(stmt)
+
+def _validators(db: Session, scopes: Iterable[str], key: str = ""):
+    scopes = sorted(set(scopes))
+    rows = {
+        row.scope: row for row in db.query(models.ChangeCounter).filter(
+            models.ChangeCounter.scope.in_(scopes)
+        ).all()
+    }
+    parts = [f"{scope}={rows[scope].version if scope in rows else 0}" for scope in scopes]
+    digest = hashlib.sha1(("|".join(parts) + "#" + key).encode()).hexdigest()[:20]
+    last_modified = max((row.updated_at for row in rows.values()), default=None)
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+    return f'"{digest}"', last_modified
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def check(request: Request, response: Response, db: Session, scopes: Iterable[str], key: str = "") -> Optional[Response]:
+    """Return a 304 response if the client's copy is current, else set ETag/Last-Modified on `response`.
+
+    `key` distinguishes representations built from the same scopes (e.g. the query string).
+    """
+    etag, last_modified = _validators(db, scopes, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    fresh = False
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, etag)
+    elif if_modified_since and last_modified is not None:
+        try:
+            fresh = last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            fresh = False
+
+    if fresh:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -1,6 +1,10 @@
+from datetime import datetime
+from typing import Callable, Optional
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from app import models, schemas, auth
+from sqlalchemy import and_, case, insert, update, func as db_func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app import models, schemas, auth, pagination, search, cache, conditional, images, storage, inventory, flash_sale, stock_shards, order_history, revocation
+from app.database import dialect_insert
 
 # User
 def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
@@ -17,6 +21,13 @@ def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replace a user's stored hash (rehash-on-login after a cost factor change)"""
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}, synchronize_session=False
+    )
+    db.commit()
+
 
 
 def get_all_users(db: Session):
@@ -31,6 +42,8 @@ def delete_user(db: Session, user_id: int):
         return False
     db.delete(db_user)
     db.commit()
+    cache.invalidate_user(user_id)
+    revocation.forget_user(user_id)
     return True
 
 
@@ -38,7 +51,11 @@ def delete_user(db: Session, user_id: int):
 # Product
 def create_product(db: Session, product: schemas.ProductCreate):
     db_product = models.Product(**product.dict())
+    images.attach_variants(db, db_product)
     db.add(db_product)
+    db.flush()
+    search.index_product(db, db_product)
+    conditional.bump(db, *conditional.product_scopes(db_product.id))
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -46,142 +63,381 @@ def create_product(db: Session, product: schemas.ProductCreate):
 def get_all_products(db: Session):
     return db.query(models.Product).all()
 
+def _product_sort_key(sort: schemas.ProductSort):
+    """Return (leading sort expression, descending) for a catalog sort key"""
+    if sort == schemas.ProductSort.PRICE_ASC:
+        return models.Product.price, False
+    if sort == schemas.ProductSort.PRICE_DESC:
+        return models.Product.price, True
+    if sort == schemas.ProductSort.NEWEST:
+        return None, True
+    if sort == schemas.ProductSort.RATING:
+        return models.Product.rating_avg, True
+    return models.Product.name, False
+
+def get_products(
+    db: Session,
+    category: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    in_stock: bool = None,
+    is_active: bool = True,
+    sort: schemas.ProductSort = schemas.ProductSort.NAME,
+    cursor: str = None,
+    limit: int = 50
+):
+    """Filtered, sorted catalog page. Returns (products, next_cursor)."""
+    sort_expr, descending = _product_sort_key(sort)
+    columns = [models.Product.id] if sort_expr is None else [sort_expr, models.Product.id]
+
+    query = db.query(models.Product, *columns)
+    if is_active is not None:
+        query = query.filter(models.Product.is_active == is_active)
+    if category:
+        query = query.filter(models.Product.category == category)
+    if min_price is not None:
+        query = query.filter(models.Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(models.Product.price <= max_price)
+    if in_stock is True:
+        query = query.filter(models.Product.quantity > 0)
+    elif in_stock is False:
+        query = query.filter(models.Product.quantity <= 0)
+
+    after = None
+    if cursor:
+        token = pagination.decode_cursor(cursor)
+        if token.get("sort") != sort.value:
+            raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+        after = token.get("key")
+
+    query = pagination.apply_keyset(query, columns, after=after, descending=descending)
+    rows, has_more = pagination.split_page(query.limit(limit + 1).all(), limit)
+
+    next_cursor = None
+    if has_more:
+        next_cursor = pagination.encode_cursor({"sort": sort.value, "key": list(rows[-1][1:])})
+    return [row[0] for row in rows], next_cursor
+
 # Cart
+def _upsert_cart_items(db: Session, user_id: int, quantities: dict, increment: bool):
+    """One multi-row upsert of {product_id: quantity}; adds to or replaces existing quantities"""
+    insert = dialect_insert(db.get_bind())
+    stmt = insert(models.CartItem).values([
+        {"user_id": user_id, "product_id": product_id, "quantity": quantity}
+        for product_id, quantity in quantities.items()
+    ])
+    quantity = models.CartItem.quantity + stmt.excluded.quantity if increment else stmt.excluded.quantity
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "product_id"],
+        set_={"quantity": quantity}
+    ).returning(models.CartItem)
+    return db.scalars(stmt, execution_options={"populate_existing": True}).all()
+
 def add_to_cart(db: Session, user_id: int, item: schemas.CartItemCreate):
-    # Check if product already exists in cart
-    existing_item = db.query(models.CartItem).filter(
-        models.CartItem.user_id == user_id,
-        models.CartItem.product_id == item.product_id
-    ).first()
-    
-    if existing_item:
-        # Product already in cart, update quantity by adding the new quantity
-        existing_item.quantity += item.quantity
+    """Add to the user's cart in one statement: insert, or add to the existing row's quantity"""
+    db_item = _upsert_cart_items(db, user_id, {item.product_id: item.quantity}, increment=True)[0]
+    if item.quantity < 0:
+        inventory.trim_to_cart(db, user_id, [item.product_id])
+    db.commit()
+    return db_item
+
+def _fold_cart_operations(operations):
+    """Reduce an ordered operation list to one net change per product.
+
+    Returns {product_id: (kind, quantity)} with kind "add" (relative to the
+    stored quantity), "set" (absolute) or "remove".
+    """
+    net = {}
+    for operation in operations:
+        kind, quantity = net.get(operation.product_id, ("add", 0))
+        if operation.op == schemas.CartOperationType.REMOVE:
+            net[operation.product_id] = ("remove", 0)
+        elif operation.op == schemas.CartOperationType.SET:
+            net[operation.product_id] = ("set", operation.quantity)
+        elif kind == "remove":
+            net[operation.product_id] = ("set", operation.quantity)
+        else:
+            net[operation.product_id] = (kind, quantity + operation.quantity)
+    return net
+
+def apply_cart_operations(db: Session, user_id: int, operations):
+    """Apply a batch of cart operations in one transaction with one statement per kind.
+
+    Raises 404 if an add/set names a product that does not exist.
+    """
+    net = _fold_cart_operations(operations)
+    adds = {pid: quantity for pid, (kind, quantity) in net.items() if kind == "add" and quantity != 0}
+    sets = {pid: quantity for pid, (kind, quantity) in net.items() if kind == "set" and quantity > 0}
+    removes = [pid for pid, (kind, quantity) in net.items() if kind == "remove" or (kind == "set" and quantity <= 0)]
+
+    wanted = set(adds) | set(sets)
+    if wanted:
+        found = {pid for (pid,) in db.query(models.Product.id).filter(models.Product.id.in_(wanted))}
+        missing = sorted(wanted - found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(map(str, missing))}")
+
+    try:
+        if removes:
+            db.query(models.CartItem).filter(
+                models.CartItem.user_id == user_id,
+                models.CartItem.product_id.in_(removes)
+            ).delete(synchronize_session=False)
+        if sets:
+            _upsert_cart_items(db, user_id, sets, increment=False)
+        if adds:
+            _upsert_cart_items(db, user_id, adds, increment=True)
+            # A negative add can take a line to zero or below
+            db.query(models.CartItem).filter(
+                models.CartItem.user_id == user_id,
+                models.CartItem.product_id.in_(list(adds)),
+                models.CartItem.quantity <= 0
+            ).delete(synchronize_session=False)
+        # Lowered or removed lines give back the stock they held
+        inventory.trim_to_cart(db, user_id, list(net))
         db.commit()
-        db.refresh(existing_item)
-        return existing_item
-    else:
-        # Create new cart item
-        db_item = models.CartItem(
-            user_id=user_id, 
-            product_id=item.product_id, 
-            quantity=item.quantity
-        )
-        db.add(db_item)
-        try:
-            db.commit()
-            db.refresh(db_item)
-            return db_item
-        except Exception as e:
-            db.rollback()
-            raise e
+    except Exception:
+        db.rollback()
+        raise
 
 def get_cart_items(db: Session, user_id: int):
     return db.query(models.CartItem).filter(models.CartItem.user_id == user_id).all()
 
-def remove_cart_item(db: Session, cart_item_id: int):
-    db_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
+def get_cart(db: Session, user_id: int):
+    """Cart lines joined to their products, with availability and cart totals, in one query.
+
+    Each row has CartItem, Product, available, item_count and subtotal
+    (the totals are window aggregates, identical on every row). A line is
+    available if unreserved stock plus the user's own hold covers it.
+    """
+    return db.query(
+        models.CartItem,
+        models.Product,
+        and_(
+            models.Product.is_active.is_not(False),
+            models.Product.quantity - models.Product.reserved_quantity
+            + db_func.coalesce(models.Reservation.quantity, 0) >= models.CartItem.quantity
+        ).label("available"),
+        db_func.sum(models.CartItem.quantity).over().label("item_count"),
+        db_func.sum(models.CartItem.quantity * models.Product.price).over().label("subtotal")
+    ).join(
+        models.Product, models.Product.id == models.CartItem.product_id
+    ).outerjoin(
+        models.Reservation, and_(
+            models.Reservation.user_id == models.CartItem.user_id,
+            models.Reservation.product_id == models.CartItem.product_id
+        )
+    ).filter(
+        models.CartItem.user_id == user_id
+    ).order_by(models.CartItem.id).all()
+
+def get_cart_summary(db: Session, user_id: int):
+    """Line count, item count and subtotal of a cart from a single aggregate query"""
+    return db.query(
+        db_func.count(models.CartItem.id).label("line_count"),
+        db_func.coalesce(db_func.sum(models.CartItem.quantity), 0).label("item_count"),
+        db_func.coalesce(db_func.sum(models.CartItem.quantity * models.Product.price), 0.0).label("subtotal")
+    ).join(
+        models.Product, models.Product.id == models.CartItem.product_id
+    ).filter(models.CartItem.user_id == user_id).one()
+
+def _own_cart_item(db: Session, user_id: int, cart_item_id: int):
+    return db.query(models.CartItem).filter(
+        models.CartItem.id == cart_item_id,
+        models.CartItem.user_id == user_id
+    ).first()
+
+def remove_cart_item(db: Session, user_id: int, cart_item_id: int):
+    db_item = _own_cart_item(db, user_id, cart_item_id)
     if not db_item:
         return False
+    product_id = db_item.product_id
     db.delete(db_item)
+    db.flush()
+    inventory.trim_to_cart(db, user_id, [product_id])
     db.commit()
     return True
 
-def update_cart_item_quantity(db: Session, cart_item_id: int, quantity: int):
-    db_item = db.query(models.CartItem).filter(models.CartItem.id == cart_item_id).first()
+def update_cart_item_quantity(db: Session, user_id: int, cart_item_id: int, quantity: int):
+    db_item = _own_cart_item(db, user_id, cart_item_id)
     if not db_item:
         return None
+    product_id = db_item.product_id
     if quantity <= 0:
         # Remove item if quantity is 0 or negative
         db.delete(db_item)
-        db.commit()
-        return None
+        db_item = None
     else:
         # Update quantity as requested
         db_item.quantity = quantity
-        db.commit()
+    db.flush()
+    inventory.trim_to_cart(db, user_id, [product_id])
+    db.commit()
+    if db_item is not None:
         db.refresh(db_item)
-        return db_item
+    return db_item
 
 def clear_cart(db: Session, user_id: int):
     db.query(models.CartItem).filter(models.CartItem.user_id == user_id).delete()
+    inventory.release(db, user_id)
     db.commit()
     return True
 
-def cleanup_duplicate_cart_items(db: Session, user_id: int):
-    """Remove duplicate cart items, keeping only the one with highest quantity"""
-    # Get all cart items for the user
-    cart_items = db.query(models.CartItem).filter(models.CartItem.user_id == user_id).all()
-    
-    # Group by product_id
-    product_groups = {}
-    for item in cart_items:
-        if item.product_id not in product_groups:
-            product_groups[item.product_id] = []
-        product_groups[item.product_id].append(item)
-    
-    removed_count = 0
-    
-    # For each product, keep only one item (merge quantities)
-    for product_id, items in product_groups.items():
-        if len(items) > 1:
-            # Calculate total quantity
-            total_quantity = sum(item.quantity for item in items)
-            
-            # Keep the first item, update its quantity
-            keep_item = items[0]
-            keep_item.quantity = total_quantity
-            
-            # Delete the rest
-            for item in items[1:]:
-                db.delete(item)
-                removed_count += 1
-    
-    db.commit()
-    return removed_count
-
 
 # Order
-def create_order(db: Session, user_id: int, order_data: schemas.OrderCreate):
-    # Create the order
-    db_order = models.Order(user_id=user_id, total_price=order_data.total_price)
+def _insert_order(db: Session, user_id: int, lines, shipping_address=None):
+    """Insert an order, its items (one executemany) and its history row from (product_id, quantity, price) lines; caller commits"""
+    db_order = models.Order(
+        user_id=user_id,
+        total_price=round(sum(quantity * price for _, quantity, price in lines), 2),
+        shipping_address=shipping_address,
+        # Set here rather than by the server default, which older databases lack;
+        # the history row and the keyset listings need it
+        created_at=datetime.utcnow()
+    )
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    # Create order items
+    db.flush()
+    db.execute(insert(models.OrderItem), [
+        {"order_id": db_order.id, "product_id": product_id, "quantity": quantity, "price": price}
+        for product_id, quantity, price in lines
+    ])
+    order_history.record(db, db_order, lines)
+    return db_order
+
+def get_order_with_items(db: Session, order_id: int):
+    return db.query(models.Order).options(
+        joinedload(models.Order.user),
+        selectinload(models.Order.order_items).joinedload(models.OrderItem.product)
+    ).filter(models.Order.id == order_id).first()
+
+def _order_quantities(order_data: schemas.OrderCreate) -> dict:
+    quantities = {}
     for item in order_data.items:
-        db_order_item = models.OrderItem(
-            order_id=db_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price=item.price
-        )
-        db.add(db_order_item)
-    
-    db.commit()
-    db.refresh(db_order)
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    if not quantities or min(quantities.values()) <= 0:
+        raise HTTPException(status_code=400, detail="Order must contain items with positive quantities")
+    return quantities
+
+def _place_order(db: Session, user_id: int, quantities: dict, shipping_address=None):
+    """Price, reserve stock and insert an order; caller commits"""
+    prices = dict(db.query(models.Product.id, models.Product.price).filter(models.Product.id.in_(list(quantities))))
+    missing = sorted(set(quantities) - set(prices))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(map(str, missing))}")
+    inventory.commit_stock(db, user_id, quantities)
+    return _insert_order(
+        db, user_id,
+        [(product_id, quantity, prices[product_id]) for product_id, quantity in quantities.items()],
+        shipping_address
+    )
+
+def _cart_lines(db: Session, user_id: int):
+    return db.query(
+        models.CartItem.id, models.CartItem.product_id, models.CartItem.quantity,
+        models.Product.price, models.Product.flash_sale
+    ).join(
+        models.Product, models.Product.id == models.CartItem.product_id
+    ).filter(
+        models.CartItem.user_id == user_id
+    ).order_by(models.CartItem.id).all()
+
+def _checkout_lines(db: Session, user_id: int, lines, shipping_address=None):
+    """Reserve stock, insert the order and delete the given cart lines; caller commits"""
+    if not lines:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    inventory.commit_stock(db, user_id, {line.product_id: line.quantity for line in lines})
+    db_order = _insert_order(
+        db, user_id,
+        [(line.product_id, line.quantity, line.price) for line in lines],
+        shipping_address
+    )
+    db.query(models.CartItem).filter(
+        models.CartItem.user_id == user_id,
+        models.CartItem.id.in_([line.id for line in lines])
+    ).delete(synchronize_session=False)
     return db_order
 
+def order_recorder(record: Callable):
+    """A before_commit hook for create_order/checkout_cart that passes the order response to an
+    idempotency `record(session, result)` callback (see app/idempotency.py)"""
+    return lambda session, order_id: record(
+        session, schemas.OrderOut.model_validate(get_order_with_items(session, order_id))
+    )
+
+def _with_hook(place: Callable, before_commit: Optional[Callable]):
+    """Wrap `place(session) -> order` so `before_commit(session, order_id)` runs in the same transaction"""
+    def run(session: Session) -> int:
+        order_id = place(session).id
+        if before_commit is not None:
+            before_commit(session, order_id)
+        return order_id
+    return run
+
+def create_order(db: Session, user_id: int, order_data: schemas.OrderCreate, before_commit: Optional[Callable] = None):
+    """Place an order in one transaction, priced from current product prices and reserving stock.
+
+    `before_commit(session, order_id)` runs inside that transaction.
+    """
+    quantities = _order_quantities(order_data)
+    place = _with_hook(lambda session: _place_order(
+        session, user_id, quantities, order_data.shipping_address
+    ), before_commit)
+    flash_ids = [pid for (pid,) in db.query(models.Product.id).filter(
+        models.Product.id.in_(list(quantities)), models.Product.flash_sale.is_(True)
+    )]
+    if flash_ids:
+        # Hot product: queue behind the SKU's worker, which commits orders in batches
+        return get_order_with_items(db, flash_sale.submit(min(flash_ids), place))
+
+    try:
+        order_id = place(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return get_order_with_items(db, order_id)
+
+def checkout_cart(db: Session, user_id: int, shipping_address=None, before_commit: Optional[Callable] = None):
+    """Turn the user's cart into an order in a single transaction.
+
+    One joined read prices the cart, the user's stock holds are confirmed
+    (one conditional UPDATE, see inventory.commit_stock), the order items
+    go in with one executemany and the cart lines are deleted before the
+    only commit. Carts containing a flash-sale product are checked out by
+    that product's queue worker instead (see app/flash_sale.py).
+    `before_commit(session, order_id)` runs inside that transaction.
+    """
+    lines = _cart_lines(db, user_id)
+    if not lines:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+
+    flash_ids = [line.product_id for line in lines if line.flash_sale]
+    if flash_ids:
+        # The worker re-reads the cart in its own transaction
+        order_id = flash_sale.submit(min(flash_ids), _with_hook(lambda session: _checkout_lines(
+            session, user_id, _cart_lines(session, user_id), shipping_address
+        ), before_commit))
+        return get_order_with_items(db, order_id)
+
+    try:
+        order_id = _with_hook(lambda session: _checkout_lines(
+            session, user_id, lines, shipping_address
+        ), before_commit)(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return get_order_with_items(db, order_id)
+
 def get_all_orders(db: Session):
     return db.query(models.Order).all()
 
 def get_user_orders(db: Session, user_id: int):
-    orders = db.query(models.Order).filter(models.Order.user_id == user_id).all()
-    
-    # Manually load relationships for each order
-    for order in orders:
-        # Load user
-        order.user = db.query(models.User).filter(models.User.id == order.user_id).first()
-        # Load order items
-        order.order_items = db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).all()
-        # Load products for each order item
-        for item in order.order_items:
-            item.product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-    
-    return orders
-
-
+    return db.query(models.Order).options(
+        joinedload(models.Order.user),
+        selectinload(models.Order.order_items).joinedload(models.OrderItem.product)
+    ).filter(models.Order.user_id == user_id).all()
 
 def get_product_by_id(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
@@ -190,9 +446,38 @@ def update_product(db: Session, product_id: int, product: schemas.ProductCreate)
     db_product = get_product_by_id(db, product_id)
     if not db_product:
         return None
-    for key, value in product.dict().items():
+    old_image = db_product.image
+    values = product.dict()
+    quantity = values.pop("quantity")
+    for key, value in values.items():
         setattr(db_product, key, value)
+    if quantity != db_product.quantity:
+        # Only on a real change, so an edit does not overwrite stock sold since the form was loaded;
+        # through stock_shards so a sharded product's shards are rewritten to match
+        stock_shards.set_quantity(db, product_id, quantity)
+    images.attach_variants(db, db_product)
+    search.index_product(db, db_product)
+    conditional.bump(db, *conditional.product_scopes(product_id))
+    db.commit()
+    cache.invalidate_product(product_id)
+    if old_image != db_product.image:
+        storage.release(db, [old_image])
+    db.refresh(db_product)
+    return db_product
+
+def update_product_image(db: Session, product_id: int, image: str):
+    """Point a product at a new image, leaving its other fields (and stock) alone"""
+    db_product = get_product_by_id(db, product_id)
+    if not db_product:
+        return None
+    old_image = db_product.image
+    db_product.image = image
+    images.attach_variants(db, db_product)
+    conditional.bump(db, *conditional.product_scopes(product_id))
     db.commit()
+    cache.invalidate_product(product_id)
+    if old_image != image:
+        storage.release(db, [old_image])
     db.refresh(db_product)
     return db_product
 
@@ -200,10 +485,88 @@ def delete_product(db: Session, product_id: int):
     db_product = get_product_by_id(db, product_id)
     if not db_product:
         return False
+    image = db_product.image
+    search.remove_product(db, product_id)
+    conditional.bump(db, *conditional.product_scopes(product_id))
     db.delete(db_product)
     db.commit()
+    cache.invalidate_product(product_id)
+    storage.release(db, [image])
     return True
 
+
+# Review rating aggregates
+RATING_COLUMNS = {star: getattr(models.Product, f"rating_{star}") for star in range(1, 6)}
+
+def apply_review_rating_change(db: Session, product_id: int, old_rating: int = None, new_rating: int = None):
+    """Move one review's contribution in the product's rating aggregates.
+
+    A rating of None means the review does not count (absent or unapproved).
+    Runs as a single UPDATE in the caller's transaction; caller commits.
+    """
+    if old_rating == new_rating:
+        return
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    values = {
+        models.Product.rating_count: models.Product.rating_count + count_delta,
+        models.Product.rating_sum: models.Product.rating_sum + sum_delta,
+        models.Product.rating_avg: case(
+            (models.Product.rating_count + count_delta > 0,
+             (models.Product.rating_sum + sum_delta) * 1.0 / (models.Product.rating_count + count_delta)),
+            else_=0.0
+        ),
+    }
+    if old_rating is not None:
+        values[RATING_COLUMNS[old_rating]] = RATING_COLUMNS[old_rating] - 1
+    if new_rating is not None:
+        values[RATING_COLUMNS[new_rating]] = RATING_COLUMNS[new_rating] + 1
+    db.execute(
+        update(models.Product).where(models.Product.id == product_id).values(values),
+        execution_options={"synchronize_session": False}
+    )
+    conditional.bump(db, *conditional.product_scopes(product_id), *conditional.review_scopes(product_id))
+    cache.invalidate_on_commit(db, product_id)
+
+def rebuild_rating_aggregates(db: Session, product_id: int = None):
+    """Recompute rating aggregates from approved reviews (repairs drift). Returns products updated."""
+    stats_query = db.query(
+        models.Review.product_id,
+        models.Review.rating,
+        db_func.count(models.Review.id)
+    ).filter(models.Review.is_approved == True)
+    products_query = db.query(models.Product.id)
+    if product_id is not None:
+        stats_query = stats_query.filter(models.Review.product_id == product_id)
+        products_query = products_query.filter(models.Product.id == product_id)
+
+    histograms = {}
+    for review_product_id, rating, count in stats_query.group_by(models.Review.product_id, models.Review.rating):
+        if rating in RATING_COLUMNS:
+            histograms.setdefault(review_product_id, {})[rating] = count
+
+    rows = []
+    for (pid,) in products_query:
+        histogram = histograms.get(pid, {})
+        count = sum(histogram.values())
+        total = sum(star * n for star, n in histogram.items())
+        row = {
+            "id": pid,
+            "rating_count": count,
+            "rating_sum": total,
+            "rating_avg": total / count if count else 0.0,
+        }
+        row.update({f"rating_{star}": histogram.get(star, 0) for star in RATING_COLUMNS})
+        rows.append(row)
+
+    if rows:
+        db.execute(update(models.Product), rows)
+        conditional.bump(db, "products", "reviews")
+    db.commit()
+    for row in rows:
+        cache.invalidate_product(row["id"])
+    return len(rows)
+
 def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
     db_user = get_user_by_id(db, user_id)
     if not db_user:
@@ -20,3 +20,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def dialect_insert(bind):
+    """INSERT construct supporting ON CONFLICT for the active backend (SQLite or PostgreSQL)"""
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
@@ -0,0 +1,177 @@
+# app/flash_sale.py
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Callable, Dict
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from app import database, conditional
+
+# Flash-sale mode: serialized, batched checkout for hot products.
+# When Product.flash_sale is set, every order touching that product is
+# handed to a per-SKU worker thread instead of writing from the request
+# thread. The worker drains its queue in batches and runs each order in a
+# SAVEPOINT inside one transaction, so a batch of N checkouts costs one
+# commit and the hot row has a single writer; an order that fails (e.g.
+# out of stock) rolls back only its own savepoint. Each waiting request
+# gets its own result or error back through a Future.
+#
+# Queues are per process: with several workers each process serializes
+# its own share, and the conditional stock UPDATE keeps them correct.
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 50
+# How long the worker waits for more orders to join a batch
+BATCH_WINDOW_SECONDS = 0.005
+# How long a request waits in the queue before giving up with 503
+QUEUE_TIMEOUT_SECONDS = 10.0
+# Workers exit after this long without orders and restart on demand
+IDLE_SECONDS = 30.0
+
+
+@dataclass
+class _Job:
+    work: Callable[[Session], int]
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class SkuQueue:
+    def __init__(self, product_id: int):
+        self.product_id = product_id
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.batches = 0
+        self.orders = 0
+        self.failed = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.total_wait_seconds = 0.0
+
+    def stats(self) -> dict:
+        processed = self.orders + self.failed
+        return {
+            "product_id": self.product_id,
+            "queue_depth": self.jobs.qsize(),
+            "worker_running": self.thread is not None,
+            "batches": self.batches,
+            "orders": self.orders,
+            "failed": self.failed,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(processed / self.batches, 2) if self.batches else 0.0,
+            "avg_queue_wait_ms": round(1000 * self.total_wait_seconds / processed, 2) if processed else 0.0,
+        }
+
+
+_lock = threading.Lock()
+_queues: Dict[int, SkuQueue] = {}
+
+
+def submit(product_id: int, work: Callable[[Session], int]) -> int:
+    """Run `work(session)` on the product's queue worker and return its result (an order id).
+
+    `work` must not commit; the worker commits the whole batch. Errors raised
+    by `work` (such as a 409 for missing stock) are re-raised here.
+    """
+    job = _Job(work)
+    with _lock:
+        sku_queue = _queues.get(product_id)
+        if sku_queue is None:
+            sku_queue = _queues[product_id] = SkuQueue(product_id)
+        if sku_queue.thread is None:
+            sku_queue.thread = threading.Thread(
+                target=_worker, args=(sku_queue,), name=f"flash-sale-{product_id}", daemon=True
+            )
+            sku_queue.thread.start()
+        # Enqueue under the lock so an idle worker cannot exit past this job
+        sku_queue.jobs.put(job)
+
+    try:
+        return job.future.result(timeout=QUEUE_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        if job.future.cancel():
+            raise HTTPException(status_code=503, detail="Checkout queue is busy, please retry")
+        # Already running: it will finish shortly, and its outcome is the answer
+        return job.future.result()
+
+def _worker(sku_queue: SkuQueue):
+    while True:
+        try:
+            first = sku_queue.jobs.get(timeout=IDLE_SECONDS)
+        except queue.Empty:
+            with _lock:
+                if sku_queue.jobs.empty():
+                    sku_queue.thread = None
+                    return
+            continue
+
+        batch = [first]
+        deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the window, still take whatever is already queued
+                if remaining > 0:
+                    batch.append(sku_queue.jobs.get(timeout=remaining))
+                else:
+                    batch.append(sku_queue.jobs.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _run_batch(sku_queue, batch)
+        except Exception:
+            logger.exception("Flash-sale batch for product %s failed", sku_queue.product_id)
+
+def _run_batch(sku_queue: SkuQueue, batch):
+    jobs = [job for job in batch if job.future.set_running_or_notify_cancel()]
+    if not jobs:
+        return
+    started = time.monotonic()
+    outcomes = []
+    db = database.SessionLocal()
+    try:
+        # Write first so the transaction is open before the first SAVEPOINT
+        # (with SQLite, releasing a savepoint that began the transaction commits it)
+        conditional.bump(db, *conditional.stock_scopes(sku_queue.product_id))
+        for job in jobs:
+            savepoint = db.begin_nested()
+            try:
+                result = job.work(db)
+                savepoint.commit()
+                outcomes.append((job, result, None))
+            except Exception as exc:
+                savepoint.rollback()
+                outcomes.append((job, None, exc))
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_exception(exc)
+        raise
+    finally:
+        db.close()
+
+    for job, result, exc in outcomes:
+        if exc is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(exc)
+
+    with _lock:
+        sku_queue.batches += 1
+        sku_queue.orders += sum(1 for _, _, exc in outcomes if exc is None)
+        sku_queue.failed += sum(1 for _, _, exc in outcomes if exc is not None)
+        sku_queue.last_batch_size = len(jobs)
+        sku_queue.max_batch_size = max(sku_queue.max_batch_size, len(jobs))
+        sku_queue.total_wait_seconds += sum(started - job.enqueued_at for job in jobs)
+
+def stats() -> list:
+    with _lock:
+        return [sku_queue.stats() for sku_queue in _queues.values()]
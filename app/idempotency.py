@@ -0,0 +1,217 @@
+# app/idempotency.py
+
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from app import models
+from app.database import dialect_insert
+
+# Idempotency-Key support for non-idempotent POSTs (placing orders).
+# The first request with a key claims it with an INSERT ... ON CONFLICT DO
+# NOTHING on (user_id, scope, key), runs, and stores its serialized response
+# in the same transaction as its own writes, so the order and the completed
+# key commit together.
+# A retry with the same key and body gets the stored response back without
+# touching the order tables; a duplicate that arrives while the first is
+# still running waits for it instead of executing again. Failed requests
+# release their claim so the client can retry. Keys expire after KEY_TTL:
+# an expired key counts as absent at once, and the reservation sweeper
+# (app/inventory.py) deletes expired rows in batches.
+#
+# A claim is identified by its created_at as well as its key: a claim left
+# in progress for STALE_CLAIM is taken over by deleting exactly that claim,
+# so of several waiters only one takes over, and a request that outlives its
+# claim cannot complete or release the claim that replaced it.
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+KEY_TTL = timedelta(hours=24)
+# How long a duplicate waits for the in-flight request before giving up with 409
+WAIT_SECONDS = 10.0
+# A claim still in progress after this long is assumed abandoned (worker died).
+# Far longer than any request runs, so a slow request is never run twice.
+STALE_CLAIM = timedelta(minutes=15)
+SWEEP_BATCH_SIZE = 500
+
+# Wakes waiters in this process as soon as the request they wait on finishes;
+# waiters in other processes fall back to polling the table
+_finished = threading.Condition()
+
+
+def fingerprint(scope: str, payload) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{scope}\n{body}".encode()).hexdigest()
+
+def _claim(db: Session, user_id: int, scope: str, key: str, request_fingerprint: str) -> Optional[datetime]:
+    """Try to take the key; returns the claim's created_at if this request owns it and should execute"""
+    now = datetime.utcnow()
+    # An expired row for this key would still block the insert
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.scope == scope,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.expires_at <= now
+    ).delete(synchronize_session=False)
+    insert = dialect_insert(db.get_bind())
+    claimed = db.execute(
+        insert(models.IdempotencyKey).values(
+            user_id=user_id,
+            scope=scope,
+            key=key,
+            fingerprint=request_fingerprint,
+            completed=False,
+            created_at=now,
+            expires_at=now + KEY_TTL
+        ).on_conflict_do_nothing(
+            index_elements=["user_id", "scope", "key"]
+        ).returning(models.IdempotencyKey.id)
+    ).first()
+    db.commit()
+    return now if claimed is not None else None
+
+def _lookup(db: Session, user_id: int, scope: str, key: str) -> Optional[models.IdempotencyKey]:
+    db.expire_all()
+    return db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.scope == scope,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.expires_at > datetime.utcnow()
+    ).first()
+
+def _own_claim(user_id: int, scope: str, key: str, claimed_at: datetime):
+    return (
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.scope == scope,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.created_at == claimed_at
+    )
+
+def _release(db: Session, user_id: int, scope: str, key: str, claimed_at: datetime):
+    """Drop the claim made at `claimed_at` if it is still in progress"""
+    db.rollback()
+    db.query(models.IdempotencyKey).filter(
+        *_own_claim(user_id, scope, key, claimed_at),
+        models.IdempotencyKey.completed.is_(False)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+def _replay(record: models.IdempotencyKey) -> JSONResponse:
+    return JSONResponse(
+        status_code=record.response_status,
+        content=json.loads(record.response_body),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def _wait_for(db: Session, user_id: int, scope: str, key: str) -> Optional[models.IdempotencyKey]:
+    """Wait for an in-flight request with the same key; returns its record, or None if the key was released"""
+    deadline = time.monotonic() + WAIT_SECONDS
+    delay = 0.02
+    while True:
+        record = _lookup(db, user_id, scope, key)
+        if record is None or record.completed:
+            return record
+        if datetime.utcnow() - record.created_at > STALE_CLAIM:
+            # The first request failed without releasing (its worker died): drop that claim
+            _release(db, user_id, scope, key, record.created_at)
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        with _finished:
+            _finished.wait(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+def _no_record(session: Session, result):
+    pass
+
+def _complete(session: Session, user_id: int, scope: str, key: str, claimed_at: datetime, status_code: int, result) -> int:
+    return session.query(models.IdempotencyKey).filter(
+        *_own_claim(user_id, scope, key, claimed_at),
+        models.IdempotencyKey.completed.is_(False)
+    ).update({
+        models.IdempotencyKey.completed: True,
+        models.IdempotencyKey.response_status: status_code,
+        models.IdempotencyKey.response_body: json.dumps(jsonable_encoder(result)),
+    }, synchronize_session=False)
+
+def execute(db: Session, user_id: int, scope: str, key: Optional[str], payload, handler: Callable, status_code: int = 200):
+    """Run `handler(record)` at most once per (user, scope, key) and replay its response for retries.
+
+    The handler calls `record(session, result)` in the transaction that
+    makes its writes, before that transaction commits; the completed key is
+    written there, so a crash cannot leave the work done and the key still
+    claimed. Without a key `record` does nothing. Results are serialized
+    with jsonable_encoder; replays return them as-is.
+    """
+    if key is None:
+        return handler(_no_record)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+    request_fingerprint = fingerprint(scope, payload)
+    while True:
+        claimed_at = _claim(db, user_id, scope, key, request_fingerprint)
+        if claimed_at is not None:
+            break
+        record = _lookup(db, user_id, scope, key)
+        if record is not None and record.fingerprint != request_fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{HEADER} was already used for a different request"
+            )
+        if record is not None and not record.completed:
+            record = _wait_for(db, user_id, scope, key)
+            if record is None:
+                # The first request failed or its claim went stale: try to claim again
+                continue
+        if record is not None:
+            return _replay(record)
+
+    recorded = []
+
+    def record(session: Session, result):
+        if not _complete(session, user_id, scope, key, claimed_at, status_code, result):
+            # Taken over as stale: roll the work back rather than commit it twice
+            raise HTTPException(status_code=409, detail=f"The claim on this {HEADER} was lost, please retry")
+        recorded.append(True)
+
+    try:
+        result = handler(record)
+    except BaseException:
+        _release(db, user_id, scope, key, claimed_at)
+        with _finished:
+            _finished.notify_all()
+        raise
+
+    if not recorded:
+        # A handler without writes of its own: complete the key now
+        _complete(db, user_id, scope, key, claimed_at, status_code, result)
+        db.commit()
+    with _finished:
+        _finished.notify_all()
+    return jsonable_encoder(result)
+
+def delete_expired(db: Session, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Delete expired keys of all users in batches of `batch_size`; returns how many were deleted"""
+    deleted = 0
+    while True:
+        expired_ids = db.query(models.IdempotencyKey.id).filter(
+            models.IdempotencyKey.expires_at <= datetime.utcnow()
+        ).order_by(models.IdempotencyKey.expires_at).limit(batch_size).scalar_subquery()
+        count = db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.id.in_(expired_ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
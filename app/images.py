@@ -0,0 +1,174 @@
+# app/images.py
+
+import importlib.util
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import storage
+
+# Resized WebP derivatives of product images.
+# Rendering runs in a small process pool so resize CPU never lands on the
+# request workers; when a job finishes, the variant URLs are written to
+# Product.image_variants for every product pointing at the source image.
+# Variant files are named after their source, so whether variants exist for
+# an image can be answered with a few stat() calls.
+# A product write only queues rendering once its transaction commits, so the
+# finished job always finds the product row it has to update.
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest edge in pixels (images are never upscaled)
+VARIANTS = {
+    "thumb": 160,
+    "card": 480,
+    "detail": 1200,
+}
+VARIANT_DIR_NAME = "variants"
+WEBP_QUALITY = 80
+MAX_WORKERS = 2
+
+_executor = None
+_lock = threading.Lock()
+_in_flight = set()
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+def variant_path(source: Path, variant: str) -> Path:
+    return source.parent / VARIANT_DIR_NAME / f"{source.stem}_{variant}.webp"
+
+def render_variants(source_path: str) -> Dict[str, str]:
+    """Process-pool worker: render every variant of one image. Returns {variant: file path}."""
+    from PIL import Image, ImageOps
+
+    source = Path(source_path)
+    rendered = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+        for variant, size in VARIANTS.items():
+            target = variant_path(source, variant)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            temp = target.parent / f".{target.name}.{os.getpid()}.part"
+            resized.save(temp, "WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(temp, target)
+            rendered[variant] = str(target)
+    return rendered
+
+def existing_variants(image_url: Optional[str]) -> Optional[Dict[str, str]]:
+    """Variant URLs for an image if all of them have been rendered, else None"""
+    source = storage.path_for_url(image_url)
+    if source is None:
+        return None
+    paths = {variant: variant_path(source, variant) for variant in VARIANTS}
+    if not all(path.exists() for path in paths.values()):
+        return None
+    return {variant: storage.url_for(path) for variant, path in paths.items()}
+
+def remove_variants(image_url: Optional[str]):
+    source = storage.path_for_url(image_url)
+    if source is None:
+        return
+    for variant in VARIANTS:
+        variant_path(source, variant).unlink(missing_ok=True)
+
+
+# Background rendering
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def schedule(image_url: Optional[str]) -> bool:
+    """Queue variant rendering for an uploaded image; returns False if nothing was queued"""
+    source = storage.path_for_url(image_url)
+    if source is None or not source.is_file() or not pillow_available():
+        return False
+    with _lock:
+        if image_url in _in_flight:
+            return False
+        _in_flight.add(image_url)
+    try:
+        future = _get_executor().submit(render_variants, str(source))
+    except Exception:
+        with _lock:
+            _in_flight.discard(image_url)
+        logger.exception("Could not queue image variants for %s", image_url)
+        return False
+    future.add_done_callback(lambda done: _on_rendered(image_url, done))
+    return True
+
+def _on_rendered(image_url: str, future):
+    with _lock:
+        _in_flight.discard(image_url)
+    try:
+        rendered = future.result()
+    except Exception:
+        logger.exception("Rendering image variants failed for %s", image_url)
+        return
+    record_variants(image_url, {variant: storage.url_for(Path(path)) for variant, path in rendered.items()})
+
+def record_variants(image_url: str, variants: Dict[str, str]):
+    """Store variant URLs on every product whose image is `image_url`"""
+    from app import database, models, conditional, cache
+
+    db = database.SessionLocal()
+    try:
+        product_ids = [pid for (pid,) in db.query(models.Product.id).filter(models.Product.image == image_url)]
+        if not product_ids:
+            return
+        db.query(models.Product).filter(models.Product.id.in_(product_ids)).update(
+            {models.Product.image_variants: variants}, synchronize_session=False
+        )
+        scopes = []
+        for product_id in product_ids:
+            scopes += conditional.product_scopes(product_id)
+            cache.invalidate_on_commit(db, product_id)
+        conditional.bump(db, *scopes)
+        db.commit()
+    finally:
+        db.close()
+
+def attach_variants(db: Session, product):
+    """Point a product being saved at its image's variants, queueing rendering for after commit if they are missing"""
+    product.image_variants = existing_variants(product.image)
+    if product.image_variants is None and product.image:
+        db.info.setdefault("render_images", set()).add(product.image)
+
+@event.listens_for(Session, "after_commit")
+def _render_committed(session):
+    for image_url in session.info.pop("render_images", ()):
+        # A job that was already running (e.g. queued by the upload) may have finished
+        # before this commit and matched no product; record its files now instead
+        variants = existing_variants(image_url)
+        if variants is not None:
+            record_variants(image_url, variants)
+        else:
+            schedule(image_url)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_renders(session):
+    session.info.pop("render_images", None)
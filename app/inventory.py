@@ -0,0 +1,256 @@
+# app/inventory.py
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from fastapi import HTTPException
+from sqlalchemy import and_, case, delete, insert, literal, or_, update
+from sqlalchemy.orm import Session
+from app import models, database, conditional, cache, idempotency, stock_shards
+
+# Inventory reservations.
+# Product.quantity is stock on hand; Product.reserved_quantity is the sum
+# of live Reservation rows, so available = quantity - reserved_quantity is a
+# column read. Every stock change is one conditional UPDATE over all the
+# products involved (CASE by id), which the database applies row by row
+# atomically: no SELECT ... FOR UPDATE and no retry loop.
+#
+# A hold is taken when checkout starts (POST /cart/reserve) and lasts
+# HOLD_TTL. Checkout confirms the user's holds by turning them into a stock
+# decrement; lines without a hold fall back to taking stock that is still
+# available. Lowering or removing a cart line shrinks its hold to match.
+# Expired holds are released in batches by a background sweeper,
+# which also deletes expired idempotency keys.
+#
+# Sharded products (see app/stock_shards.py) keep their free stock in shard
+# rows; their share of each change is applied there instead.
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL = timedelta(minutes=15)
+SWEEP_INTERVAL_SECONDS = 30
+SWEEP_BATCH_SIZE = 500
+
+_sweeper = None
+_stop_sweeper = threading.Event()
+
+
+def _by_product(values: Dict[int, int]):
+    if not values:
+        return literal(0)
+    return case(values, value=models.Product.id, else_=0)
+
+def _apply(db: Session, needed: Dict[int, int], held: Dict[int, int], consume: bool):
+    """Move stock for many products in one statement; caller commits.
+
+    needed: units each product must supply (taken from on-hand stock if
+            `consume`, otherwise newly reserved)
+    held:   units of reservations being given up for each product
+    Raises 409 naming products whose available stock (plus what the caller
+    held) does not cover what is needed.
+    """
+    product_ids = set(needed) | set(held)
+    if not product_ids:
+        return
+    short = set()
+    sharded = stock_shards.sharded(db, product_ids)
+    for product_id, is_active in sharded.items():
+        quantity = needed.get(product_id, 0)
+        if quantity > 0 and not is_active:
+            short.add(product_id)
+        elif not stock_shards.apply(db, product_id, quantity, held.get(product_id, 0), consume):
+            short.add(product_id)
+
+    row_ids = product_ids - set(sharded)
+    row_needed = {pid: quantity for pid, quantity in needed.items() if pid in row_ids}
+    row_held = {pid: quantity for pid, quantity in held.items() if pid in row_ids}
+    if row_ids:
+        n = _by_product(row_needed)
+        h = _by_product(row_held)
+        values = {models.Product.reserved_quantity: models.Product.reserved_quantity - h}
+        if consume:
+            values[models.Product.base_quantity] = models.Product.base_quantity - n
+        else:
+            values[models.Product.reserved_quantity] = models.Product.reserved_quantity - h + n
+
+        updated = db.execute(
+            update(models.Product)
+            .where(
+                models.Product.id.in_(row_ids),
+                or_(
+                    n <= 0,
+                    and_(
+                        models.Product.is_active.is_not(False),
+                        models.Product.base_quantity - models.Product.reserved_quantity + h >= n
+                    )
+                )
+            )
+            .values(values)
+            .returning(models.Product.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        short |= {pid for pid, quantity in row_needed.items() if quantity > 0} - set(updated)
+    if short:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Insufficient stock for products: {', '.join(map(str, sorted(short)))}"
+        )
+
+    scopes = []
+    for product_id in product_ids:
+        scopes += conditional.stock_scopes(product_id)
+        cache.invalidate_on_commit(db, product_id)
+    conditional.bump(db, *scopes)
+
+def _take_holds(db: Session, user_id: int, product_ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+    """Delete the user's holds (optionally only for some products); returns {product_id: units}.
+
+    DELETE ... RETURNING makes ownership atomic: a hold taken here cannot
+    also be released by the sweeper or a concurrent request.
+    """
+    stmt = delete(models.Reservation).where(models.Reservation.user_id == user_id)
+    if product_ids is not None:
+        stmt = stmt.where(models.Reservation.product_id.in_(list(product_ids)))
+    rows = db.execute(
+        stmt.returning(models.Reservation.product_id, models.Reservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {product_id: quantity for product_id, quantity in rows}
+
+def hold(db: Session, user_id: int, quantities: Dict[int, int]) -> datetime:
+    """Replace the user's holds with `quantities`, all or nothing; caller commits.
+
+    Returns the new expiry. Raises 409 if any product cannot be held.
+    """
+    quantities = {pid: quantity for pid, quantity in quantities.items() if quantity > 0}
+    previous = _take_holds(db, user_id)
+    _apply(db, quantities, previous, consume=False)
+    now = datetime.utcnow()
+    expires_at = now + HOLD_TTL
+    if quantities:
+        db.execute(insert(models.Reservation), [
+            {"user_id": user_id, "product_id": pid, "quantity": quantity, "created_at": now, "expires_at": expires_at}
+            for pid, quantity in quantities.items()
+        ])
+    return expires_at
+
+def release(db: Session, user_id: int, product_ids: Optional[Iterable[int]] = None):
+    """Give up the user's holds (optionally only for some products); caller commits"""
+    _apply(db, {}, _take_holds(db, user_id, product_ids), consume=False)
+
+def trim_to_cart(db: Session, user_id: int, product_ids: Optional[Iterable[int]] = None):
+    """Shrink the user's holds to what their cart still asks for, after a cart line shrinks or goes; caller commits.
+
+    Holds on products no longer in the cart are released and larger holds
+    are cut down to the cart quantity, keeping their expiry. Holds never
+    grow here; that is POST /cart/reserve's job.
+    """
+    holds = db.query(models.Reservation.product_id, models.Reservation.quantity).filter(
+        models.Reservation.user_id == user_id
+    )
+    lines = db.query(models.CartItem.product_id, models.CartItem.quantity).filter(
+        models.CartItem.user_id == user_id
+    )
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        holds = holds.filter(models.Reservation.product_id.in_(product_ids))
+        lines = lines.filter(models.CartItem.product_id.in_(product_ids))
+    wanted = {product_id: quantity for product_id, quantity in lines}
+    over = [product_id for product_id, quantity in holds if quantity > wanted.get(product_id, 0)]
+    if not over:
+        return
+
+    # Taking the holds (DELETE ... RETURNING) makes the change atomic against the sweeper
+    taken = db.execute(
+        delete(models.Reservation)
+        .where(models.Reservation.user_id == user_id, models.Reservation.product_id.in_(over))
+        .returning(models.Reservation.product_id, models.Reservation.quantity,
+                   models.Reservation.created_at, models.Reservation.expires_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    kept = [
+        {"user_id": user_id, "product_id": product_id, "quantity": min(quantity, wanted.get(product_id, 0)),
+         "created_at": created_at, "expires_at": expires_at}
+        for product_id, quantity, created_at, expires_at in taken
+        if wanted.get(product_id, 0) > 0
+    ]
+    if kept:
+        db.execute(insert(models.Reservation), kept)
+    kept_units = {row["product_id"]: row["quantity"] for row in kept}
+    _apply(db, {}, {
+        product_id: quantity - kept_units.get(product_id, 0) for product_id, quantity, _, _ in taken
+    }, consume=False)
+
+def commit_stock(db: Session, user_id: int, quantities: Dict[int, int]):
+    """Decrement on-hand stock for an order, confirming the user's holds; caller commits.
+
+    Units covered by a hold need no stock check; any remainder must still
+    be available. Raises 409 otherwise.
+    """
+    held = _take_holds(db, user_id, quantities)
+    _apply(db, quantities, held, consume=True)
+
+def get_holds(db: Session, user_id: int):
+    return db.query(models.Reservation).filter(
+        models.Reservation.user_id == user_id
+    ).order_by(models.Reservation.product_id).all()
+
+
+# Expiry sweeper
+
+def release_expired(db: Session, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Release expired holds in batches of `batch_size`; returns how many were released"""
+    released = 0
+    while True:
+        expired_ids = db.query(models.Reservation.id).filter(
+            models.Reservation.expires_at <= datetime.utcnow()
+        ).order_by(models.Reservation.expires_at).limit(batch_size).scalar_subquery()
+        rows = db.execute(
+            delete(models.Reservation)
+            .where(models.Reservation.id.in_(expired_ids))
+            .returning(models.Reservation.product_id, models.Reservation.quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not rows:
+            db.commit()
+            return released
+        held = {}
+        for product_id, quantity in rows:
+            held[product_id] = held.get(product_id, 0) + quantity
+        _apply(db, {}, held, consume=False)
+        db.commit()
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
+
+def _sweep_forever():
+    while not _stop_sweeper.wait(SWEEP_INTERVAL_SECONDS):
+        db = database.SessionLocal()
+        try:
+            released = release_expired(db)
+            if released:
+                logger.info("Released %d expired stock reservations", released)
+        except Exception:
+            db.rollback()
+            logger.exception("Releasing expired stock reservations failed")
+        try:
+            deleted = idempotency.delete_expired(db)
+            if deleted:
+                logger.info("Deleted %d expired idempotency keys", deleted)
+        except Exception:
+            db.rollback()
+            logger.exception("Deleting expired idempotency keys failed")
+        finally:
+            db.close()
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is not None and _sweeper.is_alive():
+        return
+    _stop_sweeper.clear()
+    _sweeper = threading.Thread(target=_sweep_forever, name="reservation-sweeper", daemon=True)
+    _sweeper.start()
+
+def stop_sweeper():
+    _stop_sweeper.set()
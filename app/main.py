@@ -1,7 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from app import models, database
+from app import models, database, search, storage, images, media, inventory, passwords, rate_limit
 from app.routes import auth, users, products, orders, cart, uploads, admin, reviews, addresses
 from pathlib import Path
 
@@ -9,6 +8,13 @@ from pathlib import Path
 
 app = FastAPI(title="E-Commerce API", version="1.0.0")
 
+# Abort oversized multipart uploads while they stream in
+# (added before CORS so its 413 responses still carry CORS headers)
+app.add_middleware(storage.UploadSizeLimitMiddleware)
+
+# Token-bucket rate limits per route group (also before CORS, for its 429s)
+app.add_middleware(rate_limit.RateLimitMiddleware)
+
 # Add the CORS middleware to your app
 app.add_middleware(
     CORSMiddleware,
@@ -21,8 +27,9 @@ app.add_middleware(
         "*"  # Allow all origins for development
     ],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "Retry-After"],
 )
 
 # Create uploads directory if it doesn't exist
@@ -30,7 +37,8 @@ uploads_dir = Path("uploads")
 uploads_dir.mkdir(exist_ok=True)
 
 # Mount static files for serving uploaded images
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+# (immutable caching for content-addressed files, Range, precompressed .br/.gz)
+app.mount("/static", media.MediaFiles(directory="uploads"), name="static")
 
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -45,6 +53,31 @@ app.include_router(addresses.router, prefix="/api/addresses", tags=["addresses"]
 
 
 
+@app.on_event("startup")
+def ensure_search_index():
+    search.ensure_index(database.engine)
+
+
+@app.on_event("startup")
+def start_reservation_sweeper():
+    inventory.start_sweeper()
+
+
+@app.on_event("shutdown")
+def stop_image_workers():
+    images.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_reservation_sweeper():
+    inventory.stop_sweeper()
+
+
+@app.on_event("shutdown")
+def stop_password_workers():
+    passwords.shutdown()
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the E--Commerce API"}
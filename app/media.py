@@ -0,0 +1,97 @@
+# app/media.py
+
+import os
+import re
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Optional
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+# Static serving for uploaded media.
+# Content-addressed files (and their variants) never change under a URL, so
+# they are sent with a year-long immutable Cache-Control and an ETag derived
+# from the digest; anything else must be revalidated. Range requests and
+# zero-copy transmission (the ASGI pathsend extension, where the server
+# offers it) come from Starlette's FileResponse. Compressible types are
+# served from a precompressed .br/.gz sibling when the client accepts it.
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# <sha256>.<ext> or <sha256>_<variant>.<ext>
+IMMUTABLE_NAME_RE = re.compile(r"^(?P<digest>[0-9a-f]{64})(?P<variant>_[a-z]+)?\.[a-z0-9]+$")
+
+# Precompressed siblings, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+PRECOMPRESSIBLE_SUFFIXES = {".svg", ".json", ".csv", ".txt"}
+
+
+class MediaFileResponse(FileResponse):
+    chunk_size = 256 * 1024
+
+
+def _accepted_encodings(header: Optional[str]) -> set:
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+def _precompressed(full_path: str, accept_encoding: Optional[str]):
+    """The best precompressed sibling the client accepts, as (encoding, path, stat) or None"""
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accepted and "*" not in accepted:
+            continue
+        candidate = full_path + suffix
+        try:
+            return encoding, candidate, os.stat(candidate)
+        except OSError:
+            continue
+    return None
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles with cache policy by path and precompressed variant negotiation"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        name = Path(full_path).name
+        immutable = IMMUTABLE_NAME_RE.match(name)
+
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        }
+        if immutable:
+            headers["ETag"] = f'"{immutable.group("digest")}{immutable.group("variant") or ""}"'
+
+        path, stat_for_response = full_path, stat_result
+        media_type = None
+        if Path(full_path).suffix.lower() in PRECOMPRESSIBLE_SUFFIXES:
+            # Only a handful of small text formats get here, so the extra stat
+            # calls stay on the event loop
+            headers["Vary"] = "Accept-Encoding"
+            found = _precompressed(full_path, request_headers.get("accept-encoding"))
+            if found is not None:
+                encoding, path, stat_for_response = found
+                media_type = guess_type(full_path)[0]
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("ETag") or f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+                headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+        response = MediaFileResponse(
+            path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_for_response
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
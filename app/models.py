@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Enum, Index, JSON, Text, case, select
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.sql import func
 from app.database import Base
 import enum
@@ -26,6 +27,8 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     # created_at = Column(DateTime(timezone=True), server_default=func.now())  # Commented out - column missing in DB
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Embedded in access tokens as "ver"; bumping it revokes every token issued before (see app/revocation.py)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Profile fields
     first_name = Column(String, nullable=True)
@@ -44,17 +47,78 @@ class Product(Base):
     name = Column(String, index=True)
     description = Column(String)
     price = Column(Float)
-    quantity = Column(Integer)
+    # Stock kept in the products.quantity column itself; for a sharded
+    # product only part of it (see quantity below and app/stock_shards.py)
+    base_quantity = Column("quantity", Integer)
     image = Column(String, nullable=True)
+    image_variants = Column(JSON, nullable=True)  # {"thumb": url, "card": url, "detail": url}
     category = Column(String, nullable=True)  # New category field
     sku = Column(String, unique=True, nullable=True)  # Stock Keeping Unit
     is_active = Column(Boolean, default=True)
     # created_at = Column(DateTime(timezone=True), server_default=func.now())  # Commented out - column missing in DB
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
+
+    # Units held by active reservations (sum of Reservation.quantity, see app/inventory.py)
+    reserved_quantity = Column(Integer, nullable=False, default=0, server_default="0")
+    # Checkouts touching this product go through its serialized queue (see app/flash_sale.py)
+    flash_sale = Column(Boolean, nullable=False, default=False, server_default="0")
+    # Number of StockShard rows holding this product's free stock; 0 = not sharded
+    stock_shard_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Denormalized aggregates over approved reviews (see crud.apply_review_rating_change)
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_avg = Column(Float, nullable=False, default=0.0, server_default="0")
+    rating_1 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_2 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_3 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_4 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_5 = Column(Integer, nullable=False, default=0, server_default="0")
+
     # Relationships
     reviews = relationship("Review", back_populates="product")
 
+    @hybrid_property
+    def quantity(self) -> int:
+        """Stock on hand: the column plus the product's stock shards"""
+        if self.base_quantity is None or not self.stock_shard_count:
+            return self.base_quantity
+        return self.base_quantity + (self.shard_quantity or 0)
+
+    @quantity.inplace.setter
+    def _quantity_setter(self, value: int):
+        # Keeps the shards as loaded; stock_shards.set_quantity redistributes them safely
+        if value is None or not self.stock_shard_count:
+            self.base_quantity = value
+        else:
+            self.base_quantity = value - (self.shard_quantity or 0)
+
+    @quantity.inplace.expression
+    @classmethod
+    def _quantity_expression(cls):
+        # The shard subquery is only evaluated for sharded rows
+        return case(
+            (cls.stock_shard_count > 0, cls.base_quantity + cls.shard_quantity),
+            else_=cls.base_quantity
+        )
+
+    @property
+    def available_quantity(self) -> int:
+        """Stock that can still be sold: on hand minus reserved"""
+        return (self.quantity or 0) - (self.reserved_quantity or 0)
+
+    # Composite indexes backing the keyset-paginated catalog listing
+    __table_args__ = (
+        Index("ix_products_active_id", "is_active", "id"),
+        Index("ix_products_active_name", "is_active", "name", "id"),
+        Index("ix_products_active_price", "is_active", "price", "id"),
+        Index("ix_products_active_rating", "is_active", "rating_avg", "id"),
+        Index("ix_products_active_category_name", "is_active", "category", "name", "id"),
+        Index("ix_products_active_category_price", "is_active", "category", "price", "id"),
+        # Reference counting of content-addressed image files (storage.reference_count)
+        Index("ix_products_image", "image"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True)
@@ -68,6 +132,36 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
 
+    # Keyset-paginated admin order listing, newest first, optionally by status or user
+    __table_args__ = (
+        Index("ix_orders_created", "created_at", "id"),
+        Index("ix_orders_status_created", "status", "created_at", "id"),
+        Index("ix_orders_user_created", "user_id", "created_at", "id"),
+    )
+
+class OrderHistory(Base):
+    """Denormalized order history: one row per order, line items snapshotted (see app/order_history.py)"""
+    __tablename__ = "order_history"
+    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    status = Column(String, nullable=False)
+    total_price = Column(Float, nullable=False)
+    shipping_address = Column(String, nullable=True)
+    item_count = Column(Integer, nullable=False)
+    items = Column(JSON, nullable=False)  # [{product_id, quantity, price, product: {...}}]
+
+    # Keyset pagination of a user's history, newest first
+    __table_args__ = (
+        Index("ix_order_history_user_created", "user_id", "created_at", "order_id"),
+    )
+
+class OrderHistoryImage(Base):
+    """An uploaded image shown by an order_history snapshot; counts as a reference to the file (see app/storage.py)"""
+    __tablename__ = "order_history_images"
+    url = Column(String, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
+
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, index=True)
@@ -89,6 +183,11 @@ class CartItem(Base):
     user = relationship("User", back_populates="cart_items")
     product = relationship("Product")
 
+    # One row per (user, product): the conflict target of crud.add_to_cart's upsert
+    __table_args__ = (
+        Index("uq_cart_items_user_product", "user_id", "product_id", unique=True),
+    )
+
 class Review(Base):
     __tablename__ = "reviews"
     id = Column(Integer, primary_key=True, index=True)
@@ -105,6 +204,12 @@ class Review(Base):
     user = relationship("User", back_populates="reviews")
     product = relationship("Product", back_populates="reviews")
 
+    # Keyset-paginated admin review moderation listing, newest first
+    __table_args__ = (
+        Index("ix_reviews_created", "created_at", "id"),
+        Index("ix_reviews_approved_created", "is_approved", "created_at", "id"),
+    )
+
 
 class Address(Base):
     __tablename__ = "addresses"
@@ -120,3 +225,104 @@ class Address(Base):
     
     # Relationship
     user = relationship("User", back_populates="addresses")
+
+
+class ChangeCounter(Base):
+    """Monotonic version per change scope (e.g. "products", "product:1"), used for ETags"""
+    __tablename__ = "change_counters"
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class IdempotencyKey(Base):
+    """Outcome of a request sent with an Idempotency-Key header (see app/idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    scope = Column(String, nullable=False)  # e.g. "POST /orders"
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)  # sha256 of the request body
+    completed = Column(Boolean, nullable=False, default=False)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("uq_idempotency_keys_user_scope_key", "user_id", "scope", "key", unique=True),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+
+class Reservation(Base):
+    """Stock held for a user's cart until checkout or expiry (see app/inventory.py)"""
+    __tablename__ = "reservations"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("uq_reservations_user_product", "user_id", "product_id", unique=True),
+        Index("ix_reservations_expires_at", "expires_at"),
+    )
+
+
+class RefreshToken(Base):
+    """One issued refresh token, stored as its sha256 (see app/refresh_tokens.py)"""
+    __tablename__ = "refresh_tokens"
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), nullable=False)
+    # Every token rotated from the same login shares the family; reuse revokes all of them
+    family_id = Column(String(32), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    token_version = Column(Integer, nullable=False, default=0)  # User.token_version at issue
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)  # set when rotated
+    revoked_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("uq_refresh_tokens_token_hash", "token_hash", unique=True),
+        Index("ix_refresh_tokens_family", "family_id"),
+        Index("ix_refresh_tokens_user_expires", "user_id", "expires_at"),
+        Index("ix_refresh_tokens_revoked_expires", "revoked_at", "expires_at"),
+    )
+
+
+class RateLimitBucket(Base):
+    """Rate limiter state shared by all workers (see app/rate_limit.py)"""
+    __tablename__ = "rate_limit_buckets"
+    key = Column(String(255), primary_key=True)
+    tokens = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(Float, nullable=False)  # unix time of the last refill or failure
+    # Failed-login backoff rows only
+    failures = Column(Integer, nullable=False, default=0)
+    blocked_until = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_rate_limit_buckets_updated_at", "updated_at"),
+    )
+
+
+class StockShard(Base):
+    """One slice of a hot product's free stock (see app/stock_shards.py)"""
+    __tablename__ = "stock_shards"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+
+
+# Sum of the product's shards. Deferred: loaded on first access, which
+# Product.quantity only does for sharded products, so ordinary product
+# loads carry no subquery
+Product.shard_quantity = column_property(
+    select(func.coalesce(func.sum(StockShard.quantity), 0))
+    .where(StockShard.product_id == Product.id)
+    .correlate_except(StockShard)
+    .scalar_subquery(),
+    deferred=True
+)
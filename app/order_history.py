@@ -0,0 +1,148 @@
+# app/order_history.py
+
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from app import models, pagination, storage
+from app.database import dialect_insert
+
+# Order history read model.
+# Each order gets one order_history row holding everything the order history
+# page shows: totals, status and the line items with the product's name,
+# image and category as they were at purchase time. The row is written in
+# the checkout transaction and updated on status changes, so reading a page
+# of history is one range scan of (user_id, created_at, order_id) and later
+# product edits or deletions do not change past orders.
+#
+# The snapshots keep pointing at uploaded image files, so each history row
+# also records the stored images it shows in order_history_images. Storage
+# counts those as references, and a product's old image is kept for as
+# long as past orders show it.
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+BACKFILL_BATCH_SIZE = 500
+
+
+def _status_value(status) -> str:
+    # models.OrderStatus, schemas.OrderStatus or a plain string
+    return getattr(status, "value", status) or models.OrderStatus.PENDING.value
+
+def _product_snapshots(db: Session, product_ids) -> dict:
+    rows = db.execute(
+        select(
+            models.Product.id, models.Product.name, models.Product.image,
+            models.Product.image_variants, models.Product.category
+        ).where(models.Product.id.in_(list(product_ids)))
+    ).all()
+    return {
+        row.id: {
+            "id": row.id,
+            "name": row.name,
+            "image": row.image,
+            "thumbnail": (row.image_variants or {}).get("thumb"),
+            "category": row.category,
+        }
+        for row in rows
+    }
+
+def _history_row(order: models.Order, lines, products: dict) -> dict:
+    return {
+        "order_id": order.id,
+        "user_id": order.user_id,
+        "created_at": order.created_at or datetime.utcnow(),
+        "status": _status_value(order.status),
+        "total_price": order.total_price or 0.0,
+        "shipping_address": order.shipping_address,
+        "item_count": sum(quantity for _, quantity, _ in lines),
+        "items": [
+            {"product_id": product_id, "quantity": quantity, "price": price, "product": products.get(product_id)}
+            for product_id, quantity, price in lines
+        ],
+    }
+
+def _image_references(rows) -> list:
+    """(url, order_id) rows for the uploaded images the history rows show"""
+    references = {
+        (item["product"]["image"], row["order_id"])
+        for row in rows
+        for item in row["items"]
+        if item.get("product") and storage.path_for_url(item["product"].get("image")) is not None
+    }
+    return [{"url": url, "order_id": order_id} for url, order_id in references]
+
+def _record_image_references(db: Session, rows):
+    references = _image_references(rows)
+    if references:
+        insert_references = dialect_insert(db.get_bind())
+        db.execute(insert_references(models.OrderHistoryImage).values(references).on_conflict_do_nothing())
+
+def record(db: Session, order: models.Order, lines):
+    """Write the history row of a new order from its (product_id, quantity, price) lines; caller commits"""
+    products = _product_snapshots(db, {product_id for product_id, _, _ in lines})
+    row = _history_row(order, lines, products)
+    db.execute(insert(models.OrderHistory).values(**row))
+    _record_image_references(db, [row])
+
+def set_status(db: Session, order_id: int, status):
+    """Mirror an order status change into its history row; caller commits"""
+    db.execute(
+        update(models.OrderHistory)
+        .where(models.OrderHistory.order_id == order_id)
+        .values(status=_status_value(status))
+        .execution_options(synchronize_session=False)
+    )
+
+def page(db: Session, user_id: int, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    """A page of the user's orders, newest first. Returns (rows, next_cursor)."""
+    after = pagination.decode_time_cursor(cursor) if cursor else None
+    query = db.query(models.OrderHistory).filter(models.OrderHistory.user_id == user_id)
+    query = pagination.apply_keyset(
+        query, [models.OrderHistory.created_at, models.OrderHistory.order_id], after, descending=True
+    )
+    rows, has_more = pagination.split_page(query.limit(limit + 1).all(), limit)
+    next_cursor = None
+    if has_more:
+        next_cursor = pagination.encode_time_cursor(rows[-1].created_at, rows[-1].order_id)
+    return rows, next_cursor
+
+def backfill(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Write history rows for orders that have none (orders placed before the read model); returns how many"""
+    written = 0
+    last_id = 0
+    while True:
+        orders = db.query(models.Order).outerjoin(
+            models.OrderHistory, models.OrderHistory.order_id == models.Order.id
+        ).filter(
+            models.OrderHistory.order_id.is_(None),
+            models.Order.id > last_id
+        ).order_by(models.Order.id).limit(batch_size).all()
+        if not orders:
+            return written
+        order_ids = [order.id for order in orders]
+        lines = {}
+        for item in db.query(models.OrderItem).filter(models.OrderItem.order_id.in_(order_ids)).order_by(models.OrderItem.id):
+            lines.setdefault(item.order_id, []).append((item.product_id, item.quantity, item.price))
+        products = _product_snapshots(db, {product_id for order_lines in lines.values() for product_id, _, _ in order_lines})
+        rows = [_history_row(order, lines.get(order.id, []), products) for order in orders]
+        db.execute(insert(models.OrderHistory), rows)
+        _record_image_references(db, rows)
+        db.commit()
+        written += len(orders)
+        last_id = order_ids[-1]
+
+def backfill_image_references(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Record the image references of existing history rows; returns how many rows were scanned"""
+    scanned = 0
+    last_id = 0
+    while True:
+        rows = db.query(models.OrderHistory.order_id, models.OrderHistory.items).filter(
+            models.OrderHistory.order_id > last_id
+        ).order_by(models.OrderHistory.order_id).limit(batch_size).all()
+        if not rows:
+            return scanned
+        _record_image_references(db, [{"order_id": order_id, "items": items} for order_id, items in rows])
+        db.commit()
+        scanned += len(rows)
+        last_id = rows[-1].order_id
@@ -0,0 +1,54 @@
+# app/pagination.py
+
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_, literal
+
+# Keyset (cursor) pagination helpers.
+# A cursor is an opaque, URL-safe token holding the sort key of the last row
+# of the previous page, so every page is a single index range scan instead
+# of an OFFSET that grows with the page depth.
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data
+
+def apply_keyset(query, columns, after=None, descending=False):
+    """Order `query` by `columns` and, if `after` is given, start right after that key"""
+    if after is not None:
+        if len(after) != len(columns):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        key = tuple_(*columns)
+        bound = tuple_(*[literal(value) for value in after])
+        query = query.filter(key < bound if descending else key > bound)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    return query.order_by(*order)
+
+def split_page(rows, limit: int):
+    """Split a `limit + 1` fetch into the page rows and a has-more flag"""
+    has_more = len(rows) > limit
+    return rows[:limit], has_more
+
+def encode_time_cursor(created_at, row_id: int) -> str:
+    """Cursor for listings ordered by (created_at, id)"""
+    return encode_cursor({"key": [created_at, row_id]})
+
+def decode_time_cursor(token: str) -> list:
+    """The [created_at, id] key of a cursor from encode_time_cursor"""
+    key = decode_cursor(token).get("key")
+    try:
+        return [datetime.fromisoformat(key[0]), int(key[1])]
+    except (TypeError, ValueError, IndexError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,182 @@
+# app/passwords.py
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# Password hashing off the request workers.
+# A bcrypt hash or verify costs 100-300 ms of CPU. Run inline, every login
+# holds one of the AnyIO threadpool's threads for that long, so a burst of
+# logins starves every other sync endpoint. Here the work runs in a small
+# dedicated process pool and async callers await it without holding a
+# thread. The number of jobs waiting for the pool is capped: past
+# MAX_PENDING new requests are rejected at once with 503 and Retry-After
+# instead of queueing for seconds.
+#
+# BCRYPT_ROUNDS is the cost factor for new hashes. Successful logins
+# rehash passwords stored with a different cost (passlib's needs_update),
+# so the cost can be raised or lowered without a migration.
+#
+# A worker that dies (OOM kill, segfault) leaves the pool broken: every
+# later submit fails with BrokenProcessPool. The broken pool is dropped and
+# the next job gets a fresh one; a job that failed that way is retried
+# once, so a crash costs at most the logins in flight at that moment.
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = 12
+MAX_WORKERS = 2
+# Jobs allowed to wait for or run in the pool before new ones are rejected
+MAX_PENDING = 32
+RETRY_AFTER_SECONDS = 1
+
+_executor = None
+_lock = threading.Lock()
+_stats = {
+    "pending": 0,
+    "max_pending": 0,
+    "completed": 0,
+    "rejected": 0,
+    "rehashed": 0,
+    "total_seconds": 0.0,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+# Run in the pool's worker processes
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    try:
+        return _context(rounds).verify_and_update(password, hashed_password)
+    except (ValueError, TypeError):
+        # Malformed or unknown hash format: treat as a failed login
+        return False, None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def _discard(executor: ProcessPoolExecutor):
+    """Forget a broken pool so the next job starts a new one"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _submit(fn, *args) -> Future:
+    """Queue a job on the pool, or raise 503 when MAX_PENDING jobs are already waiting"""
+    with _lock:
+        if _stats["pending"] >= MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-in requests, please retry shortly",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        _stats["pending"] += 1
+        _stats["max_pending"] = max(_stats["max_pending"], _stats["pending"])
+    started = time.monotonic()
+    try:
+        executor = _get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            _discard(executor)
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = _get_executor()
+            future = executor.submit(fn, *args)
+    except Exception:
+        with _lock:
+            _stats["pending"] -= 1
+        raise
+
+    def finished(done: Future):
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            _discard(executor)
+        with _lock:
+            _stats["pending"] -= 1
+            _stats["completed"] += 1
+            _stats["total_seconds"] += time.monotonic() - started
+
+    future.add_done_callback(finished)
+    return future
+
+async def _run(fn, *args):
+    """Await a job, retrying it once on a fresh pool if a worker died under it"""
+    try:
+        return await asyncio.wrap_future(_submit(fn, *args))
+    except BrokenProcessPool:
+        logger.warning("Password worker pool broke, retrying on a new pool")
+        return await asyncio.wrap_future(_submit(fn, *args))
+
+def _run_blocking(fn, *args):
+    try:
+        return _submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.warning("Password worker pool broke, retrying on a new pool")
+        return _submit(fn, *args).result()
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password, BCRYPT_ROUNDS)
+
+async def verify_and_update(password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(valid, new_hash): new_hash is set when the stored hash should be replaced (different cost)"""
+    if not hashed_password:
+        return False, None
+    valid, new_hash = await _run(_verify_and_update, password, hashed_password, BCRYPT_ROUNDS)
+    if new_hash is not None:
+        with _lock:
+            _stats["rehashed"] += 1
+    return valid, new_hash
+
+def hash_password_blocking(password: str) -> str:
+    """For sync callers: still runs in the pool, but waits on the calling thread"""
+    return _run_blocking(_hash, password, BCRYPT_ROUNDS)
+
+def verify_blocking(password: str, hashed_password: Optional[str]) -> bool:
+    if not hashed_password:
+        return False
+    return _run_blocking(_verify_and_update, password, hashed_password, BCRYPT_ROUNDS)[0]
+
+def stats() -> dict:
+    with _lock:
+        completed = _stats["completed"]
+        return {
+            "workers": MAX_WORKERS,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "max_pending_allowed": MAX_PENDING,
+            "pending": _stats["pending"],
+            "max_pending": _stats["max_pending"],
+            "completed": completed,
+            "rejected": _stats["rejected"],
+            "rehashed": _stats["rehashed"],
+            "avg_job_ms": round(1000 * _stats["total_seconds"] / completed, 2) if completed else 0.0,
+        }
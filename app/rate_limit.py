@@ -0,0 +1,386 @@
+# app/rate_limit.py
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import case, delete, select, update
+from starlette.concurrency import run_in_threadpool
+from app import models, database, auth
+from app.database import dialect_insert
+
+# Token-bucket rate limiting.
+# Every request is matched to the first ROUTE_GROUPS entry whose method and
+# path prefix fit, and takes one token from each of that group's buckets:
+# one per client IP and, for authenticated requests, one per user (read
+# from the bearer token's claims, no query). A bucket holds `capacity`
+# tokens and refills continuously over `period` seconds, so short bursts
+# pass and sustained loops are cut to the refill rate. An empty bucket
+# answers 429 with Retry-After set to when the next token arrives.
+#
+# Logins get two more checks per account and client IP on top of the
+# "auth" group's IP bucket: a small bucket of failed attempts, and
+# exponential backoff once there are more than LOGIN_FREE_FAILURES failed
+# logins in a row (1s, 2s, 4s ... up to LOGIN_BACKOFF_MAX_SECONDS), cleared
+# by a successful login. Both are checked before the password, so throttled
+# attempts cost no bcrypt work; only failures are charged, and keying on the
+# client IP as well means someone guessing at an account cannot lock its
+# owner out.
+#
+# BACKEND "memory" keeps the buckets in this process (cheapest; each
+# uvicorn worker then enforces its own share). "database" keeps them in the
+# rate_limit_buckets table with atomic conditional UPDATEs, so the limits
+# hold across workers; it costs two or three statements per request.
+
+BACKEND = "memory"  # or "database"
+# Honour X-Forwarded-For only when the app sits behind a trusted proxy
+TRUST_FORWARDED_FOR = False
+# Not limited: static media and the API docs
+EXEMPT_PREFIXES = ("/static", "/docs", "/redoc", "/openapi.json")
+
+LOGIN_FREE_FAILURES = 3
+LOGIN_BACKOFF_BASE_SECONDS = 1.0
+LOGIN_BACKOFF_MAX_SECONDS = 15 * 60
+# A failure streak is forgotten after this long without failures
+LOGIN_FAILURE_WINDOW_SECONDS = 60 * 60
+
+# Memory backend: least recently used keys are dropped past this many
+MAX_MEMORY_KEYS = 100_000
+# Database backend: rows idle this long are deleted (a bucket idle for a
+# full period is full again anyway), at most once per SWEEP_SECONDS
+IDLE_SECONDS = LOGIN_FAILURE_WINDOW_SECONDS
+SWEEP_SECONDS = 60.0
+
+
+@dataclass(frozen=True)
+class Limit:
+    """`capacity` requests per `period` seconds for each client ("ip"), user ("user") or login name ("account")"""
+    scope: str
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+@dataclass(frozen=True)
+class RouteGroup:
+    name: str
+    prefixes: Tuple[str, ...]
+    limits: Tuple[Limit, ...]
+    methods: Tuple[str, ...] = ()  # empty: any method
+
+    def matches(self, method: str, path: str) -> bool:
+        return (not self.methods or method in self.methods) and path.startswith(self.prefixes)
+
+
+ROUTE_GROUPS = (
+    RouteGroup("auth", ("/auth/login", "/auth/register", "/auth/refresh"), (Limit("ip", 20, 60),), ("POST",)),
+    RouteGroup("catalog", ("/products", "/reviews/product", "/reviews/summaries"),
+               (Limit("ip", 120, 60), Limit("user", 240, 60)), ("GET",)),
+    RouteGroup("checkout", ("/orders", "/cart/checkout"), (Limit("user", 30, 60),), ("POST",)),
+    RouteGroup("uploads", ("/uploads",), (Limit("user", 30, 60),)),
+    RouteGroup("admin", ("/admin",), (Limit("user", 600, 60),)),
+    RouteGroup("default", ("/",), (Limit("ip", 600, 60), Limit("user", 600, 60))),
+)
+
+LOGIN_ACCOUNT_LIMIT = Limit("account", 10, 15 * 60)
+
+
+def backoff_seconds(failures: int) -> float:
+    """How long an account is blocked after its `failures`-th failed login in a row"""
+    if failures <= LOGIN_FREE_FAILURES:
+        return 0.0
+    return min(LOGIN_BACKOFF_BASE_SECONDS * 2 ** (failures - LOGIN_FREE_FAILURES - 1), LOGIN_BACKOFF_MAX_SECONDS)
+
+
+class MemoryBackend:
+    """Buckets in this process, bounded by MAX_MEMORY_KEYS"""
+    blocking = False
+
+    def __init__(self, max_keys: int = MAX_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._failures = OrderedDict()  # key -> (failures, last_failure, blocked_until)
+
+    def _store(self, table: OrderedDict, key: str, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_keys:
+            table.popitem(last=False)
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """Take one token; 0 if granted, otherwise seconds until one is available"""
+        with self._lock:
+            state = self._buckets.get(key)
+            tokens = limit.capacity if state is None else min(limit.capacity, state[0] + (now - state[1]) * limit.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate
+            self._store(self._buckets, key, (tokens, now))
+            return wait
+
+    def peek(self, key: str, limit: Limit, now: float) -> float:
+        """Like take() without taking: 0 if a token is available, otherwise seconds until one is"""
+        with self._lock:
+            state = self._buckets.get(key)
+        tokens = limit.capacity if state is None else min(limit.capacity, state[0] + (now - state[1]) * limit.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+
+    def blocked_for(self, key: str, now: float) -> float:
+        with self._lock:
+            state = self._failures.get(key)
+        return max(state[2] - now, 0.0) if state else 0.0
+
+    def record_failure(self, key: str, now: float) -> float:
+        with self._lock:
+            failures, last_failure, _ = self._failures.get(key, (0, now, now))
+            if now - last_failure > LOGIN_FAILURE_WINDOW_SECONDS:
+                failures = 0
+            failures += 1
+            block = backoff_seconds(failures)
+            self._store(self._failures, key, (failures, now, now + block))
+            return block
+
+    def clear(self, key: str):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class DatabaseBackend:
+    """Buckets in the rate_limit_buckets table, shared by every worker on the database"""
+    blocking = True
+
+    def __init__(self):
+        self._last_sweep = 0.0
+
+    def _sweep(self, db, now: float):
+        if now - self._last_sweep < SWEEP_SECONDS:
+            return
+        self._last_sweep = now
+        db.execute(delete(models.RateLimitBucket).where(
+            models.RateLimitBucket.updated_at < now - IDLE_SECONDS
+        ))
+
+    def _ensure_row(self, db, key: str, tokens: float, now: float):
+        insert = dialect_insert(db.get_bind())
+        db.execute(insert(models.RateLimitBucket).values(
+            key=key, tokens=tokens, updated_at=now, failures=0
+        ).on_conflict_do_nothing(index_elements=["key"]))
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        bucket = models.RateLimitBucket
+        db = database.SessionLocal()
+        try:
+            self._sweep(db, now)
+            self._ensure_row(db, key, limit.capacity, now)
+            refilled = bucket.tokens + (now - bucket.updated_at) * limit.rate
+            tokens = case((refilled > limit.capacity, float(limit.capacity)), else_=refilled)
+            # Refill and take in one statement, so concurrent workers cannot both spend the last token
+            taken = db.execute(
+                update(bucket)
+                .where(bucket.key == key, tokens >= 1)
+                .values(tokens=tokens - 1, updated_at=now)
+                .returning(bucket.key)
+                .execution_options(synchronize_session=False)
+            ).first()
+            wait = 0.0
+            if taken is None:
+                available = db.execute(select(tokens).where(bucket.key == key)).scalar() or 0.0
+                wait = (1 - available) / limit.rate
+            db.commit()
+            return wait
+        finally:
+            db.close()
+
+    def peek(self, key: str, limit: Limit, now: float) -> float:
+        bucket = models.RateLimitBucket
+        refilled = bucket.tokens + (now - bucket.updated_at) * limit.rate
+        db = database.SessionLocal()
+        try:
+            tokens = db.execute(select(refilled).where(bucket.key == key)).scalar()
+        finally:
+            db.close()
+        if tokens is None or tokens >= 1:
+            return 0.0
+        return (1 - tokens) / limit.rate
+
+    def blocked_for(self, key: str, now: float) -> float:
+        db = database.SessionLocal()
+        try:
+            blocked_until = db.execute(
+                select(models.RateLimitBucket.blocked_until).where(models.RateLimitBucket.key == key)
+            ).scalar()
+        finally:
+            db.close()
+        return max(blocked_until - now, 0.0) if blocked_until else 0.0
+
+    def record_failure(self, key: str, now: float) -> float:
+        bucket = models.RateLimitBucket
+        db = database.SessionLocal()
+        try:
+            self._ensure_row(db, key, 0.0, now)
+            failures, last_failure = db.execute(
+                select(bucket.failures, bucket.updated_at).where(bucket.key == key).with_for_update()
+            ).one()
+            if now - last_failure > LOGIN_FAILURE_WINDOW_SECONDS:
+                failures = 0
+            failures += 1
+            block = backoff_seconds(failures)
+            db.execute(
+                update(bucket)
+                .where(bucket.key == key)
+                .values(failures=failures, updated_at=now, blocked_until=now + block)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            return block
+        finally:
+            db.close()
+
+    def clear(self, key: str):
+        db = database.SessionLocal()
+        try:
+            db.execute(delete(models.RateLimitBucket).where(models.RateLimitBucket.key == key))
+            db.commit()
+        finally:
+            db.close()
+
+
+_lock = threading.Lock()
+_backend = None
+_stats = {}  # group -> {"allowed": n, "limited": n}
+
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = DatabaseBackend() if BACKEND == "database" else MemoryBackend()
+        return _backend
+
+async def _call(method, *args):
+    if get_backend().blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+def _count(group: str, limited: bool):
+    with _lock:
+        counters = _stats.setdefault(group, {"allowed": 0, "limited": 0})
+        counters["limited" if limited else "allowed"] += 1
+
+def _too_many(wait: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please retry later",
+        headers={"Retry-After": str(max(math.ceil(wait), 1))}
+    )
+
+def match_group(method: str, path: str) -> Optional[RouteGroup]:
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    return next((group for group in ROUTE_GROUPS if group.matches(method, path)), None)
+
+def client_ip(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def user_identity(scope) -> Optional[str]:
+    """The user id from a valid bearer token, without touching the database"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            payload = auth.decode_token(token.strip())
+            if payload is None:
+                return None
+            return str(payload.get("uid") or payload["sub"])
+    return None
+
+async def check_request(group: RouteGroup, scope) -> float:
+    """Take a token from each of the group's buckets; the longest wait if any is empty, else 0"""
+    backend = get_backend()
+    now = time.time()
+    identities = {"ip": client_ip(scope), "user": user_identity(scope)}
+    wait = 0.0
+    for limit in group.limits:
+        identity = identities.get(limit.scope)
+        if identity is None:
+            continue
+        wait = max(wait, await _call(backend.take, f"{group.name}:{limit.scope}:{identity}", limit, now))
+    _count(group.name, wait > 0)
+    return wait
+
+
+class RateLimitMiddleware:
+    """Answer 429 with Retry-After when a request's route group buckets are empty"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        group = match_group(scope["method"], scope["path"])
+        if group is None:
+            return await self.app(scope, receive, send)
+        wait = await check_request(group, scope)
+        if wait <= 0:
+            return await self.app(scope, receive, send)
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(max(math.ceil(wait), 1)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b'{"detail":"Too many requests, please retry later"}'})
+
+
+# Per-account login throttling, called by POST /auth/login
+
+def _account_key(username: str, ip: str) -> str:
+    return f"login:account:{username.strip().lower()}:{ip}"
+
+def _failures_key(username: str, ip: str) -> str:
+    return f"login:failures:{username.strip().lower()}:{ip}"
+
+async def check_login(username: str, ip: str):
+    """Raise 429 if the account is backing off or out of failed attempts from this client"""
+    backend = get_backend()
+    now = time.time()
+    wait = await _call(backend.blocked_for, _failures_key(username, ip), now)
+    if wait <= 0:
+        wait = await _call(backend.peek, _account_key(username, ip), LOGIN_ACCOUNT_LIMIT, now)
+    _count("login_account", wait > 0)
+    if wait > 0:
+        raise _too_many(wait)
+
+async def login_failed(username: str, ip: str):
+    backend = get_backend()
+    now = time.time()
+    await _call(backend.take, _account_key(username, ip), LOGIN_ACCOUNT_LIMIT, now)
+    await _call(backend.record_failure, _failures_key(username, ip), now)
+
+async def login_succeeded(username: str, ip: str):
+    await _call(get_backend().clear, _failures_key(username, ip))
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "backend": BACKEND,
+            "groups": {group: dict(counters) for group, counters in _stats.items()},
+        }
@@ -0,0 +1,239 @@
+# app/refresh_tokens.py
+
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app import models, database
+
+# Rotating refresh tokens.
+# Login issues a refresh token next to the access token; POST /auth/refresh
+# trades it for a new pair without a password check. Tokens are random
+# 256-bit strings stored only as their sha256 (a slow hash buys nothing for
+# values this long), so a refresh is one lookup on the unique token_hash
+# index plus the rotation writes. Each refresh token works once: the tokens
+# rotated from one login form a family, and presenting an already rotated
+# token (a stolen copy racing the real client) revokes the whole family.
+#
+# Access tokens carry their family as the "fam" claim, so revoking a family
+# (reuse or logout) also cuts off the access tokens issued from it. Checking
+# that on every request must not cost a query, so each process keeps the
+# revoked families of the table in a Bloom filter: "not in the filter" is
+# certain and free, and only a hit (a revoked family or a rare false
+# positive) is confirmed against the table. The filter is rebuilt from the
+# table every REFRESH_SECONDS, which also drops families whose tokens have
+# all expired; families revoked in this process are added at once. One
+# thread rebuilds while the others keep checking against the old filter.
+
+REFRESH_TOKEN_TTL = timedelta(days=14)
+REFRESH_SECONDS = 15.0
+# 128 KiB of bits and 7 probes: about 1% false positives at 100k revoked families
+BLOOM_BITS = 1 << 20
+BLOOM_HASHES = 7
+
+
+class BloomFilter:
+    def __init__(self, num_bits: int = BLOOM_BITS, num_hashes: int = BLOOM_HASHES):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(num_bits // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing: k probes from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+_lock = threading.Lock()
+_rebuilt = threading.Condition(_lock)
+_revoked = BloomFilter()
+# Families revoked in this process since the last rebuild; carried into the
+# next filter in case its query ran before their revocation committed
+_recent = []
+_loaded_at = None
+_rebuilding = False
+_stats = {
+    "rebuilds": 0,
+    "checks": 0,
+    "filter_hits": 0,
+    "false_positives": 0,
+    "rotations": 0,
+    "reuse_detected": 0,
+}
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def rebuild(db: Session):
+    """Reload the filter with the families that still have unexpired revoked tokens"""
+    global _revoked, _recent, _loaded_at
+    families = db.query(models.RefreshToken.family_id).filter(
+        models.RefreshToken.revoked_at.is_not(None),
+        models.RefreshToken.expires_at > datetime.utcnow()
+    ).distinct().all()
+    revoked = BloomFilter()
+    for (family_id,) in families:
+        revoked.add(family_id)
+    with _lock:
+        for family_id in _recent:
+            revoked.add(family_id)
+        _revoked = revoked
+        _recent = []
+        _loaded_at = time.monotonic()
+        _stats["rebuilds"] += 1
+
+def _ensure_fresh():
+    """Rebuild a stale filter; only one thread rebuilds, the others use the old filter meanwhile"""
+    global _rebuilding
+    with _lock:
+        while True:
+            if _loaded_at is not None and time.monotonic() - _loaded_at < REFRESH_SECONDS:
+                return
+            if not _rebuilding:
+                _rebuilding = True
+                break
+            if _loaded_at is not None:
+                return
+            # Nothing loaded yet: wait for the first rebuild
+            _rebuilt.wait()
+    try:
+        db = database.SessionLocal()
+        try:
+            rebuild(db)
+        finally:
+            db.close()
+    finally:
+        with _lock:
+            _rebuilding = False
+            _rebuilt.notify_all()
+
+def is_family_revoked(db: Session, family_id: str) -> bool:
+    """True if the family was revoked; a query only when the filter reports a hit"""
+    _ensure_fresh()
+    with _lock:
+        _stats["checks"] += 1
+        if family_id not in _revoked:
+            return False
+        _stats["filter_hits"] += 1
+    revoked = db.query(models.RefreshToken.id).filter(
+        models.RefreshToken.family_id == family_id,
+        models.RefreshToken.revoked_at.is_not(None)
+    ).first() is not None
+    if not revoked:
+        with _lock:
+            _stats["false_positives"] += 1
+    return revoked
+
+def _insert(db: Session, user: models.User, family_id: str, now: datetime) -> str:
+    token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        token_hash=_hash(token),
+        family_id=family_id,
+        user_id=user.id,
+        token_version=user.token_version or 0,
+        created_at=now,
+        expires_at=now + REFRESH_TOKEN_TTL
+    ))
+    return token
+
+def issue(db: Session, user: models.User) -> Tuple[str, str]:
+    """Start a new family for a login; returns (refresh_token, family_id). Caller commits."""
+    now = datetime.utcnow()
+    # Expired tokens of this user are dropped here, which keeps the table bounded
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user.id,
+        models.RefreshToken.expires_at < now
+    ).delete(synchronize_session=False)
+    family_id = secrets.token_hex(16)
+    return _insert(db, user, family_id, now), family_id
+
+def revoke_family(db: Session, family_id: str):
+    """Revoke every token of the family; caller commits"""
+    db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.family_id == family_id, models.RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    with _lock:
+        # Set before the commit; a hit is confirmed against the table anyway
+        _revoked.add(family_id)
+        _recent.append(family_id)
+
+def _invalid_token():
+    return HTTPException(status_code=401, detail="Invalid refresh token")
+
+def rotate(db: Session, token: str) -> Tuple[models.User, str, str]:
+    """Use a refresh token once; returns (user, new_refresh_token, family_id). Caller commits.
+
+    Presenting a token that was already rotated revokes its family, commits
+    that and raises 401.
+    """
+    now = datetime.utcnow()
+    found = db.query(models.RefreshToken, models.User).join(
+        models.User, models.User.id == models.RefreshToken.user_id
+    ).filter(models.RefreshToken.token_hash == _hash(token)).first()
+    if found is None:
+        raise _invalid_token()
+    record, user = found
+    if record.revoked_at is not None or record.expires_at <= now:
+        raise _invalid_token()
+    if user.is_active is False:
+        raise HTTPException(status_code=403, detail="User account is deactivated")
+    if record.token_version != (user.token_version or 0):
+        # The user's tokens were revoked after this one was issued
+        raise _invalid_token()
+
+    # Claim it; a concurrent refresh with the same token finds used_at set
+    claimed = db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.id == record.id, models.RefreshToken.used_at.is_(None))
+        .values(used_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        revoke_family(db, record.family_id)
+        db.commit()
+        with _lock:
+            _stats["reuse_detected"] += 1
+        raise _invalid_token()
+
+    with _lock:
+        _stats["rotations"] += 1
+    return user, _insert(db, user, record.family_id, now), record.family_id
+
+def revoke(db: Session, token: str) -> Optional[str]:
+    """Revoke the family of a refresh token (logout); returns the family id, or None if unknown"""
+    family_id = db.query(models.RefreshToken.family_id).filter(
+        models.RefreshToken.token_hash == _hash(token)
+    ).scalar()
+    if family_id is not None:
+        revoke_family(db, family_id)
+    return family_id
+
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "filter_entries": _revoked.count,
+            "filter_bits": _revoked.num_bits,
+            "age_seconds": round(time.monotonic() - _loaded_at, 1) if _loaded_at is not None else None,
+            "refresh_seconds": REFRESH_SECONDS,
+        }
@@ -0,0 +1,127 @@
+# app/revocation.py
+
+import threading
+import time
+from typing import Dict, Set
+from sqlalchemy import event, or_, update
+from sqlalchemy.orm import Session
+from app import models, database
+
+# Access token revocation table.
+# Tokens carry the user's id, role and token_version ("uid", "role", "ver"),
+# so read-only routes can authorize from the claims alone. To keep
+# revocation correct without a query per request, each process holds a
+# small table of the users whose tokens are not all valid: those with a
+# non-zero token_version (any token with an older "ver" is revoked) and
+# deactivated users (all their tokens are). It is reloaded from the users
+# table every REFRESH_SECONDS, lazily by the first request that needs it,
+# and right after a revocation commits in this process. One thread reloads
+# while the others keep using the old table; after a revocation (or before
+# the first load) there is no usable table, and they wait for the reload.
+
+REFRESH_SECONDS = 15.0
+
+_lock = threading.Lock()
+_versions: Dict[int, int] = {}
+_inactive: Set[int] = set()
+# Users deleted by this process; the users table cannot report deleted rows,
+# so other processes accept such tokens until they expire
+_deleted: Set[int] = set()
+_loaded_at = None
+_refreshes = 0
+_refreshed = threading.Condition(_lock)
+_refreshing = False
+# Bumped by each revocation; a reload whose query may predate one does not count as fresh
+_generation = 0
+
+
+def refresh(db: Session):
+    """Reload the table from the users table (one query over the few users it covers)"""
+    global _versions, _inactive, _loaded_at, _refreshes
+    with _lock:
+        generation = _generation
+    rows = db.query(models.User.id, models.User.token_version, models.User.is_active).filter(
+        or_(models.User.token_version > 0, models.User.is_active.is_(False))
+    ).all()
+    with _lock:
+        _versions = {user_id: version for user_id, version, _ in rows if version}
+        _inactive = {user_id for user_id, _, is_active in rows if is_active is False}
+        _loaded_at = time.monotonic() if generation == _generation else None
+        _refreshes += 1
+
+def _ensure_fresh():
+    global _refreshing
+    with _lock:
+        while True:
+            if _loaded_at is not None and time.monotonic() - _loaded_at < REFRESH_SECONDS:
+                return
+            if not _refreshing:
+                _refreshing = True
+                break
+            if _loaded_at is not None:
+                return
+            _refreshed.wait()
+    try:
+        db = database.SessionLocal()
+        try:
+            refresh(db)
+        finally:
+            db.close()
+    finally:
+        with _lock:
+            _refreshing = False
+            _refreshed.notify_all()
+
+def is_inactive(user_id: int) -> bool:
+    _ensure_fresh()
+    with _lock:
+        return user_id in _inactive or user_id in _deleted
+
+def is_revoked(user_id: int, token_version: int) -> bool:
+    """True if a token for `user_id` issued at `token_version` has been revoked"""
+    _ensure_fresh()
+    with _lock:
+        return token_version != _versions.get(user_id, 0)
+
+def revoke_tokens(db: Session, user_id: int):
+    """Bump the user's token_version so every token issued so far is rejected; caller commits"""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values({models.User.token_version: models.User.token_version + 1})
+        .execution_options(synchronize_session=False)
+    )
+    reload_after_commit(db)
+
+def reload_after_commit(db: Session):
+    """Reload the table in this process once `db` commits (e.g. after reactivating a user)"""
+    db.info["revoked_tokens"] = True
+
+def forget_user(user_id: int):
+    """Reject the tokens of a user whose row was just deleted"""
+    with _lock:
+        _deleted.add(user_id)
+
+@event.listens_for(Session, "after_commit")
+def _reload_after_revocation(session):
+    global _loaded_at, _generation
+    if session.info.pop("revoked_tokens", False):
+        # The next check reloads the table, so this process applies the change at once
+        with _lock:
+            _loaded_at = None
+            _generation += 1
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revocation(session):
+    session.info.pop("revoked_tokens", None)
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "users_with_version": len(_versions),
+            "inactive_users": len(_inactive),
+            "deleted_users": len(_deleted),
+            "refreshes": _refreshes,
+            "age_seconds": round(time.monotonic() - _loaded_at, 1) if _loaded_at is not None else None,
+            "refresh_seconds": REFRESH_SECONDS,
+        }
@@ -3,14 +3,14 @@ from sqlalchemy.orm import Session
 from typing import List
 
 from .. import crud, schemas, database
-from ..auth import get_current_user
+from ..auth import Principal, get_current_principal, get_token_principal
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.AddressOut])
 def get_addresses(
-    current_user: schemas.UserOut = Depends(get_current_user),
+    current_user: Principal = Depends(get_token_principal),
     db: Session = Depends(database.get_db)
 ):
     """Get all addresses for the current user"""
@@ -21,7 +21,7 @@ def get_addresses(
 @router.post("", response_model=schemas.AddressOut)
 def create_address(
     address: schemas.AddressCreate,
-    current_user: schemas.UserOut = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(database.get_db)
 ):
     """Create a new address for the current user"""
@@ -31,7 +31,7 @@ def create_address(
 @router.get("/{address_id}", response_model=schemas.AddressOut)
 def get_address(
     address_id: int,
-    current_user: schemas.UserOut = Depends(get_current_user),
+    current_user: Principal = Depends(get_token_principal),
     db: Session = Depends(database.get_db)
 ):
     """Get a specific address by ID"""
@@ -45,7 +45,7 @@ def get_address(
 def update_address(
     address_id: int,
     address: schemas.AddressUpdate,
-    current_user: schemas.UserOut = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(database.get_db)
 ):
     """Update a specific address"""
@@ -60,7 +60,7 @@ def update_address(
 @router.delete("/{address_id}")
 def delete_address(
     address_id: int,
-    current_user: schemas.UserOut = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(database.get_db)
 ):
     """Delete a specific address"""
@@ -1,10 +1,12 @@
 # app/routes/admin.py
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy import func, and_
 from typing import List, Optional
-from app import schemas, crud, database, auth, models
+from datetime import datetime
+from app import schemas, crud, database, auth, models, cache, conditional, images, storage, upload_gc, flash_sale, stock_shards, order_history, pagination, passwords, revocation, refresh_tokens, rate_limit
+from app import search as search_index
 from app.models import UserRole, OrderStatus
 
 router = APIRouter(
@@ -78,7 +80,7 @@ def list_all_users(
 def create_admin_user(
     user_data: schemas.AdminUserCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.require_super_admin)
+    current_user: auth.Principal = Depends(auth.require_super_admin)
 ):
     """Create a new admin user (Super Admin only)"""
     # Check if user exists
@@ -119,10 +121,19 @@ def update_user(
         raise HTTPException(status_code=404, detail="User not found")
     
     # Update fields
-    for field, value in user_data.dict(exclude_unset=True).items():
+    changes = user_data.dict(exclude_unset=True)
+    was_active = user.is_active is not False
+    for field, value in changes.items():
         setattr(user, field, value)
+    if "is_active" in changes and changes["is_active"] is not was_active:
+        if was_active:
+            # Tokens issued so far stay revoked if the account is reactivated
+            revocation.revoke_tokens(db, user_id)
+        else:
+            revocation.reload_after_commit(db)
     
     db.commit()
+    cache.invalidate_user(user_id)
     db.refresh(user)
     return user
 
@@ -130,7 +141,7 @@ def update_user(
 def delete_user(
     user_id: int,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.require_admin)
+    current_user: auth.Principal = Depends(auth.require_admin)
 ):
     """Deactivate user account"""
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -143,7 +154,9 @@ def delete_user(
     
     # Deactivate instead of delete
     user.is_active = False
+    revocation.revoke_tokens(db, user_id)
     db.commit()
+    cache.invalidate_user(user_id)
     
     return {"message": "User deactivated successfully"}
 
@@ -166,10 +179,7 @@ def list_all_products(
         query = query.filter(models.Product.is_active == True)
     
     if search:
-        query = query.filter(
-            models.Product.name.ilike(f"%{search}%") |
-            models.Product.description.ilike(f"%{search}%")
-        )
+        query = query.filter(models.Product.id.in_(search_index.matching_ids(db, search)))
     
     if category:
         query = query.filter(models.Product.category == category)
@@ -187,7 +197,11 @@ def create_product(
 ):
     """Create a new product"""
     db_product = models.Product(**product_data.dict())
+    images.attach_variants(db, db_product)
     db.add(db_product)
+    db.flush()
+    search_index.index_product(db, db_product)
+    conditional.bump(db, *conditional.product_scopes(db_product.id))
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -204,10 +218,22 @@ def update_product(
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Update fields
-    for field, value in product_data.dict(exclude_unset=True).items():
+    old_image = product.image
+    updates = product_data.dict(exclude_unset=True)
+    quantity = updates.pop("quantity", None)
+    for field, value in updates.items():
         setattr(product, field, value)
+    if quantity is not None:
+        stock_shards.set_quantity(db, product_id, quantity)
+    if "image" in updates:
+        images.attach_variants(db, product)
+    search_index.index_product(db, product)
+    conditional.bump(db, *conditional.product_scopes(product_id))
     
     db.commit()
+    cache.invalidate_product(product_id)
+    if old_image != product.image:
+        storage.release(db, [old_image])
     db.refresh(product)
     return product
 
@@ -222,42 +248,131 @@ def delete_product(
         raise HTTPException(status_code=404, detail="Product not found")
     
     product.is_active = False
+    conditional.bump(db, *conditional.product_scopes(product_id))
     db.commit()
+    cache.invalidate_product(product_id)
     
     return {"message": "Product deactivated successfully"}
 
+@router.put("/products/{product_id}/flash-sale", response_model=schemas.ProductOut)
+def set_flash_sale(
+    product_id: int,
+    toggle: schemas.FlashSaleToggle,
+    db: Session = Depends(database.get_db)
+):
+    """Turn flash-sale mode (serialized, batched checkout) on or off for a product"""
+    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    product.flash_sale = toggle.enabled
+    conditional.bump(db, *conditional.product_scopes(product_id))
+    db.commit()
+    cache.invalidate_product(product_id)
+    db.refresh(product)
+    return product
+
+@router.get("/security/password-hashing")
+def get_password_hashing_metrics():
+    """Password pool load for this worker: queue depth, rejections, rehashes and job time"""
+    return passwords.stats()
+
+@router.get("/security/rate-limits")
+def get_rate_limit_metrics():
+    """Requests allowed and rejected (429) per route group by this worker"""
+    return rate_limit.stats()
+
+@router.get("/flash-sale/metrics")
+def get_flash_sale_metrics(db: Session = Depends(database.get_db)):
+    """Per-product checkout queue depth and batch sizes for this worker"""
+    enabled = [product_id for (product_id,) in db.query(models.Product.id).filter(models.Product.flash_sale.is_(True))]
+    return {"enabled_products": enabled, "queues": flash_sale.stats()}
+
+def _stock_shards_out(db: Session, product_id: int) -> schemas.StockShardsOut:
+    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return schemas.StockShardsOut(
+        product_id=product.id,
+        shard_count=product.stock_shard_count,
+        quantity=product.quantity or 0,
+        base_quantity=product.base_quantity or 0,
+        reserved_quantity=product.reserved_quantity,
+        shards=stock_shards.get_shards(db, product_id)
+    )
+
+def _commit_stock_change(db: Session, product_id: int):
+    conditional.bump(db, *conditional.product_scopes(product_id))
+    db.commit()
+    cache.invalidate_product(product_id)
+
+@router.get("/products/{product_id}/stock-shards", response_model=schemas.StockShardsOut)
+def get_stock_shards(product_id: int, db: Session = Depends(database.get_db)):
+    """A product's stock layout: column, reservations and per-shard stock"""
+    return _stock_shards_out(db, product_id)
+
+@router.put("/products/{product_id}/stock-shards", response_model=schemas.StockShardsOut)
+def configure_stock_shards(
+    product_id: int,
+    config: schemas.StockShardConfig,
+    db: Session = Depends(database.get_db)
+):
+    """Split a hot product's stock into N shards, or compact it back into one column with 0"""
+    stock_shards.configure(db, product_id, config.shards)
+    _commit_stock_change(db, product_id)
+    return _stock_shards_out(db, product_id)
+
+@router.post("/products/{product_id}/stock-shards/rebalance", response_model=schemas.StockShardsOut)
+def rebalance_stock_shards(product_id: int, db: Session = Depends(database.get_db)):
+    """Spread a sharded product's free stock evenly over its shards"""
+    stock_shards.rebalance(db, product_id)
+    _commit_stock_change(db, product_id)
+    return _stock_shards_out(db, product_id)
+
+# Order Management
+def _created_keyset(query, model, cursor: Optional[str], created_from: Optional[datetime], created_to: Optional[datetime]):
+    """Filter `query` to a created_at range and order it newest first from `cursor`"""
+    if created_from is not None:
+        query = query.filter(model.created_at >= created_from)
+    if created_to is not None:
+        query = query.filter(model.created_at < created_to)
+    after = pagination.decode_time_cursor(cursor) if cursor else None
+    return pagination.apply_keyset(query, [model.created_at, model.id], after, descending=True)
+
+def _page(response: Response, query, limit: int):
+    """Fetch one page of a _created_keyset query; the next cursor goes in X-Next-Cursor"""
+    rows, has_more = pagination.split_page(query.limit(limit + 1).all(), limit)
+    if has_more:
+        response.headers["X-Next-Cursor"] = pagination.encode_time_cursor(rows[-1].created_at, rows[-1].id)
+    return rows
+
 # Order Management
 @router.get("/orders", response_model=List[schemas.OrderOut])
 def list_all_orders(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
     status: Optional[OrderStatus] = None,
     user_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
     db: Session = Depends(database.get_db)
 ):
-    """Get all orders with filtering"""
-    # Simplified query without complex joins to debug
-    query = db.query(models.Order)
-    
+    """List orders newest first, with filtering and cursor pagination.
+
+    Users, items and products are loaded eagerly, so a page costs two
+    queries. The next page's cursor is returned in the X-Next-Cursor header.
+    """
+    query = db.query(models.Order).options(
+        joinedload(models.Order.user),
+        selectinload(models.Order.order_items).joinedload(models.OrderItem.product)
+    )
     if status:
         query = query.filter(models.Order.status == status)
-    
     if user_id:
         query = query.filter(models.Order.user_id == user_id)
-    
-    orders = query.offset(skip).limit(limit).all()
-    
-    # Manually load relationships
-    for order in orders:
-        # Load user
-        order.user = db.query(models.User).filter(models.User.id == order.user_id).first()
-        # Load order items
-        order.order_items = db.query(models.OrderItem).filter(models.OrderItem.order_id == order.id).all()
-        # Load products for each order item
-        for item in order.order_items:
-            item.product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-    
-    return orders
+    query = _created_keyset(query, models.Order, cursor, created_from, created_to)
+    return _page(response, query, limit)
 
 @router.put("/orders/{order_id}/status")
 def update_order_status(
@@ -270,7 +385,9 @@ def update_order_status(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    order.status = status_data.status
+    # The column stores model enum names, so convert from the API enum
+    order.status = OrderStatus(status_data.status.value)
+    order_history.set_status(db, order_id, order.status)
     db.commit()
     db.refresh(order)
     return {"message": "Order status updated successfully"}
@@ -576,38 +693,55 @@ def get_inventory_stats(
         "products_by_category": products_by_category
     }
 
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Get in-process cache hit/miss/eviction counters for this worker"""
+    return {
+        "products": cache.product_cache.stats(),
+        "principals": cache.principal_cache.stats(),
+        "tokens": cache.token_cache.stats(),
+        "revocation": revocation.stats(),
+        "refresh_token_families": refresh_tokens.stats(),
+    }
+
+# Upload storage
+@router.get("/storage/report")
+def get_storage_report(db: Session = Depends(database.get_db)):
+    """Storage usage of uploads and what the next garbage collection would do"""
+    return upload_gc.collect(db, dry_run=True)
+
+@router.post("/storage/gc")
+def collect_orphaned_uploads(db: Session = Depends(database.get_db)):
+    """Quarantine orphaned uploads and purge expired quarantine"""
+    return upload_gc.collect(db)
+
 # Review Management
-@router.get("/reviews")
+@router.get("/reviews", response_model=List[schemas.AdminReviewOut])
 def list_all_reviews(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
     is_approved: Optional[bool] = None,
     product_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
     db: Session = Depends(database.get_db)
 ):
-    """Get all reviews with filtering for admin moderation"""
-    
-    query = db.query(models.Review)
-    
+    """List reviews newest first for admin moderation, with filtering and cursor pagination.
+
+    Reviewer and product come from the same joined query. The next page's
+    cursor is returned in the X-Next-Cursor header.
+    """
+    query = db.query(models.Review).options(
+        joinedload(models.Review.user).load_only(models.User.id, models.User.username, models.User.email),
+        joinedload(models.Review.product).load_only(models.Product.id, models.Product.name)
+    )
     if is_approved is not None:
         query = query.filter(models.Review.is_approved == is_approved)
-    
     if product_id:
         query = query.filter(models.Review.product_id == product_id)
-    
-    reviews = query.order_by(models.Review.created_at.desc()).offset(skip).limit(limit).all()
-    
-    # Add user and product info
-    for review in reviews:
-        user = db.query(models.User).filter(models.User.id == review.user_id).first()
-        product = db.query(models.Product).filter(models.Product.id == review.product_id).first()
-        
-        if user:
-            review.user = {"id": user.id, "username": user.username, "email": user.email}
-        if product:
-            review.product = {"id": product.id, "name": product.name}
-    
-    return reviews
+    query = _created_keyset(query, models.Review, cursor, created_from, created_to)
+    return _page(response, query, limit)
 
 @router.put("/reviews/{review_id}/approve")
 def approve_review(
@@ -621,6 +755,12 @@ def approve_review(
         raise HTTPException(status_code=404, detail="Review not found")
     
     review.is_approved = not review.is_approved
+    crud.apply_review_rating_change(
+        db, review.product_id,
+        old_rating=None if review.is_approved else review.rating,
+        new_rating=review.rating if review.is_approved else None
+    )
+    conditional.bump(db, *conditional.review_scopes(review.product_id))
     db.commit()
     
     status = "approved" if review.is_approved else "disapproved"
@@ -637,11 +777,24 @@ def delete_review_admin(
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
     
+    crud.apply_review_rating_change(
+        db, review.product_id, old_rating=review.rating if review.is_approved else None
+    )
+    conditional.bump(db, *conditional.review_scopes(review.product_id))
     db.delete(review)
     db.commit()
     
     return {"message": "Review deleted successfully"}
 
+@router.post("/reviews/rebuild-aggregates")
+def rebuild_review_aggregates(
+    product_id: Optional[int] = None,
+    db: Session = Depends(database.get_db)
+):
+    """Recompute denormalized product rating aggregates from the reviews table"""
+    updated = crud.rebuild_rating_aggregates(db, product_id=product_id)
+    return {"message": f"Rebuilt rating aggregates for {updated} products"}
+
 @router.get("/reviews/stats")
 def get_review_stats(
     db: Session = Depends(database.get_db)
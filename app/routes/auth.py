@@ -1,9 +1,10 @@
 # app/routes/auth.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from app import schemas, crud, database, auth, models
+from starlette.concurrency import run_in_threadpool
+from app import schemas, crud, database, auth, models, passwords, refresh_tokens, rate_limit
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(
@@ -12,22 +13,56 @@ router = APIRouter(
 )
 
 #  Register new user
+# Async so the bcrypt work is awaited rather than holding a threadpool thread;
+# database calls still run in the threadpool
 @router.post("/register", response_model=schemas.UserOut)
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = crud.get_user_by_username(db, user.username)
+async def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    db_user = await run_in_threadpool(crud.get_user_by_username, db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_password = auth.hash_password(user.password)
-    return crud.create_user(db, user, hashed_password)
+    hashed_password = await passwords.hash_password(user.password)
+    return await run_in_threadpool(crud.create_user, db, user, hashed_password)
+
+def _issue_tokens(db: Session, user: models.User):
+    refresh_token, family_id = refresh_tokens.issue(db, user)
+    access_token = auth.create_user_token(user, family_id)
+    db.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 #  Login user
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    # Throttled per account and client before any bcrypt work (429 with Retry-After)
+    ip = rate_limit.client_ip(request.scope)
+    await rate_limit.check_login(form_data.username, ip)
+    user = await run_in_threadpool(crud.get_user_by_username, db, form_data.username)
+    valid, new_hash = await passwords.verify_and_update(form_data.password, user.hashed_password if user else None)
+    if not valid:
+        await rate_limit.login_failed(form_data.username, ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    access_token = auth.create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    await rate_limit.login_succeeded(form_data.username, ip)
+    user_id = user.id
+    tokens = await run_in_threadpool(_issue_tokens, db, user)
+    if new_hash is not None:
+        # Stored with a different cost factor: upgrade it now that we know the password
+        await run_in_threadpool(crud.set_password_hash, db, user_id, new_hash)
+    return tokens
+
+#  Trade a refresh token for a new access/refresh pair (no password check)
+@router.post("/refresh")
+def refresh(request: schemas.RefreshTokenRequest, db: Session = Depends(database.get_db)):
+    user, refresh_token, family_id = refresh_tokens.rotate(db, request.refresh_token)
+    access_token = auth.create_user_token(user, family_id)
+    db.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+#  Logout: revoke the refresh token's family and the access tokens issued from it
+@router.post("/logout")
+def logout(request: schemas.RefreshTokenRequest, db: Session = Depends(database.get_db)):
+    if refresh_tokens.revoke(db, request.refresh_token) is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    db.commit()
+    return {"message": "Logged out successfully"}
 
 #  Get current user
 @router.get("/me")
@@ -126,7 +161,7 @@ def update_current_user_profile(
 #  Get user profile statistics
 @router.get("/profile/stats")
 def get_user_profile_stats(
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_token_principal),
     db: Session = Depends(database.get_db)
 ):
     # Get total orders count
@@ -1,70 +1,125 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.orm import Session
-from app import schemas, crud, database, auth, models
-from typing import List
+from app import schemas, crud, database, auth, cache, idempotency, inventory
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/cart",
     tags=["Cart"]
 )
 
+def _with_products(db: Session, cart_items):
+    """Attach cached product snapshots instead of lazy-loading cart_item.product per row"""
+    products = cache.get_many(db, [item.product_id for item in cart_items])
+    return [
+        schemas.CartItemOut(
+            id=item.id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            product=products[item.product_id]
+        )
+        for item in cart_items if item.product_id in products
+    ]
+
+def _cart_item_out(row) -> schemas.CartItemOut:
+    return schemas.CartItemOut(
+        id=row.CartItem.id,
+        product_id=row.CartItem.product_id,
+        quantity=row.CartItem.quantity,
+        product=schemas.ProductOut.model_validate(row.Product),
+        available=bool(row.available)
+    )
+
+def _cart_out(db: Session, user_id: int) -> schemas.CartOut:
+    rows = crud.get_cart(db, user_id)
+    items = [_cart_item_out(row) for row in rows]
+    return schemas.CartOut(
+        items=items,
+        item_count=rows[0].item_count if rows else 0,
+        subtotal=round(rows[0].subtotal, 2) if rows else 0.0,
+        all_available=all(item.available for item in items)
+    )
+
+@router.patch("", response_model=schemas.CartOut)
+def update_cart(batch: schemas.CartBatchUpdate, current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    """Apply many add/set/remove operations in one transaction and return the resulting cart"""
+    crud.apply_cart_operations(db, current_user.id, batch.operations)
+    return _cart_out(db, current_user.id)
+
 @router.post("/add", response_model=schemas.CartItemOut)
-def add_item_to_cart(item: schemas.CartItemCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    return crud.add_to_cart(db, user_id=current_user.id, item=item)
+def add_item_to_cart(item: schemas.CartItemCreate, current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    if not cache.get_product(db, item.product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    cart_item = crud.add_to_cart(db, user_id=current_user.id, item=item)
+    return _with_products(db, [cart_item])[0]
 
 @router.get("/", response_model=List[schemas.CartItemOut])
-def view_cart(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    return crud.get_cart_items(db, user_id=current_user.id)
+def view_cart(current_user: auth.Principal = Depends(auth.get_token_principal), db: Session = Depends(database.get_db)):
+    return [_cart_item_out(row) for row in crud.get_cart(db, current_user.id)]
+
+@router.get("/details", response_model=schemas.CartOut)
+def view_cart_with_totals(current_user: auth.Principal = Depends(auth.get_token_principal), db: Session = Depends(database.get_db)):
+    """Cart lines with availability plus item count and subtotal computed in SQL"""
+    return _cart_out(db, current_user.id)
+
+@router.get("/summary", response_model=schemas.CartSummary)
+def cart_summary(current_user: auth.Principal = Depends(auth.get_token_principal), db: Session = Depends(database.get_db)):
+    """Item count and subtotal only, for header badges"""
+    summary = crud.get_cart_summary(db, current_user.id)
+    return schemas.CartSummary(
+        line_count=summary.line_count,
+        item_count=summary.item_count,
+        subtotal=round(summary.subtotal, 2)
+    )
 
 @router.delete("/remove/{cart_item_id}")
-def remove_item(cart_item_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    deleted = crud.remove_cart_item(db, cart_item_id)
+def remove_item(cart_item_id: int, current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    deleted = crud.remove_cart_item(db, current_user.id, cart_item_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Cart item not found")
     return {"detail": "Item removed from cart"}
 
 @router.put("/update/{cart_item_id}", response_model=schemas.CartItemOut)
-def update_cart_item(cart_item_id: int, quantity: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    updated_item = crud.update_cart_item_quantity(db, cart_item_id, quantity)
+def update_cart_item(cart_item_id: int, quantity: int, current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    updated_item = crud.update_cart_item_quantity(db, current_user.id, cart_item_id, quantity)
     if not updated_item:
         raise HTTPException(status_code=404, detail="Cart item not found")
-    return updated_item
+    return _with_products(db, [updated_item])[0]
 
-@router.post("/checkout", response_model=schemas.OrderOut)
-def checkout(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    # Get cart items
-    cart_items = crud.get_cart_items(db, user_id=current_user.id)
-    if not cart_items:
+@router.post("/reserve", response_model=schemas.CartReservationOut)
+def reserve_cart(current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    """Hold stock for every cart line until checkout (or expiry); all or nothing"""
+    quantities = {}
+    for item in crud.get_cart_items(db, user_id=current_user.id):
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    if not quantities:
         raise HTTPException(status_code=400, detail="Cart is empty")
-    
-    # Calculate total and create order items
-    total_price = 0
-    order_items = []
-    for cart_item in cart_items:
-        item_total = cart_item.product.price * cart_item.quantity
-        total_price += item_total
-        order_items.append(schemas.OrderItemCreate(
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
-        ))
-    
-    # Create order
-    order_data = schemas.OrderCreate(total_price=total_price, items=order_items)
-    order = crud.create_order(db, current_user.id, order_data)
-    
-    # Clear cart
-    crud.clear_cart(db, current_user.id)
-    
-    return order
+    try:
+        expires_at = inventory.hold(db, current_user.id, quantities)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return schemas.CartReservationOut(expires_at=expires_at, holds=inventory.get_holds(db, current_user.id))
+
+@router.delete("/reserve", response_model=schemas.CartReservationOut)
+def release_cart_reservation(current_user: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(database.get_db)):
+    """Give up the stock held for this cart"""
+    inventory.release(db, current_user.id)
+    db.commit()
+    return schemas.CartReservationOut(holds=[])
 
-@router.post("/cleanup-duplicates")
-def cleanup_duplicate_cart_items(current_username: str = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    """Clean up duplicate cart items for the current user"""
-    user = crud.get_user_by_username(db, current_username)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    removed_count = crud.cleanup_duplicate_cart_items(db, user.id)
-    return {"message": f"Cleaned up {removed_count} duplicate cart items"}
+@router.post("/checkout", response_model=schemas.OrderOut)
+def checkout(
+    idempotency_key: Optional[str] = Header(None),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    """Place an order for the whole cart: priced server-side, stock reserved, cart cleared, one commit"""
+    return idempotency.execute(
+        db, current_user.id, "POST /cart/checkout", idempotency_key, None,
+        lambda record: schemas.OrderOut.model_validate(crud.checkout_cart(
+            db, current_user.id, before_commit=crud.order_recorder(record)
+        ))
+    )
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, Query, Response
 from sqlalchemy.orm import Session
-from app import schemas, crud, database, auth, models
-from typing import List
+from app import schemas, crud, database, auth, idempotency, order_history
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/orders",
@@ -9,9 +9,37 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.OrderOut)
-def place_order(order: schemas.OrderCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    return crud.create_order(db, current_user.id, order)
+def place_order(
+    order: schemas.OrderCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: auth.Principal = Depends(auth.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    return idempotency.execute(
+        db, current_user.id, "POST /orders", idempotency_key, order,
+        lambda record: schemas.OrderOut.model_validate(crud.create_order(
+            db, current_user.id, order, before_commit=crud.order_recorder(record)
+        ))
+    )
 
 @router.get("/", response_model=List[schemas.OrderOut])
-def list_orders(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+def list_orders(current_user: auth.Principal = Depends(auth.get_token_principal), db: Session = Depends(database.get_db)):
     return crud.get_user_orders(db, current_user.id)
+
+@router.get("/history", response_model=List[schemas.OrderHistoryOut])
+def order_history_page(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(order_history.DEFAULT_PAGE_SIZE, ge=1, le=order_history.MAX_PAGE_SIZE),
+    current_user: auth.Principal = Depends(auth.get_token_principal),
+    db: Session = Depends(database.get_db)
+):
+    """The user's order history, newest first, from the order history read model.
+
+    The cursor for the next page is returned in the X-Next-Cursor header;
+    pass it back as `cursor` to continue.
+    """
+    orders, next_cursor = order_history.page(db, current_user.id, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return orders
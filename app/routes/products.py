@@ -1,10 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
 from sqlalchemy.orm import Session
-from app import schemas, crud, database
+from starlette.concurrency import run_in_threadpool
+from app import schemas, crud, database, search, cache, conditional, storage
 from typing import List, Optional
-import os
-import uuid
-from pathlib import Path
 
 router = APIRouter(
     prefix="/products",
@@ -29,35 +27,8 @@ async def create_product_with_image(
     image_url = None
     
     if image:
-        # Validate file type
-        allowed_extensions = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
-        file_extension = Path(image.filename).suffix.lower()
-        
-        if file_extension not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
-            )
-        
-        # Validate file size (max 5MB)
-        file_content = await image.read()
-        if len(file_content) > 5 * 1024 * 1024:  # 5MB
-            raise HTTPException(status_code=400, detail="File too large. Max size is 5MB")
-        
-        # Create uploads directory if it doesn't exist
-        upload_dir = Path("uploads/products")
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        # Set image URL
-        image_url = f"/uploads/products/{unique_filename}"
+        stored = await storage.save_image_upload(image)
+        image_url = stored.url
     
     # Create product
     product_data = schemas.ProductCreate(
@@ -71,12 +42,69 @@ async def create_product_with_image(
     return crud.create_product(db, product_data)
 
 @router.get("/", response_model=List[schemas.ProductOut])
-def list_products(db: Session = Depends(database.get_db)):
-    return crud.get_all_products(db)
+def list_products(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: Optional[bool] = None,
+    is_active: Optional[bool] = True,
+    sort: schemas.ProductSort = schemas.ProductSort.NAME,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    db: Session = Depends(database.get_db)
+):
+    """List products with filtering, sorting and cursor pagination.
+
+    The cursor for the next page is returned in the X-Next-Cursor header;
+    pass it back as `cursor` (with the same filters and sort) to continue.
+    """
+    scopes = conditional.catalog_read_scopes() + (["reviews"] if sort == schemas.ProductSort.RATING else [])
+    not_modified = conditional.check(request, response, db, scopes, key=str(request.url.query))
+    if not_modified:
+        return not_modified
+
+    products, next_cursor = crud.get_products(
+        db,
+        category=category,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+        is_active=is_active,
+        sort=sort,
+        cursor=cursor,
+        limit=limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return products
+
+@router.get("/search", response_model=List[schemas.ProductSearchHit])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(database.get_db)
+):
+    """Full-text product search, best matches first, with highlighted name and description snippet"""
+    results = search.search_products(db, q, skip=skip, limit=limit)
+    return [
+        schemas.ProductSearchHit(
+            **schemas.ProductOut.model_validate(product).model_dump(),
+            score=score,
+            name_highlight=name_highlight,
+            snippet=snippet
+        )
+        for product, score, name_highlight, snippet in results
+    ]
 
 @router.get("/{product_id}", response_model=schemas.ProductOut)
-def get_product(product_id: int, db: Session = Depends(database.get_db)):
-    db_product = crud.get_product_by_id(db, product_id)
+def get_product(product_id: int, request: Request, response: Response, db: Session = Depends(database.get_db)):
+    not_modified = conditional.check(request, response, db, conditional.product_read_scopes(product_id))
+    if not_modified:
+        return not_modified
+    db_product = cache.get_product(db, product_id)
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     return db_product
@@ -101,55 +129,14 @@ async def update_product_image(
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Validate file type
-    allowed_extensions = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
-    file_extension = Path(image.filename).suffix.lower()
-    
-    if file_extension not in allowed_extensions:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
-        )
-    
-    # Validate file size (max 5MB)
-    file_content = await image.read()
-    if len(file_content) > 5 * 1024 * 1024:  # 5MB
-        raise HTTPException(status_code=400, detail="File too large. Max size is 5MB")
+    stored = await storage.save_image_upload(image)
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/products")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Delete old image if it exists
-    if db_product.image:
-        old_image_path = Path(db_product.image.lstrip('/'))
-        if old_image_path.exists():
-            try:
-                os.remove(old_image_path)
-            except:
-                pass  # Continue even if deletion fails
-    
-    # Generate unique filename
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = upload_dir / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        buffer.write(file_content)
-    
-    # Update product image URL
-    image_url = f"/uploads/products/{unique_filename}"
-    
-    # Update product in database
-    product_data = schemas.ProductCreate(
-        name=db_product.name,
-        description=db_product.description,
-        price=db_product.price,
-        quantity=db_product.quantity,
-        image=image_url
-    )
-    
-    return crud.update_product(db, product_id, product_data)
+    # Only the image column changes, so stock sold during the upload is kept;
+    # the old file is released by crud once nothing references it
+    db_product = await run_in_threadpool(crud.update_product_image, db, product_id, stored.url)
+    if not db_product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return db_product
 
 @router.delete("/{product_id}")
 def delete_product(product_id: int, db: Session = Depends(database.get_db)):
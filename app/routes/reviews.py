@@ -1,10 +1,11 @@
 # app/routes/reviews.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc
+from sqlalchemy import desc
 from typing import List, Optional
-from app import schemas, database, auth, models
+from datetime import datetime
+from app import schemas, crud, database, auth, models, conditional
 from app.models import Review, Product, User
 
 router = APIRouter(
@@ -12,11 +13,13 @@ router = APIRouter(
     tags=["Reviews"]
 )
 
+MAX_BATCH_SUMMARIES = 100
+
 @router.post("/", response_model=schemas.ReviewOut)
 def create_review(
     review_data: schemas.ReviewCreate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_principal)
 ):
     """Create a new product review"""
     
@@ -40,10 +43,16 @@ def create_review(
         product_id=review_data.product_id,
         rating=review_data.rating,
         title=review_data.title,
-        comment=review_data.comment
+        comment=review_data.comment,
+        # Same timestamp format as orders: the admin listing pages on (created_at, id)
+        created_at=datetime.utcnow()
     )
     
     db.add(review)
+    db.flush()
+    crud.apply_review_rating_change(
+        db, review.product_id, new_rating=review.rating if review.is_approved else None
+    )
     db.commit()
     db.refresh(review)
     
@@ -67,12 +76,22 @@ def create_review(
 @router.get("/product/{product_id}", response_model=List[schemas.ReviewOut])
 def get_product_reviews(
     product_id: int,
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
     db: Session = Depends(database.get_db)
 ):
     """Get all reviews for a specific product"""
     
+    not_modified = conditional.check(
+        request, response, db,
+        conditional.review_read_scopes(product_id),
+        key=f"list:{skip}:{limit}"
+    )
+    if not_modified:
+        return not_modified
+    
     try:
         # Check if product exists
         product = db.query(models.Product).filter(models.Product.id == product_id).first()
@@ -115,49 +134,64 @@ def get_product_reviews(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+SUMMARY_COLUMNS = (
+    models.Product.id,
+    models.Product.rating_count,
+    models.Product.rating_avg,
+    *crud.RATING_COLUMNS.values()
+)
+
+def _summary(row) -> schemas.ProductReviewSummary:
+    return schemas.ProductReviewSummary(
+        product_id=row.id,
+        total_reviews=row.rating_count,
+        average_rating=float(row.rating_avg),
+        rating_distribution={str(star): getattr(row, f"rating_{star}") for star in range(1, 6)}
+    )
+
+@router.get("/summaries", response_model=List[schemas.ProductReviewSummary])
+def get_review_summaries(
+    product_ids: str = Query(..., description="Comma-separated product ids"),
+    db: Session = Depends(database.get_db)
+):
+    """Get review summaries for many products in one query (e.g. for product grids)"""
+    try:
+        ids = list(dict.fromkeys(int(pid) for pid in product_ids.split(",") if pid.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="product_ids must be comma-separated integers")
+    if len(ids) > MAX_BATCH_SUMMARIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SUMMARIES} product ids per request")
+    if not ids:
+        return []
+    
+    rows = db.query(*SUMMARY_COLUMNS).filter(models.Product.id.in_(ids)).all()
+    by_id = {row.id: row for row in rows}
+    return [_summary(by_id[pid]) for pid in ids if pid in by_id]
+
 @router.get("/product/{product_id}/summary", response_model=schemas.ProductReviewSummary)
 def get_product_review_summary(
     product_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(database.get_db)
 ):
     """Get review summary for a product (average rating, total reviews, etc.)"""
     
+    not_modified = conditional.check(
+        request, response, db,
+        conditional.review_read_scopes(product_id),
+        key="summary"
+    )
+    if not_modified:
+        return not_modified
+    
     try:
-        # Check if product exists
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        # Aggregates are maintained on the product row by review writes
+        product = db.query(*SUMMARY_COLUMNS).filter(models.Product.id == product_id).first()
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Get total reviews and average rating
-        stats = db.query(
-            func.count(models.Review.id).label('total_reviews'),
-            func.avg(models.Review.rating).label('average_rating')
-        ).filter(
-            models.Review.product_id == product_id,
-            models.Review.is_approved == True
-        ).first()
-        
-        total_reviews = stats.total_reviews or 0
-        average_rating = float(stats.average_rating or 0)
-        
-        # Get rating distribution
-        rating_distribution = {}
-        for rating in range(1, 6):
-            count = db.query(models.Review).filter(
-                models.Review.product_id == product_id,
-                models.Review.rating == rating,
-                models.Review.is_approved == True
-            ).count()
-            rating_distribution[str(rating)] = count
-        
-        summary = schemas.ProductReviewSummary(
-            product_id=product_id,
-            total_reviews=total_reviews,
-            average_rating=average_rating,
-            rating_distribution=rating_distribution
-        )
-        
-        return summary
+        return _summary(product)
         
     except HTTPException:
         raise
@@ -169,7 +203,7 @@ def update_review(
     review_id: int,
     review_data: schemas.ReviewUpdate,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_principal)
 ):
     """Update a review (only by the review author)"""
     
@@ -181,26 +215,43 @@ def update_review(
     if review.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this review")
     
+    old_rating = review.rating if review.is_approved else None
+    
     # Update fields
     for field, value in review_data.dict(exclude_unset=True).items():
         setattr(review, field, value)
+    crud.apply_review_rating_change(
+        db, review.product_id,
+        old_rating=old_rating,
+        new_rating=review.rating if review.is_approved else None
+    )
+    conditional.bump(db, *conditional.review_scopes(review.product_id))
     
     db.commit()
     db.refresh(review)
     
-    # Add user info to response
-    review.user = {
-        "id": current_user.id,
-        "username": current_user.username
+    # Return proper response format (review.user is a relationship, not a dict)
+    return {
+        "id": review.id,
+        "user_id": review.user_id,
+        "product_id": review.product_id,
+        "rating": review.rating,
+        "title": review.title,
+        "comment": review.comment,
+        "is_approved": review.is_approved,
+        "created_at": review.created_at,
+        "updated_at": review.updated_at,
+        "user": {
+            "id": current_user.id,
+            "username": current_user.username
+        }
     }
-    
-    return review
 
 @router.delete("/{review_id}")
 def delete_review(
     review_id: int,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_principal)
 ):
     """Delete a review (only by the review author)"""
     
@@ -212,6 +263,10 @@ def delete_review(
     if review.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this review")
     
+    crud.apply_review_rating_change(
+        db, review.product_id, old_rating=review.rating if review.is_approved else None
+    )
+    conditional.bump(db, *conditional.review_scopes(review.product_id))
     db.delete(review)
     db.commit()
     
@@ -222,7 +277,7 @@ def get_user_reviews(
     skip: int = 0,
     limit: int = 10,
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_token_principal)
 ):
     """Get all reviews by the current user"""
     
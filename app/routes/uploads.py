@@ -1,11 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
-from app import schemas, crud, database, auth
-from typing import List, Optional
-import os
-import uuid
-from pathlib import Path
-import shutil
+from starlette.concurrency import run_in_threadpool
+from app import database, storage, images
 
 router = APIRouter(
     prefix="/uploads",
@@ -13,63 +9,39 @@ router = APIRouter(
 )
 
 # Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("uploads/products")
+UPLOAD_DIR = storage.PRODUCT_IMAGE_DIR
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-# Allowed image extensions
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
-
-def get_file_extension(filename: str) -> str:
-    return Path(filename).suffix.lower()
-
-def is_allowed_file(filename: str) -> bool:
-    return get_file_extension(filename) in ALLOWED_EXTENSIONS
-
 @router.post("/product-image/")
 async def upload_product_image(file: UploadFile = File(...)):
     """Upload a product image and return the file URL"""
     
-    # Validate file type
-    if not is_allowed_file(file.filename):
-        raise HTTPException(
-            status_code=400, 
-            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
-        )
-    
-    # Validate file size (max 5MB)
-    file_content = await file.read()
-    if len(file_content) > 5 * 1024 * 1024:  # 5MB
-        raise HTTPException(status_code=400, detail="File too large. Max size is 5MB")
-    
-    # Generate unique filename
-    file_extension = get_file_extension(file.filename)
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        buffer.write(file_content)
-    
-    # Return the URL path
-    file_url = f"/static/products/{unique_filename}"
+    stored = await storage.save_image_upload(file)
+    images.schedule(stored.url)
     
     return {
-        "filename": unique_filename,
-        "url": file_url,
-        "size": len(file_content)
+        "filename": stored.filename,
+        "url": stored.url,
+        "size": stored.size,
+        "deduplicated": stored.deduplicated
     }
 
 @router.delete("/product-image/{filename}")
-async def delete_product_image(filename: str):
+async def delete_product_image(filename: str, db: Session = Depends(database.get_db)):
     """Delete a product image file"""
     
-    file_path = UPLOAD_DIR / filename
+    file_path = storage.path_for_filename(filename, UPLOAD_DIR)
     
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     
+    # Identical uploads share one file, so only unreferenced files may go
+    references = storage.reference_count(db, storage.url_for(file_path))
+    if references:
+        raise HTTPException(status_code=409, detail=f"File is still used by {references} product(s) or past order(s)")
+    
     try:
-        os.remove(file_path)
+        await run_in_threadpool(storage.remove_file, storage.url_for(file_path))
         return {"message": "File deleted successfully"}
-    except Exception as e:
+    except OSError as e:
         raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
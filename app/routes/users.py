@@ -11,7 +11,7 @@ router = APIRouter(
 @router.get("/", response_model=List[schemas.UserOut])
 def list_users(
     db: Session = Depends(database.get_db),
-    current_user: str = Depends(auth.get_current_user)  #  JWT required
+    current_user: auth.Principal = Depends(auth.get_token_principal)  #  JWT required
 ):
     return crud.get_all_users(db)
 
@@ -19,7 +19,7 @@ def list_users(
 def get_user(
     user_id: int,
     db: Session = Depends(database.get_db),
-    current_user: str = Depends(auth.get_current_user)  #  JWT required
+    current_user: auth.Principal = Depends(auth.get_token_principal)  #  JWT required
 ):
     db_user = crud.get_user_by_id(db, user_id)
     if not db_user:
@@ -30,7 +30,7 @@ def get_user(
 def delete_user(
     user_id: int,
     db: Session = Depends(database.get_db),
-    current_user: str = Depends(auth.get_current_user)  #  JWT required
+    current_user: auth.Principal = Depends(auth.get_current_principal)  #  JWT required
 ):
     deleted = crud.delete_user(db, user_id)
     if not deleted:
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -16,6 +16,18 @@ class OrderStatus(str, Enum):
     DELIVERED = "delivered"
     CANCELLED = "cancelled"
 
+class CartOperationType(str, Enum):
+    ADD = "add"        # add quantity to the line (creating it if needed)
+    SET = "set"        # set the line's quantity; 0 or less removes it
+    REMOVE = "remove"  # remove the line
+
+class ProductSort(str, Enum):
+    NAME = "name"
+    PRICE_ASC = "price_asc"
+    PRICE_DESC = "price_desc"
+    NEWEST = "newest"
+    RATING = "rating"
+
 # User schemas
 class UserCreate(BaseModel):
     username: str
@@ -52,6 +64,10 @@ class UserOut(BaseModel):
     class Config:
         from_attributes = True
 
+# Refresh token flow (POST /auth/refresh, /auth/logout)
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 # Admin user creation
 class AdminUserCreate(UserCreate):
     role: UserRole = UserRole.ADMIN
@@ -87,18 +103,50 @@ class ProductOut(BaseModel):
     category: Optional[str] = None
     sku: Optional[str] = None
     image: Optional[str] = None
+    image_variants: Optional[Dict[str, str]] = None
     is_active: bool
+    available_quantity: Optional[int] = None  # quantity minus units held by reservations
+    flash_sale: bool = False
     created_at: Optional[datetime] = None
+    rating_count: int = 0
+    rating_avg: float = 0.0
     
     class Config:
         from_attributes = True
 
+
+class ProductSearchHit(ProductOut):
+    score: float
+    name_highlight: Optional[str] = None
+    snippet: Optional[str] = None
+
+class FlashSaleToggle(BaseModel):
+    enabled: bool
+
+class StockShardConfig(BaseModel):
+    shards: int = Field(..., ge=0, le=64, description="Number of stock shards; 0 compacts back into one column")
+
+class StockShardOut(BaseModel):
+    shard: int
+    quantity: int
+
+    class Config:
+        from_attributes = True
+
+class StockShardsOut(BaseModel):
+    product_id: int
+    shard_count: int
+    quantity: int           # total on hand: column plus shards
+    base_quantity: int      # part kept in the products.quantity column (covers reservations)
+    reserved_quantity: int
+    shards: List[StockShardOut]
+
         
 # Order schemas
 class OrderItemCreate(BaseModel):
     product_id: int
     quantity: int
-    price: float
+    price: Optional[float] = None  # ignored: orders are priced from current product prices
 
 class OrderItemOut(BaseModel):
     id: int
@@ -111,7 +159,7 @@ class OrderItemOut(BaseModel):
         from_attributes = True
 
 class OrderCreate(BaseModel):
-    total_price: float
+    total_price: Optional[float] = None  # ignored: computed server-side
     shipping_address: Optional[str] = None
     items: Optional[List[OrderItemCreate]] = []
 
@@ -135,6 +183,34 @@ class OrderOut(BaseModel):
     class Config:
         from_attributes = True
 
+
+# Order history read model (app/order_history.py): products as they were at purchase time
+class OrderHistoryProduct(BaseModel):
+    id: int
+    name: Optional[str] = None
+    image: Optional[str] = None
+    thumbnail: Optional[str] = None
+    category: Optional[str] = None
+
+class OrderHistoryItem(BaseModel):
+    product_id: int
+    quantity: int
+    price: Optional[float] = None
+    product: Optional[OrderHistoryProduct] = None
+
+class OrderHistoryOut(BaseModel):
+    id: int = Field(validation_alias="order_id")
+    user_id: int
+    total_price: float
+    status: OrderStatus
+    shipping_address: Optional[str] = None
+    created_at: datetime
+    item_count: int
+    order_items: List[OrderHistoryItem] = Field(validation_alias="items")
+
+    class Config:
+        from_attributes = True
+
         
 # Cart schemas
 class CartItemCreate(BaseModel):
@@ -146,10 +222,42 @@ class CartItemOut(BaseModel):
     product_id: int
     quantity: int
     product: ProductOut
+    available: bool = True  # product active and enough stock for this quantity
+
+    class Config:
+        from_attributes = True
+
+class CartOperation(BaseModel):
+    op: CartOperationType
+    product_id: int
+    quantity: int = 1  # ignored for remove
+
+class CartBatchUpdate(BaseModel):
+    operations: List[CartOperation] = Field(..., max_length=100)
+
+class CartOut(BaseModel):
+    items: List[CartItemOut]
+    item_count: int
+    subtotal: float
+    all_available: bool
+
+class CartSummary(BaseModel):
+    line_count: int
+    item_count: int
+    subtotal: float
+
+class ReservationOut(BaseModel):
+    product_id: int
+    quantity: int
+    expires_at: datetime
 
     class Config:
         from_attributes = True
 
+class CartReservationOut(BaseModel):
+    expires_at: Optional[datetime] = None
+    holds: List[ReservationOut]
+
 # Dashboard schemas
 class DashboardStats(BaseModel):
     total_users: int
@@ -209,6 +317,25 @@ class ReviewOut(BaseModel):
     class Config:
         from_attributes = True
 
+class ReviewUserOut(BaseModel):
+    id: int
+    username: str
+    email: str
+
+    class Config:
+        from_attributes = True
+
+class ReviewProductOut(BaseModel):
+    id: int
+    name: str
+
+    class Config:
+        from_attributes = True
+
+class AdminReviewOut(ReviewOut):
+    user: Optional[ReviewUserOut] = None
+    product: Optional[ReviewProductOut] = None
+
 class ProductReviewSummary(BaseModel):
     product_id: int
     total_reviews: int
@@ -0,0 +1,192 @@
+# app/search.py
+
+import html
+import re
+from sqlalchemy import text, column
+from sqlalchemy.orm import Session
+from app import models
+
+# Full-text product search.
+# SQLite uses an FTS5 table (products_fts, rowid = product id) ranked with
+# bm25(); PostgreSQL uses a product_search table holding a weighted tsvector
+# behind a GIN index, ranked with ts_rank_cd(). Both are kept in sync from
+# the product write paths in crud/admin, inside the caller's transaction.
+#
+# Highlights and snippets are returned as HTML. The database marks matches
+# with control characters, and the text is escaped before those become
+# <mark> tags, so product text can never inject markup.
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+# Relative column weights: name, description, category
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+CATEGORY_WEIGHT = 4.0
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+def _terms(query: str):
+    return _TOKEN_RE.findall(query or "")[:16]
+
+def _to_html(marked):
+    """Escape database highlight output and turn its match markers into HIGHLIGHT_START/END"""
+    if marked is None:
+        return None
+    return html.escape(marked).replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_END, HIGHLIGHT_END)
+
+def build_match_query(query: str, postgres: bool = False):
+    """Turn free text into a safe MATCH / to_tsquery expression (AND of terms, last term as prefix)"""
+    terms = _terms(query)
+    if not terms:
+        return None
+    if postgres:
+        return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+    return " ".join([f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+# Index maintenance
+
+def ensure_index(engine):
+    """Create the search index if it is missing and backfill it from products"""
+    with engine.begin() as conn:
+        if _is_postgres(conn):
+            exists = conn.execute(text("SELECT to_regclass('product_search')")).scalar()
+            if exists is None:
+                conn.execute(text(
+                    "CREATE TABLE product_search ("
+                    " product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,"
+                    " document tsvector NOT NULL)"
+                ))
+                conn.execute(text(
+                    "CREATE INDEX ix_product_search_document ON product_search USING GIN (document)"
+                ))
+                _rebuild(conn)
+        else:
+            exists = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name='products_fts'"
+            )).first()
+            if exists is None:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE products_fts USING fts5("
+                    "name, description, category, tokenize='porter unicode61')"
+                ))
+                _rebuild(conn)
+
+_PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce({name}, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({category}, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce({description}, '')), 'C')"
+)
+
+def _rebuild(conn):
+    if _is_postgres(conn):
+        conn.execute(text("DELETE FROM product_search"))
+        conn.execute(text(
+            "INSERT INTO product_search (product_id, document) SELECT id, "
+            + _PG_DOCUMENT.format(name="name", category="category", description="description")
+            + " FROM products"
+        ))
+    else:
+        conn.execute(text("DELETE FROM products_fts"))
+        conn.execute(text(
+            "INSERT INTO products_fts (rowid, name, description, category) "
+            "SELECT id, coalesce(name, ''), coalesce(description, ''), coalesce(category, '') FROM products"
+        ))
+
+def rebuild_index(db: Session):
+    """Re-index every product (use after bulk imports or direct SQL edits)"""
+    _rebuild(db.connection())
+    db.commit()
+
+def index_product(db: Session, product: models.Product):
+    """Insert or replace a product's search document; caller commits"""
+    params = {
+        "id": product.id,
+        "name": product.name or "",
+        "description": product.description or "",
+        "category": product.category or "",
+    }
+    if _is_postgres(db.get_bind()):
+        db.execute(text(
+            "INSERT INTO product_search (product_id, document) VALUES (:id, "
+            + _PG_DOCUMENT.format(name=":name", category=":category", description=":description")
+            + ") ON CONFLICT (product_id) DO UPDATE SET document = excluded.document"
+        ), params)
+    else:
+        db.execute(text("DELETE FROM products_fts WHERE rowid = :id"), {"id": product.id})
+        db.execute(text(
+            "INSERT INTO products_fts (rowid, name, description, category) "
+            "VALUES (:id, :name, :description, :category)"
+        ), params)
+
+def remove_product(db: Session, product_id: int):
+    """Drop a product's search document; caller commits"""
+    if _is_postgres(db.get_bind()):
+        db.execute(text("DELETE FROM product_search WHERE product_id = :id"), {"id": product_id})
+    else:
+        db.execute(text("DELETE FROM products_fts WHERE rowid = :id"), {"id": product_id})
+
+
+# Queries
+
+def matching_ids(db: Session, query: str):
+    """Selectable of product ids matching `query`, for use in `Product.id.in_(...)`"""
+    postgres = _is_postgres(db.get_bind())
+    match = build_match_query(query, postgres=postgres)
+    if postgres:
+        stmt = text(
+            "SELECT product_id FROM product_search "
+            "WHERE document @@ to_tsquery('english', :search_query)"
+        )
+    else:
+        stmt = text("SELECT rowid FROM products_fts WHERE products_fts MATCH :search_query")
+    return stmt.bindparams(search_query=match or '""').columns(column("id"))
+
+def search_products(db: Session, query: str, skip: int = 0, limit: int = 20, include_inactive: bool = False):
+    """Ranked search. Returns a list of (product, score, name_highlight, snippet)."""
+    postgres = _is_postgres(db.get_bind())
+    match = build_match_query(query, postgres=postgres)
+    if match is None:
+        return []
+
+    active_filter = "" if include_inactive else " AND p.is_active = :active"
+    params = {"q": match, "limit": limit, "skip": skip, "active": True,
+              "start": _MATCH_START, "end": _MATCH_END}
+    if postgres:
+        sql = (
+            "SELECT p.id, ts_rank_cd(s.document, q) AS score, "
+            "ts_headline('english', coalesce(p.name, ''), q, "
+            "'StartSel=' || :start || ', StopSel=' || :end || ', HighlightAll=true') AS name_highlight, "
+            "ts_headline('english', coalesce(p.description, ''), q, "
+            "'StartSel=' || :start || ', StopSel=' || :end || ', MaxWords=24, MinWords=8') AS snippet "
+            "FROM product_search s JOIN products p ON p.id = s.product_id, "
+            "to_tsquery('english', :q) q "
+            "WHERE s.document @@ q" + active_filter +
+            " ORDER BY score DESC, p.id LIMIT :limit OFFSET :skip"
+        )
+    else:
+        sql = (
+            f"SELECT p.id, -bm25(products_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {CATEGORY_WEIGHT}) AS score, "
+            "highlight(products_fts, 0, :start, :end) AS name_highlight, "
+            "snippet(products_fts, 1, :start, :end, '…', 24) AS snippet "
+            "FROM products_fts JOIN products p ON p.id = products_fts.rowid "
+            "WHERE products_fts MATCH :q" + active_filter +
+            " ORDER BY score DESC, p.id LIMIT :limit OFFSET :skip"
+        )
+    hits = db.execute(text(sql), params).all()
+    if not hits:
+        return []
+
+    products = {
+        p.id: p for p in db.query(models.Product).filter(models.Product.id.in_([h.id for h in hits])).all()
+    }
+    return [
+        (products[h.id], float(h.score), _to_html(h.name_highlight), _to_html(h.snippet))
+        for h in hits if h.id in products
+    ]
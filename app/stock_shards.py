@@ -0,0 +1,241 @@
+# app/stock_shards.py
+
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from app import models
+
+# Sharded stock counters for hot SKUs.
+# Every sale of an unsharded product decrements the same products row, so a
+# best-seller's checkouts queue up on that row's lock. A sharded product
+# (stock_shard_count = N) keeps its free stock in N StockShard rows instead,
+# and a sale decrements one randomly chosen shard that can cover it alone,
+# so concurrent sales mostly touch different rows.
+#
+# Units held by reservations stay in the products.quantity column
+# (Product.base_quantity), so holds keep their exact accounting on the
+# product row. Product.quantity is base_quantity plus the sum of the shards,
+# on instances and in SQL (a hybrid property), so listings, stock filters
+# and the admin stats read the true on-hand figure unchanged.
+#
+# When no single shard can cover a sale but the free stock can, the product
+# is rebalanced (free stock spread evenly again, including units left in
+# the column by released holds) and the sale retried once; a sold-out
+# product fails without touching its shards. compact() folds the shards
+# back into the column and turns sharding off.
+
+MAX_SHARDS = 64
+# Tries per sale before rebalancing: a concurrent writer may drain the chosen shard first
+TAKE_ATTEMPTS = 3
+# Rebalancing rewrites every shard of the product, so it runs at most this
+# often per product; in between, sales no single shard covers take from several
+REBALANCE_INTERVAL_SECONDS = 1.0
+
+_rebalance_lock = threading.Lock()
+_last_rebalance: Dict[int, float] = {}
+
+
+def sharded(db: Session, product_ids: Iterable[int]) -> Dict[int, bool]:
+    """{product_id: is_active} for the sharded products among `product_ids`"""
+    rows = db.execute(
+        select(models.Product.id, models.Product.is_active).where(
+            models.Product.id.in_(list(product_ids)),
+            models.Product.stock_shard_count > 0
+        )
+    ).all()
+    return {product_id: is_active is not False for product_id, is_active in rows}
+
+def _take_from_shard(db: Session, product_id: int, units: int) -> bool:
+    """Decrement one random shard holding at least `units`; False if none does"""
+    for _ in range(TAKE_ATTEMPTS):
+        candidate = select(models.StockShard.shard).where(
+            models.StockShard.product_id == product_id,
+            models.StockShard.quantity >= units
+        ).order_by(func.random()).limit(1).scalar_subquery()
+        taken = db.execute(
+            update(models.StockShard)
+            .where(
+                models.StockShard.product_id == product_id,
+                models.StockShard.shard == candidate,
+                # Re-checked under the row lock: another sale may have drained it
+                models.StockShard.quantity >= units
+            )
+            .values({models.StockShard.quantity: models.StockShard.quantity - units})
+            .returning(models.StockShard.shard)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if taken is not None:
+            return True
+    return False
+
+def _free_stock(db: Session, product_id: int) -> int:
+    """Unreserved units: the shards plus any left in the column by released holds"""
+    shard_total = select(func.coalesce(func.sum(models.StockShard.quantity), 0)).where(
+        models.StockShard.product_id == product_id
+    ).scalar_subquery()
+    return db.execute(
+        select(models.Product.base_quantity - models.Product.reserved_quantity + shard_total)
+        .where(models.Product.id == product_id)
+    ).scalar() or 0
+
+def _take_spread(db: Session, product_id: int, units: int) -> bool:
+    """Take `units` across several shards, fullest first, then the column; False (caller rolls back) if they run out"""
+    shards = db.execute(
+        select(models.StockShard.shard, models.StockShard.quantity).where(
+            models.StockShard.product_id == product_id,
+            models.StockShard.quantity > 0
+        ).order_by(models.StockShard.quantity.desc())
+    ).all()
+    remaining = units
+    for shard, quantity in shards:
+        take = min(quantity, remaining)
+        taken = db.execute(
+            update(models.StockShard)
+            .where(
+                models.StockShard.product_id == product_id,
+                models.StockShard.shard == shard,
+                models.StockShard.quantity >= take
+            )
+            .values({models.StockShard.quantity: models.StockShard.quantity - take})
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if taken:
+            remaining -= take
+        if not remaining:
+            return True
+    # The rest from units released into the column
+    return db.execute(
+        update(models.Product)
+        .where(
+            models.Product.id == product_id,
+            models.Product.base_quantity - models.Product.reserved_quantity >= remaining
+        )
+        .values({models.Product.base_quantity: models.Product.base_quantity - remaining})
+        .execution_options(synchronize_session=False)
+    ).rowcount > 0
+
+def _claim_rebalance(product_id: int) -> bool:
+    """True at most once per REBALANCE_INTERVAL_SECONDS per product (in this process)"""
+    now = time.monotonic()
+    with _rebalance_lock:
+        if now - _last_rebalance.get(product_id, float("-inf")) < REBALANCE_INTERVAL_SECONDS:
+            return False
+        _last_rebalance[product_id] = now
+        return True
+
+def _take(db: Session, product_id: int, units: int) -> bool:
+    if _take_from_shard(db, product_id, units):
+        return True
+    # Sold out: no rebalance can help, so fail without rewriting the shards
+    if _free_stock(db, product_id) < units:
+        return False
+    # Stock is spread too thin (or sitting in the column): even it out and
+    # retry, unless that was just done; failing that, take from several shards
+    if _claim_rebalance(product_id):
+        rebalance(db, product_id)
+        if _take_from_shard(db, product_id, units):
+            return True
+    return _take_spread(db, product_id, units)
+
+def apply(db: Session, product_id: int, needed: int, held: int, consume: bool) -> bool:
+    """Sharded counterpart of inventory._apply for one product; caller commits.
+
+    Sales not covered by a hold come out of a shard. New holds move units
+    from a shard into the column, where reserved stock lives; released
+    holds leave their units in the column until the next rebalance.
+    Returns False if the free stock cannot cover `needed`.
+    """
+    base_delta = reserved_delta = 0
+    if consume:
+        covered = min(needed, held)
+        if needed > covered and not _take(db, product_id, needed - covered):
+            return False
+        base_delta, reserved_delta = -covered, -held
+    else:
+        extra = needed - held
+        if extra > 0:
+            if not _take(db, product_id, extra):
+                return False
+            base_delta = extra
+        reserved_delta = extra
+    if base_delta or reserved_delta:
+        db.execute(
+            update(models.Product)
+            .where(models.Product.id == product_id)
+            .values({
+                models.Product.base_quantity: models.Product.base_quantity + base_delta,
+                models.Product.reserved_quantity: models.Product.reserved_quantity + reserved_delta,
+            })
+            .execution_options(synchronize_session=False)
+        )
+    return True
+
+def _redistribute(db: Session, product_id: int, shard_count: Optional[int] = None, on_hand: Optional[int] = None):
+    """Rewrite the product's stock as `shard_count` even shards plus the column; caller commits.
+
+    shard_count defaults to the current one (0 puts everything in the
+    column); on_hand defaults to the current total. The product row and its
+    shards are locked for the rewrite, so concurrent sales wait rather than
+    being lost.
+    """
+    row = db.execute(
+        select(models.Product.base_quantity, models.Product.reserved_quantity, models.Product.stock_shard_count)
+        .where(models.Product.id == product_id)
+        .with_for_update()
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    base, reserved, current_count = row
+    shard_stock = db.scalars(
+        select(models.StockShard.quantity)
+        .where(models.StockShard.product_id == product_id)
+        .with_for_update()
+    ).all()
+    if shard_count is None:
+        shard_count = current_count
+    if on_hand is None:
+        on_hand = (base or 0) + sum(shard_stock)
+
+    db.execute(delete(models.StockShard).where(models.StockShard.product_id == product_id))
+    free = max(on_hand - (reserved or 0), 0) if shard_count else 0
+    if shard_count:
+        per_shard, remainder = divmod(free, shard_count)
+        db.execute(insert(models.StockShard), [
+            {"product_id": product_id, "shard": shard, "quantity": per_shard + (1 if shard < remainder else 0)}
+            for shard in range(shard_count)
+        ])
+    db.execute(
+        update(models.Product)
+        .where(models.Product.id == product_id)
+        .values({
+            models.Product.base_quantity: on_hand - free,
+            models.Product.stock_shard_count: shard_count,
+        })
+        .execution_options(synchronize_session=False)
+    )
+
+def configure(db: Session, product_id: int, shard_count: int):
+    """Split a product's free stock into `shard_count` shards; 0 compacts it back into the column"""
+    if not 0 <= shard_count <= MAX_SHARDS:
+        raise HTTPException(status_code=400, detail=f"Shard count must be between 0 and {MAX_SHARDS}")
+    _redistribute(db, product_id, shard_count)
+
+def rebalance(db: Session, product_id: int):
+    """Spread the product's free stock evenly over its shards again; caller commits"""
+    _redistribute(db, product_id)
+
+def compact(db: Session, product_id: int):
+    """Fold all shards back into the products.quantity column and turn sharding off"""
+    _redistribute(db, product_id, 0)
+
+def set_quantity(db: Session, product_id: int, quantity: int):
+    """Set a product's total stock on hand (admin edits), keeping its shard layout"""
+    _redistribute(db, product_id, on_hand=quantity)
+
+def get_shards(db: Session, product_id: int):
+    return db.query(models.StockShard).filter(
+        models.StockShard.product_id == product_id
+    ).order_by(models.StockShard.shard).all()
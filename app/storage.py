@@ -0,0 +1,249 @@
+# app/storage.py
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app import models
+
+# Shared upload pipeline for product images.
+# The request body is bounded while it arrives by UploadSizeLimitMiddleware
+# (413 without reading an oversized body); Starlette then spools the file
+# part to a SpooledTemporaryFile. From there the file is copied in
+# fixed-size chunks to a temp file in the target directory (off the event
+# loop), validated by magic bytes rather than file extension, capped at
+# MAX_UPLOAD_BYTES, and atomically renamed into place so readers never see
+# a partial file.
+#
+# Storage is content-addressed: a file is named by the SHA-256 of its bytes
+# and sharded as products/ab/cd/abcd....ext, so identical uploads are stored
+# once and a URL never changes meaning (safe to cache forever). A file's
+# reference count is the number of products whose image points at it plus
+# the order history rows that show it.
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ROOT = Path("uploads")
+PRODUCT_IMAGE_DIR = UPLOAD_ROOT / "products"
+STATIC_URL_PREFIX = "/static"
+
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024  # 5MB
+CHUNK_SIZE = 64 * 1024
+
+# Unreferenced files touched more recently than this are left for the
+# garbage collector, so an upload that is about to be attached to a
+# product is never deleted from under it.
+RELEASE_GRACE_SECONDS = 10 * 60
+
+CONTENT_NAME_RE = re.compile(r"^(?P<digest>[0-9a-f]{64})(?P<ext>\.[a-z0-9]+)$")
+
+# Leading bytes -> canonical extension
+_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+ALLOWED_TYPES = ("jpg", "png", "gif", "webp")
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    filename: str
+    path: Path
+    url: str
+    size: int
+    digest: str
+    deduplicated: bool
+
+
+def detect_image_type(head: bytes) -> Optional[str]:
+    """Return the canonical extension for an image header, or None if not an allowed type"""
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+def content_path(digest: str, extension: str, directory: Path = PRODUCT_IMAGE_DIR) -> Path:
+    return directory / digest[:2] / digest[2:4] / f"{digest}{extension}"
+
+def path_for_filename(filename: str, directory: Path = PRODUCT_IMAGE_DIR) -> Path:
+    """Locate a stored file by bare name (content-addressed or legacy flat name)"""
+    name = Path(filename).name
+    match = CONTENT_NAME_RE.match(name)
+    if match:
+        return content_path(match.group("digest"), match.group("ext"), directory)
+    return directory / name
+
+def url_for(path: Path) -> str:
+    return f"{STATIC_URL_PREFIX}/{path.relative_to(UPLOAD_ROOT).as_posix()}"
+
+def path_for_url(url: str) -> Optional[Path]:
+    """Map a stored image URL (/static/... or legacy /uploads/...) back to its file, if it is ours"""
+    if not url:
+        return None
+    for prefix in (STATIC_URL_PREFIX + "/", "/" + UPLOAD_ROOT.as_posix() + "/"):
+        if url.startswith(prefix):
+            relative = Path(url[len(prefix):])
+            if ".." in relative.parts or relative.is_absolute():
+                return None
+            return UPLOAD_ROOT / relative
+    return None
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"File too large. Max size is {MAX_UPLOAD_BYTES // (1024 * 1024)}MB")
+
+def _not_an_image():
+    return HTTPException(
+        status_code=400,
+        detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_TYPES)}"
+    )
+
+def _stream_to_disk(source, directory: Path) -> StoredFile:
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    temp_path = Path(temp_name)
+    try:
+        size = 0
+        extension = None
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = detect_image_type(chunk)
+                    if extension is None:
+                        raise _not_an_image()
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise _too_large()
+                digest.update(chunk)
+                out.write(chunk)
+        if extension is None:
+            raise _not_an_image()
+
+        hex_digest = digest.hexdigest()
+        final_path = content_path(hex_digest, extension, directory)
+        deduplicated = final_path.exists()
+        if deduplicated:
+            # Same bytes already stored: keep the existing file, refresh its
+            # mtime so a concurrent release() leaves it alone
+            temp_path.unlink()
+            os.utime(final_path)
+        else:
+            final_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_path, final_path)
+        return StoredFile(
+            filename=final_path.name,
+            path=final_path,
+            url=url_for(final_path),
+            size=size,
+            digest=hex_digest,
+            deduplicated=deduplicated
+        )
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+async def save_image_upload(file: UploadFile, directory: Path = PRODUCT_IMAGE_DIR) -> StoredFile:
+    """Validate and store an uploaded image without blocking the event loop.
+
+    The upload has already been spooled by Starlette, so this copies it in
+    chunks rather than streaming it off the socket; the early abort on an
+    oversized body is UploadSizeLimitMiddleware's job.
+    """
+    await file.seek(0)
+    return await run_in_threadpool(_stream_to_disk, file.file, directory)
+
+def reference_count(db: Session, url: str) -> int:
+    """Number of products (ix_products_image) and order history snapshots showing `url`"""
+    products = db.query(models.Product.id).filter(models.Product.image == url).count()
+    orders = db.query(models.OrderHistoryImage.order_id).filter(models.OrderHistoryImage.url == url).count()
+    return products + orders
+
+def remove_file(url: str) -> bool:
+    """Delete the file behind a stored image URL and its variants; False if it was not ours or already gone"""
+    from app import images
+
+    path = path_for_url(url)
+    if path is None:
+        return False
+    images.remove_variants(url)
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+def release(db: Session, urls: Iterable[Optional[str]]):
+    """Drop stored images that no product or order history row references any more (call after commit).
+
+    Files touched within RELEASE_GRACE_SECONDS are kept for the garbage
+    collector, since a fresh upload may be about to be attached.
+    """
+    for url in dict.fromkeys(u for u in urls if u):
+        path = path_for_url(url)
+        if path is None or reference_count(db, url) > 0:
+            continue
+        try:
+            if time.time() - path.stat().st_mtime < RELEASE_GRACE_SECONDS:
+                continue
+            remove_file(url)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            logger.exception("Could not remove unreferenced image %s", url)
+
+
+class UploadSizeLimitMiddleware:
+    """Reject multipart request bodies over the upload limit while they are still arriving.
+
+    Requests with a Content-Length over the limit are refused before any body is
+    read; chunked bodies are counted as they stream in and aborted with 413.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_UPLOAD_BYTES + 64 * 1024):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"connection", b"close")],
+            })
+            await send({"type": "http.response.body", "body": b'{"detail":"Request body too large"}'})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,196 @@
+# app/upload_gc.py
+
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Iterator, List, Tuple
+from sqlalchemy.orm import Session
+from app import models, storage, images
+
+# Garbage collection for uploads/products.
+# The directory is walked with os.scandir and checked against Product.image
+# and the order history image references (app/order_history.py) in
+# fixed-size batches, so memory stays bounded however many files there
+# are. An unreferenced file is first moved to a quarantine directory outside
+# the static root (no longer served, still recoverable) and only deleted once
+# it has sat there for QUARANTINE_SECONDS. A quarantined file that a product
+# has started referencing again is restored instead of deleted.
+
+logger = logging.getLogger(__name__)
+
+# Quarantine lives outside UPLOAD_ROOT so quarantined files are not served
+QUARANTINE_ROOT = Path("uploads_quarantine")
+
+# Unreferenced files younger than this are left alone (uploaded, not yet attached)
+ORPHAN_GRACE_SECONDS = 24 * 60 * 60
+# How long an orphan stays recoverable in quarantine before it is deleted
+QUARANTINE_SECONDS = 7 * 24 * 60 * 60
+BATCH_SIZE = 500
+
+
+def _walk(directory: Path) -> Iterator[Tuple[Path, os.stat_result]]:
+    """Yield (path, stat) for every regular file below `directory`, depth first"""
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    yield Path(entry.path), entry.stat(follow_symlinks=False)
+
+def _batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _urls_for(path: Path) -> List[str]:
+    """Every form of URL a product may store for this file (current and legacy prefix)"""
+    relative = path.relative_to(storage.UPLOAD_ROOT).as_posix()
+    return [f"{storage.STATIC_URL_PREFIX}/{relative}", f"/{storage.UPLOAD_ROOT.as_posix()}/{relative}"]
+
+def _referenced(db: Session, paths: List[Path]) -> set:
+    """The subset of `paths` a product's image or an order history snapshot points at (one query per batch)"""
+    candidates = {url: path for path in paths for url in _urls_for(path)}
+    urls = list(candidates)
+    rows = db.query(models.Product.image).filter(models.Product.image.in_(urls)).union(
+        db.query(models.OrderHistoryImage.url).filter(models.OrderHistoryImage.url.in_(urls))
+    )
+    return {candidates[image] for (image,) in rows}
+
+def _is_variant(path: Path) -> bool:
+    return path.parent.name == images.VARIANT_DIR_NAME
+
+def _variant_source_exists(path: Path) -> bool:
+    stem = path.stem.rsplit("_", 1)[0]
+    return any(path.parent.parent.glob(f"{stem}.*"))
+
+def _quarantine_path(path: Path) -> Path:
+    return QUARANTINE_ROOT / path.relative_to(storage.UPLOAD_ROOT)
+
+def _move(source: Path, target: Path):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, target)
+    # Restart the clock: mtime records when the file entered (or left) quarantine
+    os.utime(target)
+
+def _new_report(dry_run: bool) -> dict:
+    return {
+        "dry_run": dry_run,
+        "files": 0,
+        "bytes": 0,
+        "referenced_files": 0,
+        "referenced_bytes": 0,
+        "variant_files": 0,
+        "variant_bytes": 0,
+        "recent_unreferenced_files": 0,
+        "orphans_quarantined": 0,
+        "orphan_bytes_quarantined": 0,
+        "stale_temp_files_removed": 0,
+        "quarantine_files": 0,
+        "quarantine_bytes": 0,
+        "restored": 0,
+        "purged": 0,
+        "bytes_freed": 0,
+        "errors": 0,
+    }
+
+def _sweep_uploads(db: Session, report: dict, now: float, dry_run: bool):
+    for batch in _batches(_walk(storage.PRODUCT_IMAGE_DIR), BATCH_SIZE):
+        sources = []
+        for path, stat_result in batch:
+            report["files"] += 1
+            report["bytes"] += stat_result.st_size
+            old_enough = now - stat_result.st_mtime >= ORPHAN_GRACE_SECONDS
+            if path.name.startswith(".upload-"):
+                # Temp file left behind by an interrupted upload
+                if old_enough:
+                    report["stale_temp_files_removed"] += 1
+                    if not dry_run:
+                        path.unlink(missing_ok=True)
+            elif _is_variant(path):
+                report["variant_files"] += 1
+                report["variant_bytes"] += stat_result.st_size
+                # Variants are regenerable, so ones whose source is gone are just removed
+                if old_enough and not dry_run and not _variant_source_exists(path):
+                    path.unlink(missing_ok=True)
+            else:
+                sources.append((path, stat_result))
+
+        referenced = _referenced(db, [path for path, _ in sources])
+        for path, stat_result in sources:
+            if path in referenced:
+                report["referenced_files"] += 1
+                report["referenced_bytes"] += stat_result.st_size
+                continue
+            if now - stat_result.st_mtime < ORPHAN_GRACE_SECONDS:
+                report["recent_unreferenced_files"] += 1
+                continue
+            report["orphans_quarantined"] += 1
+            report["orphan_bytes_quarantined"] += stat_result.st_size
+            if dry_run:
+                continue
+            try:
+                _move(path, _quarantine_path(path))
+                images.remove_variants(storage.url_for(path))
+            except OSError:
+                report["errors"] += 1
+                logger.exception("Could not quarantine orphaned upload %s", path)
+
+def _sweep_quarantine(db: Session, report: dict, now: float, dry_run: bool):
+    quarantine_dir = _quarantine_path(storage.PRODUCT_IMAGE_DIR)
+    for batch in _batches(_walk(quarantine_dir), BATCH_SIZE):
+        originals = {storage.UPLOAD_ROOT / path.relative_to(QUARANTINE_ROOT): (path, stat_result) for path, stat_result in batch}
+        referenced = _referenced(db, list(originals))
+        for original, (path, stat_result) in originals.items():
+            try:
+                if original in referenced:
+                    # Re-attached to a product while quarantined: put it back
+                    if not dry_run:
+                        _move(path, original)
+                        images.schedule(storage.url_for(original))
+                    report["restored"] += 1
+                elif now - stat_result.st_mtime >= QUARANTINE_SECONDS:
+                    if not dry_run:
+                        path.unlink()
+                    report["purged"] += 1
+                    report["bytes_freed"] += stat_result.st_size
+                else:
+                    report["quarantine_files"] += 1
+                    report["quarantine_bytes"] += stat_result.st_size
+            except FileNotFoundError:
+                continue
+            except OSError:
+                report["errors"] += 1
+                logger.exception("Could not process quarantined upload %s", path)
+
+def collect(db: Session, dry_run: bool = False) -> dict:
+    """Quarantine orphaned uploads, purge expired quarantine and report storage usage.
+
+    With dry_run nothing is moved or deleted; the report shows what would be.
+    """
+    started = time.monotonic()
+    now = time.time()
+    report = _new_report(dry_run)
+    _sweep_quarantine(db, report, now, dry_run)
+    _sweep_uploads(db, report, now, dry_run)
+
+    storage.UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
+    disk = shutil.disk_usage(storage.UPLOAD_ROOT)
+    report["disk_total_bytes"] = disk.total
+    report["disk_free_bytes"] = disk.free
+    report["duration_seconds"] = round(time.monotonic() - started, 3)
+    logger.info("Upload GC finished: %s", report)
+    return report
@@ -14,7 +14,7 @@ export default function ProductCard({ product }) {
       <Link to={`/product/${product.id}`} className="block">
         <div className="aspect-w-1 aspect-h-1 relative overflow-hidden">
           <img 
-            src={getImageUrl(product.image)} 
+            src={getImageUrl(product.image_variants?.card || product.image)} 
             alt={product.name || product.title}
             className="w-full h-40 sm:h-44 lg:h-48 object-cover group-hover:scale-105 transition-transform duration-300"
             onError={(e) => {
@@ -1,4 +1,4 @@
-import React, { createContext, useState, useEffect, useContext } from 'react'
+import React, { createContext, useState, useEffect, useContext, useRef } from 'react'
 import { AuthContext } from './AuthContext'
 import api from '../api'
 
@@ -7,11 +7,28 @@ export const CartContext = createContext()
 export const CartProvider = ({ children }) => {
   const [cartItems, setCartItems] = useState([])
   const { user } = useContext(AuthContext)
+  const previousUser = useRef(user)
+  // True while cartItems mirrors the backend cart; those items must never
+  // reach localStorage, or the next login would add them a second time
+  const fromBackend = useRef(false)
+
+  const setBackendItems = (items) => {
+    fromBackend.current = true
+    setCartItems(items)
+  }
 
   // Load cart from backend when user is authenticated
   useEffect(() => {
+    const loggedOut = previousUser.current && !user
+    previousUser.current = user
     if (user) {
-      loadCartFromBackend()
+      syncLocalCartToBackend()
+    } else if (loggedOut) {
+      // The backend cart stays on the server: start an empty local cart.
+      // fromBackend stays set until a local addition, so the save effect
+      // below cannot write this render's (backend) items back
+      localStorage.removeItem('cart')
+      setCartItems([])
     } else {
       // Load from localStorage for non-authenticated users
       const savedCart = localStorage.getItem('cart')
@@ -21,9 +38,9 @@ export const CartProvider = ({ children }) => {
     }
   }, [user])
 
-  // Save cart to localStorage for non-authenticated users
+  // Save cart to localStorage for non-authenticated users (items added while logged out only)
   useEffect(() => {
-    if (!user) {
+    if (!user && !fromBackend.current) {
       localStorage.setItem('cart', JSON.stringify(cartItems))
     }
   }, [cartItems, user])
@@ -52,12 +69,42 @@ export const CartProvider = ({ children }) => {
         return acc
       }, [])
       
-      setCartItems(deduplicatedItems)
+      setBackendItems(deduplicatedItems)
     } catch (error) {
       console.error('Error loading cart from backend:', error)
     }
   }
 
+  // Apply cart operations in one request; the response is the resulting cart
+  const patchCart = async (operations) => {
+    const response = await api.patch('/cart', { operations })
+    setBackendItems(response.data.items)
+    return response.data
+  }
+
+  // Merge items added while logged out into the backend cart in one batch
+  const syncLocalCartToBackend = async () => {
+    // Backend cart rows (they have product_id) saved by older versions are not local additions
+    const savedCart = JSON.parse(localStorage.getItem('cart') || '[]').filter(item => item.product_id === undefined)
+    const operations = savedCart.map(item => ({
+      op: 'add',
+      product_id: item.product?.id || item.id,
+      quantity: item.quantity || 1
+    }))
+    if (operations.length === 0) {
+      localStorage.removeItem('cart')
+      await loadCartFromBackend()
+      return
+    }
+    try {
+      await patchCart(operations)
+      localStorage.removeItem('cart')
+    } catch (error) {
+      console.error('Error syncing local cart to backend:', error)
+      await loadCartFromBackend()
+    }
+  }
+
   const addToCart = async (product) => {
     console.log('Adding to cart:', product.id, 'Current cart items:', cartItems.length)
     
@@ -82,6 +129,9 @@ export const CartProvider = ({ children }) => {
   }
 
   const addToLocalCart = (product) => {
+    if (!user) {
+      fromBackend.current = false
+    }
     setCartItems(prevItems => {
       const existingItem = prevItems.find(item => {
         const productId = item.product?.id || item.id
@@ -107,8 +157,7 @@ export const CartProvider = ({ children }) => {
       const cartItem = cartItems.find(item => item.product?.id === productId || item.id === productId)
       if (cartItem) {
         try {
-          await api.delete(`/cart/remove/${cartItem.id}`)
-          await loadCartFromBackend() // Refresh cart
+          await patchCart([{ op: 'remove', product_id: cartItem.product_id }])
         } catch (error) {
           console.error('Error removing from backend cart:', error)
           // Fallback to local removal
@@ -134,8 +183,7 @@ export const CartProvider = ({ children }) => {
       const cartItem = cartItems.find(item => item.product?.id === productId || item.id === productId)
       if (cartItem) {
         try {
-          await api.put(`/cart/update/${cartItem.id}?quantity=${newQuantity}`)
-          await loadCartFromBackend() // Refresh cart
+          await patchCart([{ op: 'set', product_id: cartItem.product_id, quantity: newQuantity }])
         } catch (error) {
           console.error('Error updating quantity in backend cart:', error)
           // Fallback to local update
@@ -159,6 +207,7 @@ export const CartProvider = ({ children }) => {
   }
 
   const clearCart = () => {
+    fromBackend.current = false
     setCartItems([])
     localStorage.removeItem('cart')
   }
@@ -43,7 +43,7 @@ export default function Home() {
   ]
 
   useEffect(() => {
-    api.get('/products/')
+    api.get('/products/', { params: { limit: 8 } })
       .then(res => setProducts(res.data))
       .catch(err => console.error(err))
       .finally(() => setLoading(false))
@@ -78,7 +78,7 @@ export default function Product() {
             {/* Product Image */}
             <div className="aspect-w-1 aspect-h-1 bg-gray-100 rounded-lg overflow-hidden">
               <img 
-                src={product.image ? `http://127.0.0.1:8000${product.image}` : '/placeholder-product.jpg'}
+                src={product.image ? `http://127.0.0.1:8000${product.image_variants?.detail || product.image}` : '/placeholder-product.jpg'}
                 alt={product.name}
                 className="w-full h-48 sm:h-56 lg:h-64 object-contain hover:object-cover transition-all duration-300 cursor-pointer"
                 onError={(e) => {
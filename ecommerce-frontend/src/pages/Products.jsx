@@ -1,22 +1,40 @@
-import React, { useEffect, useState, useContext } from 'react'
+import React, { useEffect, useState, useContext, useRef } from 'react'
 import { useSearchParams } from 'react-router-dom'
 import api from '../api'
 import ProductCard from '../components/ProductCard'
 import { AuthContext } from '../contexts/AuthContext'
 
+const PAGE_SIZE = 24
+const SEARCH_DEBOUNCE_MS = 300
+// UI sort keys -> GET /products/ `sort` values
+const SORT_PARAMS = { name: 'name', 'price-low': 'price_asc', 'price-high': 'price_desc' }
+
 export default function Products() {
   const [products, setProducts] = useState([])
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
+  // Cursor (listing) or skip offset (search) of the next page; null when there is none
+  const [nextPage, setNextPage] = useState(null)
   const [searchParams, setSearchParams] = useSearchParams()
   const searchTerm = searchParams.get('search') || '' // Get search from URL
+  const [debouncedSearch, setDebouncedSearch] = useState(searchTerm)
   const [sortBy, setSortBy] = useState(searchParams.get('sort') || 'name')
   const [filterBy, setFilterBy] = useState(searchParams.get('category') || '')
+  const [inStockOnly, setInStockOnly] = useState(searchParams.get('in_stock') === 'true')
+  const [categories, setCategories] = useState([])
+  // Responses of superseded requests are dropped
+  const requestId = useRef(0)
   
   const { user } = useContext(AuthContext)
 
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedSearch(searchTerm), SEARCH_DEBOUNCE_MS)
+    return () => clearTimeout(timer)
+  }, [searchTerm])
+
   useEffect(() => {
     fetchProducts()
-  }, [])
+  }, [debouncedSearch, sortBy, filterBy, inStockOnly])
 
   useEffect(() => {
     // Update URL params when filters change
@@ -24,44 +42,89 @@ export default function Products() {
     if (searchTerm) params.set('search', searchTerm) // Keep existing search from navbar
     if (sortBy !== 'name') params.set('sort', sortBy)
     if (filterBy) params.set('category', filterBy)
+    if (inStockOnly) params.set('in_stock', 'true')
     setSearchParams(params)
-  }, [sortBy, filterBy, setSearchParams]) // Removed searchTerm from dependency
+  }, [sortBy, filterBy, inStockOnly, setSearchParams]) // Removed searchTerm from dependency
+
+  // One page: filtering, sorting and paging happen on the server. Search is
+  // ranked server-side and has no category/stock filters, so those (and a
+  // chosen sort) apply to the loaded search results below.
+  const fetchPage = async (page) => {
+    if (debouncedSearch) {
+      const skip = page || 0
+      const res = await api.get('/products/search', { params: { q: debouncedSearch, skip, limit: PAGE_SIZE } })
+      return { items: res.data, next: res.data.length === PAGE_SIZE ? skip + PAGE_SIZE : null }
+    }
+    const params = { sort: SORT_PARAMS[sortBy] || 'name', limit: PAGE_SIZE }
+    if (filterBy) params.category = filterBy
+    if (inStockOnly) params.in_stock = true
+    if (page) params.cursor = page
+    const res = await api.get('/products/', { params })
+    return { items: res.data, next: res.headers['x-next-cursor'] || null }
+  }
+
+  const rememberCategories = (items) => {
+    setCategories(prev => [...new Set([...prev, ...items.map(p => p.category).filter(Boolean)])].sort())
+  }
 
   const fetchProducts = async () => {
+    const id = ++requestId.current
     setLoading(true)
     try {
-      const res = await api.get('/products/')
-      setProducts(res.data)
+      const { items, next } = await fetchPage(null)
+      if (id !== requestId.current) return
+      setProducts(items)
+      setNextPage(next)
+      rememberCategories(items)
+    } catch (err) {
+      console.error(err)
+    } finally {
+      if (id === requestId.current) setLoading(false)
+    }
+  }
+
+  const loadMore = async () => {
+    const id = requestId.current
+    setLoadingMore(true)
+    try {
+      const { items, next } = await fetchPage(nextPage)
+      if (id !== requestId.current) return
+      setProducts(prev => [...prev, ...items])
+      setNextPage(next)
+      rememberCategories(items)
     } catch (err) {
       console.error(err)
     } finally {
-      setLoading(false)
+      setLoadingMore(false)
     }
   }
 
-  // Filter and sort products
-  const filteredProducts = products
+  const clearFilters = () => {
+    setFilterBy('')
+    setSortBy('name')
+    setInStockOnly(false)
+    setSearchParams(new URLSearchParams())
+  }
+
+  // Search results only: category/stock filters and an explicit sort
+  const filteredProducts = !debouncedSearch ? products : products
     .filter(product => {
-      const matchesSearch = product.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                          product.description.toLowerCase().includes(searchTerm.toLowerCase())
       const matchesCategory = !filterBy || product.category === filterBy
-      return matchesSearch && matchesCategory
+      const matchesStock = !inStockOnly || product.quantity > 0
+      return matchesCategory && matchesStock
     })
     .sort((a, b) => {
+      // Keep relevance order unless a sort is chosen
       switch (sortBy) {
         case 'price-low':
           return a.price - b.price
         case 'price-high':
           return b.price - a.price
-        case 'name':
         default:
-          return a.name.localeCompare(b.name)
+          return 0
       }
     })
 
-  // Get unique categories
-  const categories = [...new Set(products.map(p => p.category).filter(Boolean))]
-
   return (
     <div className="min-h-screen bg-gray-50 py-8 sm:py-12 lg:py-16">
       <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8">
@@ -81,7 +144,7 @@ export default function Products() {
             {/* Left side - Results count */}
             <div className="flex items-center">
               <h3 className="text-lg lg:text-xl font-medium text-gray-900">
-                {filteredProducts.length} Products Found
+                {filteredProducts.length}{nextPage !== null ? '+' : ''} Products Found
                 {searchTerm && (
                   <span className="text-indigo-600 ml-2">
                     for "{searchTerm}"
@@ -128,18 +191,28 @@ export default function Products() {
                   ))}
                 </select>
               </div>
+
+              {/* Stock Filter */}
+              <div className="flex items-end">
+                <label htmlFor="in-stock" className="flex items-center gap-2 text-sm font-medium text-gray-700 py-2 lg:py-3">
+                  <input
+                    id="in-stock"
+                    type="checkbox"
+                    checked={inStockOnly}
+                    onChange={(e) => setInStockOnly(e.target.checked)}
+                    className="h-4 w-4 text-indigo-600 border-gray-300 rounded focus:ring-indigo-500"
+                  />
+                  In stock only
+                </label>
+              </div>
             </div>
           </div>
 
           {/* Clear Filters */}
-          {(searchTerm || filterBy || sortBy !== 'name') && (
+          {(searchTerm || filterBy || inStockOnly || sortBy !== 'name') && (
             <div className="mt-4 lg:mt-6 pt-4 lg:pt-6 border-t border-gray-200">
               <button
-                onClick={() => {
-                  setSearchTerm('')
-                  setFilterBy('')
-                  setSortBy('name')
-                }}
+                onClick={clearFilters}
                 className="text-indigo-600 hover:text-indigo-800 font-medium lg:text-lg transition-colors duration-200 px-4 py-2 hover:bg-indigo-50 rounded-lg"
               >
                 Clear all filters
@@ -151,7 +224,7 @@ export default function Products() {
         {/* Results */}
         <div className="mb-6 lg:mb-8">
           <p className="text-gray-600 lg:text-lg">
-            {loading ? 'Loading...' : `Showing ${filteredProducts.length} of ${products.length} products`}
+            {loading ? 'Loading...' : `Showing ${filteredProducts.length} products${nextPage !== null ? ' (more available)' : ''}`}
           </p>
         </div>
 
@@ -169,17 +242,14 @@ export default function Products() {
             </div>
             <h3 className="text-xl lg:text-2xl xl:text-3xl font-semibold text-gray-900 mb-2 lg:mb-4">No products found</h3>
             <p className="text-gray-600 lg:text-lg mb-6 lg:mb-8">
-              {searchTerm || filterBy 
+              {searchTerm || filterBy || inStockOnly
                 ? "Try adjusting your search or filter criteria." 
                 : "No products are available at the moment."
               }
             </p>
-            {(searchTerm || filterBy) && (
+            {(searchTerm || filterBy || inStockOnly) && (
               <button
-                onClick={() => {
-                  setSearchTerm('')
-                  setFilterBy('')
-                }}
+                onClick={clearFilters}
                 className="bg-indigo-600 text-white px-6 py-3 lg:px-8 lg:py-4 rounded-lg font-medium lg:text-lg hover:bg-indigo-700 transition-all duration-200 transform hover:scale-105 active:scale-95"
               >
                 View All Products
@@ -196,6 +266,19 @@ export default function Products() {
             ))}
           </div>
         )}
+
+        {/* Next page */}
+        {!loading && nextPage !== null && (
+          <div className="flex justify-center mt-8 lg:mt-12">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-indigo-600 text-white px-6 py-3 lg:px-8 lg:py-4 rounded-lg font-medium lg:text-lg hover:bg-indigo-700 transition-all duration-200 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   )
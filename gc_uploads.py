@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Garbage-collect orphaned product images and print a storage usage report.
+Unreferenced files older than a day are moved to uploads_quarantine/ and
+deleted after a week there. Meant to run from cron, e.g. nightly:
+
+    python gc_uploads.py             # collect
+    python gc_uploads.py --dry-run   # report only
+"""
+
+import argparse
+import json
+from app import database, upload_gc
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would be collected without changing anything")
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        report = upload_gc.collect(db, dry_run=args.dry_run)
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
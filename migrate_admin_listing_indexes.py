@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the (created_at, id) indexes used by the keyset-paginated
+admin order and review listings. Orders placed while orders.created_at had no
+server default get a timestamp: their order history row's, else updated_at,
+else now (rows with NULL keys would never appear in a keyset page). On
+SQLite, timestamps written by CURRENT_TIMESTAMP defaults get the microsecond
+suffix the application writes, so all values compare correctly as text.
+"""
+
+from sqlalchemy import inspect, text
+from app import models, database
+
+INDEXES = {
+    "ix_orders_created", "ix_orders_status_created", "ix_orders_user_created",
+    "ix_reviews_created", "ix_reviews_approved_created",
+}
+
+def migrate_database():
+    if "order_history" in inspect(database.engine).get_table_names():
+        history = "(SELECT order_history.created_at FROM order_history WHERE order_history.order_id = orders.id), "
+    else:
+        history = ""
+    with database.engine.begin() as conn:
+        filled = conn.execute(text(
+            f"UPDATE orders SET created_at = COALESCE({history}updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL"
+        )).rowcount
+    print(f"Filled created_at of {filled} orders")
+
+    if database.engine.dialect.name == "sqlite":
+        with database.engine.begin() as conn:
+            for table in ("orders", "reviews"):
+                conn.execute(text(
+                    f"UPDATE {table} SET created_at = created_at || '.000000' WHERE length(created_at) = 19"
+                ))
+
+    for table in (models.Order.__table__, models.Review.__table__):
+        for index in table.indexes:
+            if index.name in INDEXES:
+                print(f"Ensuring index {index.name} exists...")
+                index.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
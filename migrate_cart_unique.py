@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Migration script to enforce one cart row per (user_id, product_id).
+Existing duplicates are merged into the oldest row (quantities summed)
+before the unique index used by the cart upsert is created.
+"""
+
+from sqlalchemy import text
+from app import models, database
+
+def merge_duplicates(conn):
+    duplicates = conn.execute(text("""
+        SELECT user_id, product_id, MIN(id) AS keep_id, SUM(quantity) AS total
+        FROM cart_items
+        GROUP BY user_id, product_id
+        HAVING COUNT(*) > 1
+    """)).all()
+    for row in duplicates:
+        conn.execute(text("UPDATE cart_items SET quantity = :total WHERE id = :keep_id"),
+                     {"total": row.total, "keep_id": row.keep_id})
+        conn.execute(text("""
+            DELETE FROM cart_items
+            WHERE user_id = :user_id AND product_id = :product_id AND id <> :keep_id
+        """), {"user_id": row.user_id, "product_id": row.product_id, "keep_id": row.keep_id})
+    print(f"Merged duplicate cart rows for {len(duplicates)} (user, product) pairs")
+
+def migrate_database():
+    with database.engine.begin() as conn:
+        merge_duplicates(conn)
+        for index in models.CartItem.__table__.indexes:
+            print(f"Ensuring index {index.name} exists...")
+            index.create(bind=conn, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
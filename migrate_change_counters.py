@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to create the change_counters table used for ETags
+"""
+
+from app import models, database
+
+def migrate_database():
+    """Create the change_counters table if it does not exist"""
+    models.ChangeCounter.__table__.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Migration script to move product images to content-addressed storage.
+Every legacy flat file in uploads/products is renamed to the SHA-256 of its
+bytes under products/ab/cd/, duplicates collapse to one file, and
+Product.image is rewritten to the new URL. Also creates ix_products_image.
+Safe to re-run: files are copied first and the originals deleted only after
+the URL rewrite commits, so an interrupted run is finished by running again;
+files already in content-addressed form are left alone.
+Run after migrate_image_variants.py; variants are re-rendered for moved files.
+"""
+
+import hashlib
+import os
+import shutil
+from sqlalchemy import update
+from app import models, database, images, storage, conditional
+import migrate_image_variants
+
+def create_index():
+    for index in models.Product.__table__.indexes:
+        if index.name == "ix_products_image":
+            print(f"Ensuring index {index.name} exists...")
+            index.create(bind=database.engine, checkfirst=True)
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(storage.CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_legacy_files():
+    """Copy flat files to their content address; returns {old url: new url}.
+
+    The originals stay in place until the URL rewrite has committed, so the
+    mapping can always be rebuilt from the files' hashes by re-running.
+    """
+    moved = {}
+    copied = duplicates = skipped = 0
+    for path in sorted(storage.PRODUCT_IMAGE_DIR.iterdir()):
+        if not path.is_file() or path.name.startswith(".") or storage.CONTENT_NAME_RE.match(path.name):
+            continue
+        with open(path, "rb") as f:
+            extension = storage.detect_image_type(f.read(16))
+        if extension is None:
+            print(f"Skipping {path.name}: not a supported image")
+            skipped += 1
+            continue
+        target = storage.content_path(file_digest(path), extension)
+        if target.exists():
+            duplicates += 1
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            partial = target.with_name(f".{target.name}.partial")
+            shutil.copyfile(path, partial)
+            os.replace(partial, target)
+            copied += 1
+        moved[storage.url_for(path)] = storage.url_for(target)
+    print(f"Copied {copied} images ({duplicates} already stored), skipped {skipped} files")
+    return moved
+
+def rewrite_products(moved):
+    """Point products at the new URLs (both /static/... and legacy /uploads/... forms)"""
+    db = database.SessionLocal()
+    try:
+        updated = 0
+        # Column-level query: runs before later migrations add their Product columns
+        rows = db.query(models.Product.id, models.Product.image).filter(models.Product.image.isnot(None)).all()
+        for product_id, image in rows:
+            path = storage.path_for_url(image)
+            new_url = moved.get(storage.url_for(path)) if path is not None else None
+            if new_url and new_url != image:
+                db.execute(
+                    update(models.Product)
+                    .where(models.Product.id == product_id)
+                    .values(image=new_url, image_variants=images.existing_variants(new_url))
+                    .execution_options(synchronize_session=False)
+                )
+                conditional.bump(db, *conditional.product_scopes(product_id))
+                updated += 1
+        db.commit()
+        print(f"Updated image URLs on {updated} products")
+    finally:
+        db.close()
+
+def remove_legacy_files(moved):
+    """Delete the originals and their variants, once no product refers to them"""
+    removed = 0
+    for old_url in moved:
+        images.remove_variants(old_url)
+        path = storage.path_for_url(old_url)
+        if path is not None and path.exists():
+            path.unlink()
+            removed += 1
+    print(f"Removed {removed} legacy files")
+
+def migrate_database():
+    create_index()
+    storage.PRODUCT_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    moved = copy_legacy_files()
+    rewrite_products(moved)
+    remove_legacy_files(moved)
+    if images.pillow_available():
+        migrate_image_variants.render_missing()
+        migrate_image_variants.attach_to_products()
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the Product.flash_sale flag
+"""
+
+from sqlalchemy import inspect, text
+from app import database
+
+def migrate_database():
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    if "flash_sale" in columns:
+        print("Column flash_sale already exists in products table")
+    else:
+        print("Adding column flash_sale to products table...")
+        with database.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE products ADD COLUMN flash_sale BOOLEAN NOT NULL DEFAULT 0"))
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
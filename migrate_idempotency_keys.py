@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Migration script to create the idempotency_keys table used by
+POST /orders and POST /cart/checkout
+"""
+
+from app import models, database
+
+def migrate_database():
+    """Create the idempotency_keys table if it does not exist"""
+    models.IdempotencyKey.__table__.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration script to add Product.image_variants and backfill resized WebP
+variants for every image already in uploads/products.
+Safe to re-run: images that already have all variants are skipped.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import inspect, text, update
+from app import models, database, images, storage
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+def add_column():
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    if "image_variants" in columns:
+        print("Column image_variants already exists in products table")
+        return
+    print("Adding column image_variants to products table...")
+    with database.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE products ADD COLUMN image_variants JSON"))
+
+def render_missing():
+    """Render variants for source images that do not have them yet"""
+    pending = (
+        path for path in storage.PRODUCT_IMAGE_DIR.rglob("*")
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+        and images.VARIANT_DIR_NAME not in path.parts and not path.name.startswith(".")
+        and images.existing_variants(storage.url_for(path)) is None
+    )
+    rendered = failed = 0
+    with ProcessPoolExecutor(max_workers=images.MAX_WORKERS) as executor:
+        futures = {executor.submit(images.render_variants, str(path)): path for path in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                rendered += 1
+            except Exception as e:
+                failed += 1
+                print(f"Could not render {futures[future].name}: {e}")
+    print(f"Rendered variants for {rendered} images ({failed} failed)")
+
+def attach_to_products():
+    """Record variant URLs on every product whose image has them"""
+    db = database.SessionLocal()
+    try:
+        updated = 0
+        # Column-level query: runs before later migrations add their Product columns
+        rows = db.query(models.Product.id, models.Product.image, models.Product.image_variants).filter(
+            models.Product.image.isnot(None)
+        ).all()
+        for product_id, image, current in rows:
+            variants = images.existing_variants(image)
+            if variants != current:
+                db.execute(
+                    update(models.Product)
+                    .where(models.Product.id == product_id)
+                    .values(image_variants=variants)
+                    .execution_options(synchronize_session=False)
+                )
+                updated += 1
+        db.commit()
+        print(f"Updated image variants on {updated} products")
+    finally:
+        db.close()
+
+def migrate_database():
+    if not images.pillow_available():
+        print("Pillow is not installed: pip install -r requirements.txt")
+        return
+    add_column()
+    storage.PRODUCT_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    render_missing()
+    attach_to_products()
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
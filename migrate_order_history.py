@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the order_history read model and fill it for
+existing orders, then record the uploaded images the history rows show
+(order_history_images). Safe to re-run: only orders without a history row
+are written, and image references already recorded are skipped.
+"""
+
+from app import models, database, order_history
+
+def migrate_database():
+    models.OrderHistory.__table__.create(bind=database.engine, checkfirst=True)
+    models.OrderHistoryImage.__table__.create(bind=database.engine, checkfirst=True)
+    print("Backfilling order history...")
+    db = database.SessionLocal()
+    try:
+        written = order_history.backfill(db)
+        print(f"Wrote {written} order history rows")
+        print("Recording order history image references...")
+        scanned = order_history.backfill_image_references(db)
+        print(f"Scanned {scanned} order history rows")
+    finally:
+        db.close()
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
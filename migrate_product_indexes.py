@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the composite indexes used by the product listing
+"""
+
+from sqlalchemy import inspect
+from app import models, database
+
+def migrate_database():
+    """Create any product indexes declared on the model that are missing"""
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    for index in models.Product.__table__.indexes:
+        missing = [column.name for column in index.columns if column.name not in columns]
+        if missing:
+            print(f"Skipping index {index.name}: run the migration adding {', '.join(missing)} first")
+            continue
+        print(f"Ensuring index {index.name} exists...")
+        index.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Migration script to create (or rebuild) the full-text product search index
+"""
+
+from app import database, search
+
+def migrate_database():
+    """Create the search index if missing, then re-index every product"""
+    search.ensure_index(database.engine)
+    db = database.SessionLocal()
+    try:
+        search.rebuild_index(db)
+    finally:
+        db.close()
+    print("Search index rebuilt successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
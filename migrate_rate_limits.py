@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the rate_limit_buckets table, used when
+app/rate_limit.py runs with BACKEND = "database"
+"""
+
+from app import models, database
+
+def migrate_database():
+    print("Creating rate_limit_buckets table...")
+    models.RateLimitBucket.__table__.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
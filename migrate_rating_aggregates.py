@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Migration script to add denormalized rating aggregates to products.
+Safe to re-run: it also rebuilds the aggregates from the reviews table,
+which repairs any drift.
+"""
+
+from sqlalchemy import inspect, text
+from app import models, database, crud
+
+RATING_COLUMNS = [
+    ("rating_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+    ("rating_avg", "FLOAT NOT NULL DEFAULT 0"),
+] + [(f"rating_{star}", "INTEGER NOT NULL DEFAULT 0") for star in range(1, 6)]
+
+def migrate_database():
+    """Add missing rating columns and index, then rebuild the aggregates"""
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    with database.engine.begin() as conn:
+        for column_name, column_type in RATING_COLUMNS:
+            if column_name not in columns:
+                print(f"Adding column {column_name} to products table...")
+                conn.execute(text(f"ALTER TABLE products ADD COLUMN {column_name} {column_type}"))
+            else:
+                print(f"Column {column_name} already exists in products table")
+
+    for index in models.Product.__table__.indexes:
+        index.create(bind=database.engine, checkfirst=True)
+
+    db = database.SessionLocal()
+    try:
+        updated = crud.rebuild_rating_aggregates(db)
+        print(f"Rebuilt rating aggregates for {updated} products")
+    finally:
+        db.close()
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the refresh_tokens table (rotating refresh tokens)
+"""
+
+from app import models, database
+
+def migrate_database():
+    print("Creating refresh_tokens table...")
+    models.RefreshToken.__table__.create(bind=database.engine, checkfirst=True)
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
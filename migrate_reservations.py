@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Migration script to add inventory reservations: the reservations table and
+Product.reserved_quantity. Safe to re-run: reserved_quantity is recomputed
+from the reservations table, which repairs any drift.
+"""
+
+from sqlalchemy import inspect, text
+from app import models, database
+
+def migrate_database():
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    with database.engine.begin() as conn:
+        if "reserved_quantity" not in columns:
+            print("Adding column reserved_quantity to products table...")
+            conn.execute(text("ALTER TABLE products ADD COLUMN reserved_quantity INTEGER NOT NULL DEFAULT 0"))
+        else:
+            print("Column reserved_quantity already exists in products table")
+
+    models.Reservation.__table__.create(bind=database.engine, checkfirst=True)
+
+    with database.engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE products SET reserved_quantity = COALESCE(
+                (SELECT SUM(quantity) FROM reservations WHERE reservations.product_id = products.id), 0
+            )
+        """))
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
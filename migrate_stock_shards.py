@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Migration script to add sharded stock counters: Product.stock_shard_count,
+the stock_shards table and the product_stock view, which exposes each
+product's total stock on hand (column plus shards) to SQL readers outside
+the application, such as reporting tools.
+"""
+
+from sqlalchemy import inspect, text
+from app import models, database
+
+def migrate_database():
+    columns = {column["name"] for column in inspect(database.engine).get_columns("products")}
+    with database.engine.begin() as conn:
+        if "stock_shard_count" not in columns:
+            print("Adding column stock_shard_count to products table...")
+            conn.execute(text("ALTER TABLE products ADD COLUMN stock_shard_count INTEGER NOT NULL DEFAULT 0"))
+        else:
+            print("Column stock_shard_count already exists in products table")
+
+    models.StockShard.__table__.create(bind=database.engine, checkfirst=True)
+
+    print("Creating view product_stock...")
+    with database.engine.begin() as conn:
+        conn.execute(text("DROP VIEW IF EXISTS product_stock"))
+        conn.execute(text("""
+            CREATE VIEW product_stock AS
+            SELECT products.id AS product_id,
+                   products.quantity + COALESCE(
+                       (SELECT SUM(stock_shards.quantity) FROM stock_shards
+                        WHERE stock_shards.product_id = products.id), 0
+                   ) AS quantity,
+                   products.reserved_quantity AS reserved_quantity
+            FROM products
+        """))
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
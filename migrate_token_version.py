@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Migration script to add User.token_version (access token revocation)
+"""
+
+from sqlalchemy import inspect, text
+from app import database
+
+def migrate_database():
+    columns = {column["name"] for column in inspect(database.engine).get_columns("users")}
+    if "token_version" in columns:
+        print("Column token_version already exists in users table")
+    else:
+        print("Adding column token_version to users table...")
+        with database.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"))
+    print("Migration completed successfully!")
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,89 @@
+# tests/conftest.py
+#
+# The app opens ./ecommerce.db relative to the working directory and serves
+# ./uploads, so the suite runs in a scratch directory with a schema created
+# from the models. Passwords are hashed at the lowest bcrypt cost to keep
+# logins fast.
+
+import os
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix="ecommerce-tests-")
+os.chdir(_workdir)
+
+import itertools
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from app import models, database, auth, passwords, rate_limit, search
+from app.main import app
+
+passwords.BCRYPT_ROUNDS = 4
+models.Base.metadata.create_all(bind=database.engine)
+search.ensure_index(database.engine)
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits():
+    """Every test starts with full buckets"""
+    rate_limit._backend = None
+    yield
+    rate_limit._backend = None
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user; returns (user, auth headers)"""
+    def make(role=models.UserRole.USER, password="secret-password"):
+        name = f"user{next(_names)}"
+        user = models.User(
+            username=name,
+            email=f"{name}@example.com",
+            hashed_password=passwords.hash_password_blocking(password),
+            role=role,
+            is_active=True
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user, {"Authorization": f"Bearer {auth.create_user_token(user)}"}
+    return make
+
+
+@pytest.fixture
+def make_product(db):
+    def make(quantity=10, price=9.99):
+        product = models.Product(name=f"Product {next(_names)}", description="A product", price=price,
+                                 category="Tests", is_active=True)
+        product.quantity = quantity
+        db.add(product)
+        db.commit()
+        db.refresh(product)
+        return product
+    return make
+
+
+@pytest.fixture
+def order_concurrently(client):
+    """Have each of `buyers` (auth headers) order one unit of `product` at once; returns the status codes"""
+    def order(product, buyers):
+        body = {"items": [{"product_id": product.id, "quantity": 1, "price": product.price}],
+                "total_price": product.price}
+        with ThreadPoolExecutor(max_workers=len(buyers)) as pool:
+            return list(pool.map(lambda headers: client.post("/orders/", json=body, headers=headers).status_code, buyers))
+    return order
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from app import models
+
+
+def _fill_cart(client, headers, product_id, quantity):
+    response = client.patch("/cart", json={"operations": [
+        {"op": "set", "product_id": product_id, "quantity": quantity}
+    ]}, headers=headers)
+    assert response.status_code == 200, response.text
+
+
+def test_checkout_takes_stock_and_clears_cart(client, db, make_user, make_product):
+    product = make_product(quantity=5, price=2.5)
+    _, headers = make_user()
+    _fill_cart(client, headers, product.id, 2)
+
+    response = client.post("/cart/checkout", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["total_price"] == 5.0
+    db.expire_all()
+    assert db.get(models.Product, product.id).quantity == 3
+    assert client.get("/cart/summary", headers=headers).json()["item_count"] == 0
+
+
+def test_concurrent_checkouts_do_not_oversell(client, db, make_user, make_product):
+    product = make_product(quantity=3)
+    buyers = [make_user()[1] for _ in range(8)]
+    for headers in buyers:
+        _fill_cart(client, headers, product.id, 1)
+
+    with ThreadPoolExecutor(max_workers=len(buyers)) as pool:
+        statuses = list(pool.map(lambda headers: client.post("/cart/checkout", headers=headers).status_code, buyers))
+
+    assert statuses.count(200) == 3
+    assert statuses.count(409) == len(buyers) - 3
+    db.expire_all()
+    assert db.get(models.Product, product.id).quantity == 0
+    assert db.query(models.OrderItem).filter(models.OrderItem.product_id == product.id).count() == 3
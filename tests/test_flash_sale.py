@@ -0,0 +1,48 @@
+from app import models
+
+
+def _catalog_etag(client):
+    return client.get("/products/").headers["ETag"]
+
+
+def test_flash_sale_orders_do_not_oversell(client, db, make_user, make_product, order_concurrently):
+    product = make_product(quantity=4)
+    _, admin = make_user(role=models.UserRole.ADMIN)
+    response = client.put(f"/admin/products/{product.id}/flash-sale", json={"enabled": True}, headers=admin)
+    assert response.status_code == 200, response.text
+
+    statuses = order_concurrently(product, [make_user()[1] for _ in range(10)])
+
+    assert statuses.count(200) == 4
+    assert statuses.count(409) == 6
+    db.expire_all()
+    assert db.get(models.Product, product.id).quantity == 0
+
+
+def test_stock_change_refreshes_catalog_etag_without_the_products_counter(client, db, make_user, make_product, order_concurrently):
+    product = make_product(quantity=5)
+    _, headers = make_user()
+    before = _catalog_etag(client)
+    products_version = db.get(models.ChangeCounter, "products")
+    products_version = products_version.version if products_version else 0
+
+    statuses = order_concurrently(product, [headers])
+
+    assert statuses == [200]
+    assert _catalog_etag(client) != before
+    db.expire_all()
+    counter = db.get(models.ChangeCounter, "products")
+    assert (counter.version if counter else 0) == products_version
+
+
+def test_product_etag_follows_only_its_own_stock(client, make_user, make_product, order_concurrently):
+    product = make_product(quantity=5)
+    other = make_product(quantity=5)
+    _, headers = make_user()
+    before = client.get(f"/products/{product.id}").headers["ETag"]
+
+    assert order_concurrently(other, [headers]) == [200]
+    assert client.get(f"/products/{product.id}", headers={"If-None-Match": before}).status_code == 304
+
+    assert order_concurrently(product, [headers]) == [200]
+    assert client.get(f"/products/{product.id}").headers["ETag"] != before
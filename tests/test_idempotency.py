@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from app import models, idempotency
+
+
+def _order(product, quantity=1):
+    return {"items": [{"product_id": product.id, "quantity": quantity, "price": product.price}],
+            "total_price": product.price * quantity}
+
+
+def test_retry_with_same_key_replays_the_order(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    user, headers = make_user()
+    keyed = {**headers, "Idempotency-Key": "order-1"}
+
+    first = client.post("/orders/", json=_order(product), headers=keyed)
+    retry = client.post("/orders/", json=_order(product), headers=keyed)
+
+    assert first.status_code == 200, first.text
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+    assert db.query(models.Order).filter(models.Order.user_id == user.id).count() == 1
+    db.expire_all()
+    assert db.get(models.Product, product.id).quantity == 4
+
+
+def test_same_key_with_different_body_is_rejected(client, make_user, make_product):
+    product = make_product(quantity=5)
+    _, headers = make_user()
+    keyed = {**headers, "Idempotency-Key": "order-2"}
+
+    assert client.post("/orders/", json=_order(product), headers=keyed).status_code == 200
+    assert client.post("/orders/", json=_order(product, 2), headers=keyed).status_code == 422
+
+
+def test_failed_request_releases_its_key(client, make_user, make_product):
+    product = make_product(quantity=1)
+    _, headers = make_user()
+    keyed = {**headers, "Idempotency-Key": "order-3"}
+
+    for _ in range(2):
+        response = client.post("/orders/", json=_order(product, 2), headers=keyed)
+        assert response.status_code == 409
+        assert response.json()["detail"].startswith("Insufficient stock")
+
+
+def test_stale_claim_is_taken_over_once(db, make_user):
+    user, _ = make_user()
+    stale = datetime.utcnow() - idempotency.STALE_CLAIM - timedelta(minutes=1)
+    db.add(models.IdempotencyKey(user_id=user.id, scope="test", key="k", fingerprint=idempotency.fingerprint("test", {}),
+                                 completed=False, created_at=stale, expires_at=stale + idempotency.KEY_TTL))
+    db.commit()
+
+    assert idempotency.execute(db, user.id, "test", "k", {}, lambda record: {"run": 1}) == {"run": 1}
+
+    # The abandoned request finishing late cannot release the claim that replaced it
+    idempotency._release(db, user.id, "test", "k", stale)
+    record = idempotency._lookup(db, user.id, "test", "k")
+    assert record.completed and record.response_body == '{"run": 1}'
+
+
+def test_expired_keys_of_all_users_are_swept(db, make_user):
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    for _ in range(3):
+        user, _ = make_user()
+        db.add(models.IdempotencyKey(user_id=user.id, scope="test", key="old", fingerprint="f", completed=True,
+                                     created_at=expired - idempotency.KEY_TTL, expires_at=expired))
+    db.commit()
+
+    assert idempotency.delete_expired(db, batch_size=2) == 3
+    assert db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == "old").count() == 0
+
+
+def test_order_is_rolled_back_when_its_key_cannot_be_completed(client, db, make_user, make_product, monkeypatch):
+    product = make_product(quantity=5)
+    user, headers = make_user()
+    # The claim was taken over as stale while the order was being placed
+    monkeypatch.setattr(idempotency, "_complete", lambda *args: 0)
+
+    response = client.post("/orders/", json=_order(product), headers={**headers, "Idempotency-Key": "lost"})
+
+    assert response.status_code == 409
+    assert db.query(models.Order).filter(models.Order.user_id == user.id).count() == 0
+    db.expire_all()
+    assert db.get(models.Product, product.id).quantity == 5
+
+
+def test_flash_sale_order_is_replayed(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    _, admin = make_user(role=models.UserRole.ADMIN)
+    client.put(f"/admin/products/{product.id}/flash-sale", json={"enabled": True}, headers=admin)
+    user, headers = make_user()
+    keyed = {**headers, "Idempotency-Key": "flash-1"}
+
+    first = client.post("/orders/", json=_order(product), headers=keyed)
+    retry = client.post("/orders/", json=_order(product), headers=keyed)
+
+    assert first.status_code == 200, first.text
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+    assert db.query(models.Order).filter(models.Order.user_id == user.id).count() == 1
+
+
+def test_expired_key_is_not_replayed(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    user, headers = make_user()
+    keyed = {**headers, "Idempotency-Key": "order-4"}
+    first = client.post("/orders/", json=_order(product), headers=keyed)
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.user_id == user.id).update(
+        {"expires_at": datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.commit()
+
+    again = client.post("/orders/", json=_order(product), headers=keyed)
+
+    assert again.status_code == 200
+    assert "Idempotent-Replayed" not in again.headers
+    assert again.json()["id"] != first.json()["id"]
@@ -0,0 +1,50 @@
+import io
+from PIL import Image
+from app import crud, database, images, models
+
+
+def _upload(client, color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, format="PNG")
+    response = client.post("/uploads/product-image/", files={"file": ("p.png", buffer.getvalue(), "image/png")})
+    assert response.status_code == 200, response.text
+    return response.json()["url"]
+
+
+def test_rendering_is_queued_once_the_product_commits(client, db, make_product, monkeypatch):
+    queued = []
+    monkeypatch.setattr(images, "schedule", lambda url: queued.append(url) or True)
+    url = _upload(client, "orange")
+    queued.clear()
+    product = make_product()
+    seen = []
+
+    def schedule(image_url):
+        check = database.SessionLocal()
+        try:
+            seen.append(check.get(models.Product, product.id).image)
+        finally:
+            check.close()
+        return True
+
+    monkeypatch.setattr(images, "schedule", schedule)
+    crud.update_product_image(db, product.id, url)
+
+    assert seen == [url]
+
+
+def test_variants_rendered_before_the_commit_are_recorded(client, db, make_product, monkeypatch):
+    monkeypatch.setattr(images, "schedule", lambda url: True)
+    url = _upload(client, "purple")
+    product = make_product()
+    # The upload's job finishes while the product write is in flight
+    monkeypatch.setattr(images, "existing_variants", lambda image_url: None)
+    db.get(models.Product, product.id).image = url
+    images.attach_variants(db, db.get(models.Product, product.id))
+    images.render_variants(str(images.storage.path_for_url(url)))
+    monkeypatch.undo()
+    db.commit()
+
+    db.expire_all()
+    assert db.get(models.Product, product.id).image_variants == images.existing_variants(url)
+    assert db.get(models.Product, product.id).image_variants is not None
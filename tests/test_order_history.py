@@ -0,0 +1,46 @@
+import io
+from PIL import Image
+from app import storage, upload_gc
+
+
+def _upload_image(client) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "green").save(buffer, format="PNG")
+    response = client.post("/uploads/product-image/", files={"file": ("item.png", buffer.getvalue(), "image/png")})
+    assert response.status_code == 200, response.text
+    return response.json()["url"]
+
+
+def test_history_keeps_the_image_it_shows(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    product.image = _upload_image(client)
+    db.commit()
+    url = product.image
+    _, headers = make_user()
+    order = {"items": [{"product_id": product.id, "quantity": 1, "price": product.price}],
+             "total_price": product.price}
+    assert client.post("/orders/", json=order, headers=headers).status_code == 200
+
+    # The product moves on to another image; the past order still shows this one
+    product.image = None
+    db.commit()
+
+    history = client.get("/orders/history", headers=headers).json()
+    assert history[0]["order_items"][0]["product"]["image"] == url
+    assert storage.reference_count(db, url) == 1
+    path = storage.path_for_url(url)
+    assert upload_gc._referenced(db, [path]) == {path}
+
+
+def test_order_list_keeps_its_response_shape(client, make_user, make_product):
+    product = make_product(quantity=5)
+    user, headers = make_user()
+    order = {"items": [{"product_id": product.id, "quantity": 2, "price": product.price}],
+             "total_price": 2 * product.price}
+    placed = client.post("/orders/", json=order, headers=headers).json()
+
+    orders = client.get("/orders/", headers=headers).json()
+
+    assert [o["id"] for o in orders] == [placed["id"]]
+    assert orders[0]["user"]["id"] == user.id
+    assert orders[0]["order_items"][0]["product"]["name"] == product.name
@@ -0,0 +1,23 @@
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from app import passwords
+
+
+def _crash():
+    os._exit(1)
+
+
+def test_pool_is_replaced_after_a_worker_dies():
+    hashed = passwords.hash_password_blocking("secret")
+    with pytest.raises(BrokenProcessPool):
+        passwords._submit(_crash).result()
+
+    assert passwords.verify_blocking("secret", hashed)
+
+
+def test_wrong_password_and_malformed_hash_fail():
+    hashed = passwords.hash_password_blocking("secret")
+
+    assert not passwords.verify_blocking("guess", hashed)
+    assert not passwords.verify_blocking("secret", "not-a-bcrypt-hash")
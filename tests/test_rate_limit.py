@@ -0,0 +1,65 @@
+from app import rate_limit
+
+
+def _checkout_capacity():
+    checkout = next(group for group in rate_limit.ROUTE_GROUPS if group.name == "checkout")
+    return checkout.limits[0].capacity
+
+
+def test_exhausted_bucket_answers_429_with_retry_after(client, make_user, make_product):
+    product = make_product(quantity=100, price=1.0)
+    _, headers = make_user()
+    order = {"items": [{"product_id": product.id, "quantity": 1, "price": 1.0}], "total_price": 1.0}
+    capacity = _checkout_capacity()
+
+    statuses = [client.post("/orders/", json=order, headers=headers).status_code for _ in range(capacity)]
+    limited = client.post("/orders/", json=order, headers=headers)
+
+    assert statuses == [200] * capacity
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+
+
+def test_other_users_keep_their_own_bucket(client, make_user, make_product):
+    product = make_product(quantity=100, price=1.0)
+    _, heavy = make_user()
+    _, light = make_user()
+    order = {"items": [{"product_id": product.id, "quantity": 1, "price": 1.0}], "total_price": 1.0}
+    statuses = [client.post("/orders/", json=order, headers=heavy).status_code for _ in range(_checkout_capacity() + 1)]
+    assert statuses[-1] == 429
+
+    assert client.post("/orders/", json=order, headers=light).status_code == 200
+
+
+def test_failed_logins_back_off_per_account(client, make_user):
+    user, _ = make_user()
+    for _ in range(rate_limit.LOGIN_FREE_FAILURES + 1):
+        response = client.post("/auth/login", data={"username": user.username, "password": "wrong"})
+        assert response.status_code == 401
+
+    blocked = client.post("/auth/login", data={"username": user.username, "password": "secret-password"})
+
+    assert blocked.status_code == 429
+    assert int(blocked.headers["Retry-After"]) >= 1
+
+
+def test_successful_logins_are_not_charged_to_the_account(client, make_user):
+    user, _ = make_user()
+    for _ in range(rate_limit.LOGIN_ACCOUNT_LIMIT.capacity + 2):
+        response = client.post("/auth/login", data={"username": user.username, "password": "secret-password"})
+        assert response.status_code == 200, response.text
+
+
+def test_failures_from_one_client_do_not_lock_out_another(client, make_user, monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUST_FORWARDED_FOR", True)
+    user, _ = make_user()
+    attacker = {"X-Forwarded-For": "203.0.113.7"}
+    for _ in range(rate_limit.LOGIN_ACCOUNT_LIMIT.capacity):
+        client.post("/auth/login", data={"username": user.username, "password": "wrong"}, headers=attacker)
+    assert client.post("/auth/login", data={"username": user.username, "password": "wrong"},
+                       headers=attacker).status_code == 429
+
+    owner = client.post("/auth/login", data={"username": user.username, "password": "secret-password"},
+                        headers={"X-Forwarded-For": "198.51.100.2"})
+
+    assert owner.status_code == 200, owner.text
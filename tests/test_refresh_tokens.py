@@ -0,0 +1,82 @@
+import threading
+import time
+from app import models, refresh_tokens
+
+
+def _login(client, user, password="secret-password"):
+    response = client.post("/auth/login", data={"username": user.username, "password": password})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _bearer(tokens):
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+
+def test_refresh_rotates_the_token(client, make_user):
+    user, _ = make_user()
+    tokens = _login(client, user)
+
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert client.get("/auth/me", headers=_bearer(rotated)).json()["id"] == user.id
+
+
+def test_reusing_a_rotated_token_revokes_the_family(client, db, make_user):
+    user, _ = make_user()
+    tokens = _login(client, user)
+    rotated = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).json()
+
+    # A stolen copy of the old token is presented again
+    reuse = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+
+    assert reuse.status_code == 401
+    assert client.post("/auth/refresh", json={"refresh_token": rotated["refresh_token"]}).status_code == 401
+    assert client.get("/auth/me", headers=_bearer(rotated)).status_code == 401
+    live = db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user.id, models.RefreshToken.revoked_at.is_(None)
+    ).count()
+    assert live == 0
+
+
+def test_other_logins_survive_a_revoked_family(client, make_user):
+    user, _ = make_user()
+    stolen = _login(client, user)
+    other = _login(client, user)
+    client.post("/auth/refresh", json={"refresh_token": stolen["refresh_token"]})
+    client.post("/auth/refresh", json={"refresh_token": stolen["refresh_token"]})
+
+    assert client.get("/auth/me", headers=_bearer(other)).status_code == 200
+    assert client.post("/auth/refresh", json={"refresh_token": other["refresh_token"]}).status_code == 200
+
+
+def test_logout_revokes_the_access_token(client, make_user):
+    user, _ = make_user()
+    tokens = _login(client, user)
+
+    assert client.post("/auth/logout", json={"refresh_token": tokens["refresh_token"]}).status_code == 200
+    assert client.get("/auth/me", headers=_bearer(tokens)).status_code == 401
+
+
+def test_stale_filter_is_rebuilt_by_one_thread(db, monkeypatch):
+    rebuild = refresh_tokens.rebuild
+    calls = []
+
+    def slow_rebuild(session):
+        calls.append(1)
+        time.sleep(0.1)
+        rebuild(session)
+
+    refresh_tokens._ensure_fresh()
+    monkeypatch.setattr(refresh_tokens, "rebuild", slow_rebuild)
+    monkeypatch.setattr(refresh_tokens, "_loaded_at", time.monotonic() - refresh_tokens.REFRESH_SECONDS - 1)
+    threads = [threading.Thread(target=refresh_tokens.is_family_revoked, args=(db, "unknown")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from app import models, inventory
+
+
+def _reserve(client, headers, product_id, quantity):
+    client.patch("/cart", json={"operations": [
+        {"op": "set", "product_id": product_id, "quantity": quantity}
+    ]}, headers=headers)
+    return client.post("/cart/reserve", headers=headers)
+
+
+def test_held_stock_is_not_available_to_others(client, db, make_user, make_product):
+    product = make_product(quantity=2)
+    _, holder = make_user()
+    _, other = make_user()
+
+    assert _reserve(client, holder, product.id, 2).status_code == 200
+    assert _reserve(client, other, product.id, 1).status_code == 409
+
+    # The holder's checkout is covered by the hold
+    assert client.post("/cart/checkout", headers=holder).status_code == 200
+    db.expire_all()
+    product = db.get(models.Product, product.id)
+    assert (product.quantity, product.reserved_quantity) == (0, 0)
+
+
+def test_expired_holds_are_released(client, db, make_user, make_product):
+    product = make_product(quantity=2)
+    user, headers = make_user()
+    assert _reserve(client, headers, product.id, 2).status_code == 200
+    db.query(models.Reservation).filter(models.Reservation.user_id == user.id).update(
+        {"expires_at": datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.commit()
+
+    assert inventory.release_expired(db) >= 1
+    db.expire_all()
+    assert db.get(models.Product, product.id).reserved_quantity == 0
+    assert inventory.get_holds(db, user.id) == []
+
+
+def _hold(db, user_id, product_id):
+    db.expire_all()
+    return {hold.product_id: hold.quantity for hold in inventory.get_holds(db, user_id)}.get(product_id, 0)
+
+
+def test_lowering_or_removing_a_line_gives_back_held_stock(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    user, headers = make_user()
+    assert _reserve(client, headers, product.id, 4).status_code == 200
+
+    line_id = client.get("/cart/", headers=headers).json()[0]["id"]
+    assert client.put(f"/cart/update/{line_id}", params={"quantity": 3}, headers=headers).status_code == 200
+    assert _hold(db, user.id, product.id) == 3
+
+    client.patch("/cart", json={"operations": [{"op": "set", "product_id": product.id, "quantity": 1}]}, headers=headers)
+    assert _hold(db, user.id, product.id) == 1
+    # Raising the line again does not grow the hold
+    client.patch("/cart", json={"operations": [{"op": "add", "product_id": product.id, "quantity": 2}]}, headers=headers)
+    assert _hold(db, user.id, product.id) == 1
+
+    assert client.delete(f"/cart/remove/{line_id}", headers=headers).status_code == 200
+    assert _hold(db, user.id, product.id) == 0
+    assert db.get(models.Product, product.id).reserved_quantity == 0
+
+
+def test_cart_lines_of_other_users_cannot_be_touched(client, db, make_user, make_product):
+    product = make_product(quantity=5)
+    owner, owner_headers = make_user()
+    _, other = make_user()
+    assert _reserve(client, owner_headers, product.id, 2).status_code == 200
+    line_id = client.get("/cart/", headers=owner_headers).json()[0]["id"]
+
+    assert client.delete(f"/cart/remove/{line_id}", headers=other).status_code == 404
+    assert client.put(f"/cart/update/{line_id}", params={"quantity": 1}, headers=other).status_code == 404
+    assert _hold(db, owner.id, product.id) == 2
+    assert client.get("/cart/", headers=owner_headers).json()[0]["quantity"] == 2
@@ -0,0 +1,22 @@
+def _review(client, headers, product_id, rating=5):
+    response = client.post("/reviews/", json={"product_id": product_id, "rating": rating, "title": "Nice",
+                                              "comment": "Works"}, headers=headers)
+    assert response.status_code == 200, response.text
+
+
+def test_review_etags_ignore_other_products(client, make_user, make_product):
+    product = make_product()
+    other = make_product()
+    _, headers = make_user()
+    urls = [f"/reviews/product/{product.id}", f"/reviews/product/{product.id}/summary"]
+    etags = [client.get(url).headers["ETag"] for url in urls]
+
+    _review(client, headers, other.id)
+
+    for url, etag in zip(urls, etags):
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    _review(client, headers, product.id)
+
+    for url, etag in zip(urls, etags):
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
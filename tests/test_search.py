@@ -0,0 +1,18 @@
+from app import search
+
+
+def test_highlights_escape_product_text(client, db, make_product):
+    product = make_product()
+    product.name = 'Gadget <img src=x onerror=alert(1)> & "friends"'
+    product.description = "A <b>gadget</b> for everyone"
+    search.index_product(db, product)
+    db.commit()
+
+    response = client.get("/products/search", params={"q": "gadget"})
+
+    assert response.status_code == 200, response.text
+    hit = next(hit for hit in response.json() if hit["id"] == product.id)
+    assert hit["name_highlight"] == (
+        '<mark>Gadget</mark> &lt;img src=x onerror=alert(1)&gt; &amp; &quot;friends&quot;'
+    )
+    assert hit["snippet"] == "A &lt;b&gt;<mark>gadget</mark>&lt;/b&gt; for everyone"
@@ -0,0 +1,62 @@
+import io
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from app import models, storage
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "purple").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_sharded_stock_sells_out_exactly(client, db, make_user, make_product, order_concurrently):
+    product = make_product(quantity=6)
+    _, admin = make_user(role=models.UserRole.ADMIN)
+    response = client.put(f"/admin/products/{product.id}/stock-shards", json={"shards": 4}, headers=admin)
+    assert response.status_code == 200, response.text
+    assert response.json()["quantity"] == 6
+
+    statuses = order_concurrently(product, [make_user()[1] for _ in range(10)])
+
+    assert statuses.count(200) == 6
+    assert statuses.count(409) == 4
+    layout = client.get(f"/admin/products/{product.id}/stock-shards", headers=admin).json()
+    assert layout["quantity"] == 0
+    assert all(shard["quantity"] == 0 for shard in layout["shards"])
+
+
+def test_image_change_keeps_stock_sold_during_the_upload(client, db, make_user, make_product, monkeypatch):
+    product = make_product(quantity=5)
+    _, buyer = make_user()
+    save_image_upload = storage.save_image_upload
+
+    async def slow_upload(file, *args):
+        # A sale lands while the upload is still being stored
+        order = {"items": [{"product_id": product.id, "quantity": 2, "price": product.price}],
+                 "total_price": product.price * 2}
+        assert await run_in_threadpool(client.post, "/orders/", json=order, headers=buyer)
+        return await save_image_upload(file, *args)
+
+    monkeypatch.setattr(storage, "save_image_upload", slow_upload)
+    response = client.put(f"/products/{product.id}/image", files={"image": ("p.png", _png(), "image/png")})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["quantity"] == 3
+
+
+def test_product_edit_without_a_stock_change_keeps_the_shards(client, db, make_user, make_product, order_concurrently):
+    product = make_product(quantity=8)
+    _, admin = make_user(role=models.UserRole.ADMIN)
+    client.put(f"/admin/products/{product.id}/stock-shards", json={"shards": 4}, headers=admin)
+    # Leave the shards uneven, so any redistribution would show
+    assert order_concurrently(product, [make_user()[1] for _ in range(3)]) == [200] * 3
+    before = client.get(f"/admin/products/{product.id}/stock-shards", headers=admin).json()["shards"]
+
+    response = client.put(f"/products/{product.id}", json={
+        "name": "Renamed", "description": product.description, "price": product.price,
+        "quantity": 5, "category": product.category
+    })
+
+    assert response.status_code == 200, response.text
+    assert client.get(f"/admin/products/{product.id}/stock-shards", headers=admin).json()["shards"] == before
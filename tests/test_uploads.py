@@ -0,0 +1,58 @@
+import hashlib
+import io
+from PIL import Image
+from app import storage
+
+URL = "/uploads/product-image/"
+BOUNDARY = "test-boundary"
+
+
+def _png(color="red") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _multipart_chunks(size: int, chunk_size: int = 256 * 1024):
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.png\"\r\n"
+           "Content-Type: image/png\r\n\r\n").encode()
+    yield _png()
+    for _ in range(size // chunk_size):
+        yield b"\0" * chunk_size
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_image_is_stored_by_content_hash(client):
+    data = _png("blue")
+
+    response = client.post(URL, files={"file": ("photo.png", data, "image/png")})
+
+    assert response.status_code == 200, response.text
+    path = storage.content_path(hashlib.sha256(data).hexdigest(), ".png")
+    assert response.json()["url"] == storage.url_for(path)
+    assert path.read_bytes() == data
+
+
+def test_non_image_is_rejected(client):
+    response = client.post(URL, files={"file": ("notes.png", b"just some text", "image/png")})
+
+    assert response.status_code == 400
+
+
+def test_declared_oversized_body_is_refused_before_reading(client):
+    data = _png() + b"\0" * (storage.MAX_UPLOAD_BYTES + 128 * 1024)
+
+    response = client.post(URL, files={"file": ("big.png", data, "image/png")})
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+
+
+def test_chunked_oversized_body_is_aborted_with_413(client):
+    response = client.post(
+        URL,
+        content=_multipart_chunks(storage.MAX_UPLOAD_BYTES + 512 * 1024),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+    )
+
+    assert response.status_code == 413